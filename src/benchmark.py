@@ -0,0 +1,307 @@
+import io
+import itertools
+import json
+import os
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import albumentations as A
+import hydra
+import numpy as np
+import rootutils
+import torch
+from albumentations.pytorch.transforms import ToTensorV2
+from lightning import LightningDataModule
+from omegaconf import DictConfig, OmegaConf
+from torch.utils.data import DataLoader, Dataset, IterableDataset, Subset
+from torch.utils.data._utils.collate import default_collate
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+# ------------------------------------------------------------------------------------ #
+# the setup_root above is equivalent to:
+# - adding project root dir to PYTHONPATH
+#       (so you don't need to force user to install project as a package)
+#       (necessary before importing any local modules e.g. `from src import utils`)
+# - setting up PROJECT_ROOT environment variable
+#       (which is used as a base for paths in "configs/paths/default.yaml")
+#       (this way all filepaths are the same no matter where you run the code)
+# - loading environment variables from ".env" in root dir
+#
+# you can remove it if you:
+# 1. either install project as a package or move entry files to project root dir
+# 2. set `root_dir` to "." in "configs/paths/default.yaml"
+#
+# more info: https://github.com/ashleve/rootutils
+# ------------------------------------------------------------------------------------ #
+
+from src.data.components.decode import open_reduced
+from src.utils import RankedLogger, extras, task_wrapper
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+
+def _timed(stats: Dict[str, List[float]], stage: str, fn: Callable, *args, **kwargs) -> Any:
+    start = time.perf_counter()
+    out = fn(*args, **kwargs)
+    stats.setdefault(stage, []).append(time.perf_counter() - start)
+    return out
+
+
+def _source(dataset: Dataset, index: int) -> Tuple[Dataset, int]:
+    """Follow `TransformDLIB.data` / `Subset` wrappers down to the raw dataset and its index."""
+    while True:
+        if isinstance(dataset, Subset):
+            dataset, index = dataset.dataset, dataset.indices[index]
+        elif hasattr(dataset, "apply") and hasattr(dataset, "data"):
+            dataset = dataset.data
+        else:
+            return dataset, index
+
+
+def _split_transform(transform: A.Compose) -> Tuple[A.Compose, A.Compose]:
+    """Split a `TransformDLIB` transform into augmentations and a `Normalize`/`ToTensorV2` tail."""
+    keypoint_params = (
+        transform.processors["keypoints"].params if "keypoints" in transform.processors else None
+    )
+    tail_types = (A.Normalize, ToTensorV2)
+    augment = [t for t in transform.transforms if not isinstance(t, tail_types)]
+    tail = [t for t in transform.transforms if isinstance(t, tail_types)]
+    return (
+        A.Compose(augment, keypoint_params=keypoint_params),
+        A.Compose(tail, keypoint_params=keypoint_params),
+    )
+
+
+def _copy(tensor: torch.Tensor, device: torch.device, non_blocking: bool = False) -> torch.Tensor:
+    out = tensor.to(device, non_blocking=non_blocking)
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+    return out
+
+
+def _summary(seconds: List[float], items: int = 1) -> Dict[str, float]:
+    seconds = np.asarray(seconds)
+    return {
+        "mean_ms": float(seconds.mean() * 1e3),
+        "p50_ms": float(np.percentile(seconds, 50) * 1e3),
+        "p95_ms": float(np.percentile(seconds, 95) * 1e3),
+        "samples_per_sec": (
+            float(items * len(seconds) / seconds.sum()) if seconds.sum() > 0 else float("inf")
+        ),
+    }
+
+
+def benchmark_stages(
+    loader: DataLoader,
+    device: torch.device,
+    num_samples: int = 200,
+    batch_size: int = 64,
+    seed: int = 0,
+) -> Dict[str, Dict[str, float]]:
+    """Time every stage of the per-sample pipeline in the main process.
+
+    DLIB / DLIB_LPA samples are split into `read` (file or archive bytes), `decode`, `crop`,
+    `augmentation` and `normalization`; other datasets (MNIST, crop caches, shards) are timed as a
+    single `load` stage. `collate` and `h2d` (host-to-device copy, pageable and pinned) are timed
+    on full batches.
+    """
+    dataset = loader.dataset
+    collate_fn = loader.collate_fn or default_collate
+    stats: Dict[str, List[float]] = {}
+    rng = np.random.default_rng(seed)
+
+    samples = []
+    augment, tail = (
+        _split_transform(dataset.transform) if hasattr(dataset, "apply") else (None, None)
+    )
+    if isinstance(dataset, IterableDataset):
+        iterator = iter(dataset)
+        for _ in range(num_samples):
+            samples.append(_timed(stats, "load", next, iterator))
+    else:
+        for index in rng.integers(0, len(dataset), size=num_samples):
+            raw, raw_index = _source(dataset, int(index))
+            if not (hasattr(raw, "open_image") and hasattr(dataset, "apply")):
+                samples.append(_timed(stats, "load", dataset.__getitem__, int(index)))
+                continue
+            labels = raw.img_labels
+            roi_box = labels.roi_boxes[raw_index]
+            file_name = labels.file_name(raw_index)
+
+            def read(raw=raw, file_name=file_name):
+                # `open_image` already reads archive members, so it is part of the stage
+                source = raw.open_image(file_name)
+                if isinstance(source, io.BytesIO):
+                    return source
+                with open(source, "rb") as file:
+                    return io.BytesIO(file.read())
+
+            data = _timed(stats, "read", read)
+            image, factor = _timed(
+                stats, "decode", open_reduced, data, roi_box, getattr(raw, "decode_size", None)
+            )
+            area = tuple(float(v) / factor for v in roi_box)
+            image = _timed(stats, "crop", lambda: np.array(image.crop(area)))
+            keypoints = (labels.landmarks[raw_index] - roi_box[:2]).astype(np.float32) / factor
+
+            out = _timed(stats, "augmentation", augment, image=image, keypoints=keypoints)
+            out = _timed(
+                stats, "normalization", tail, image=out["image"], keypoints=out["keypoints"]
+            )
+            landmark = (
+                np.asarray(out["keypoints"], dtype=np.float32)
+                / np.array([out["image"].shape[2], out["image"].shape[1]], dtype=np.float32)
+                - 0.5
+            )
+            samples.append((out["image"], landmark))
+
+    batches = [samples[i : i + batch_size] for i in range(0, len(samples), batch_size)]
+    collated = [_timed(stats, "collate", collate_fn, batch) for batch in batches]
+    if device.type != "cpu":
+        for batch in collated:
+            images = batch[0]
+            _timed(stats, "h2d", _copy, images, device)
+            _timed(stats, "h2d_pinned", _copy, images.pin_memory(), device, non_blocking=True)
+
+    report = {}
+    for stage, seconds in stats.items():
+        items = batch_size if stage in ("collate", "h2d", "h2d_pinned") else 1
+        report[stage] = _summary(seconds, items)
+    return report
+
+
+def benchmark_loader(
+    loader: DataLoader,
+    device: torch.device,
+    num_batches: int = 50,
+    warmup_batches: int = 5,
+    epochs: int = 2,
+    **loader_kwargs: Any,
+) -> Dict[str, Any]:
+    """Measure end-to-end samples/sec of a DataLoader rebuilt from `loader` with `loader_kwargs`.
+
+    Every epoch restarts the iterator, so `first_batch_s` shows the worker start-up cost that
+    `persistent_workers` saves. Batches are copied to `device` as in training.
+    """
+    shuffle = not isinstance(loader.dataset, IterableDataset)
+    bench_loader = DataLoader(
+        loader.dataset, shuffle=shuffle, collate_fn=loader.collate_fn, **loader_kwargs
+    )
+    first_batch, throughput = [], []
+    for _ in range(epochs):
+        start = time.perf_counter()
+        samples, measured_start = 0, start if warmup_batches == 0 else None
+        for index, batch in enumerate(bench_loader):
+            images = _copy(batch[0], device, non_blocking=loader_kwargs.get("pin_memory", False))
+            if index == 0:
+                first_batch.append(time.perf_counter() - start)
+            if index < warmup_batches:
+                if index == warmup_batches - 1:
+                    measured_start = time.perf_counter()
+                continue
+            samples += images.shape[0]
+            if index + 1 >= warmup_batches + num_batches:
+                break
+        elapsed = time.perf_counter() - measured_start if measured_start is not None else 0.0
+        throughput.append(samples / elapsed if elapsed > 0 else 0.0)
+    del bench_loader
+    return {
+        "samples_per_sec": float(np.mean(throughput)),
+        "samples_per_sec_per_epoch": [float(t) for t in throughput],
+        "first_batch_s": [float(t) for t in first_batch],
+    }
+
+
+def sweep_configs(sweep: DictConfig) -> List[Dict[str, Any]]:
+    """Cartesian product of the swept DataLoader fields, without the ones DataLoader rejects."""
+    configs = []
+    fields = ("num_workers", "batch_size", "pin_memory", "persistent_workers", "prefetch_factor")
+    for values in itertools.product(*(sweep[field] for field in fields)):
+        num_workers, batch_size, pin_memory, persistent_workers, prefetch_factor = values
+        config = {"num_workers": num_workers, "batch_size": batch_size, "pin_memory": pin_memory}
+        if num_workers > 0:
+            config.update(persistent_workers=persistent_workers, prefetch_factor=prefetch_factor)
+        if config not in configs:
+            configs.append(config)
+    return configs
+
+
+@task_wrapper
+def benchmark(cfg: DictConfig) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Benchmarks the training DataLoader of the configured datamodule.
+
+    Writes `benchmark.json` to the output dir with the per-stage timings and the throughput of
+    every swept DataLoader configuration, best first.
+
+    :param cfg: DictConfig configuration composed by Hydra.
+    :return: Tuple[dict, dict] with the report and dict with all instantiated objects.
+    """
+    log.info(f"Instantiating datamodule <{cfg.data._target_}>")
+    datamodule: LightningDataModule = hydra.utils.instantiate(cfg.data)
+    datamodule.prepare_data()
+    datamodule.setup(stage="fit")
+    loader = datamodule.train_dataloader()
+
+    device = torch.device(
+        cfg.device if cfg.device != "cuda" or torch.cuda.is_available() else "cpu"
+    )
+    report: Dict[str, Any] = {
+        "data": OmegaConf.to_container(cfg.data, resolve=True),
+        "device": str(device),
+        "cpu_count": os.cpu_count(),
+    }
+
+    log.info("Timing pipeline stages...")
+    report["stages"] = benchmark_stages(
+        loader, device, num_samples=cfg.stages.num_samples, batch_size=loader.batch_size or 1
+    )
+    for stage, result in report["stages"].items():
+        log.info(
+            f"{stage:>14}: {result['mean_ms']:8.3f} ms  "
+            f"{result['samples_per_sec']:10.1f} samples/s"
+        )
+
+    results = []
+    for config in sweep_configs(cfg.sweep):
+        result = benchmark_loader(
+            loader,
+            device,
+            num_batches=cfg.sweep.num_batches,
+            warmup_batches=cfg.sweep.warmup_batches,
+            epochs=cfg.sweep.epochs,
+            **config,
+        )
+        log.info(
+            f"{config}: {result['samples_per_sec']:.1f} samples/s, "
+            f"first batch {result['first_batch_s']}"
+        )
+        results.append({**config, **result})
+    report["sweep"] = sorted(results, key=lambda r: r["samples_per_sec"], reverse=True)
+    if report["sweep"]:
+        log.info(f"Best DataLoader config: {report['sweep'][0]}")
+
+    report_path = os.path.join(cfg.paths.output_dir, "benchmark.json")
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=2)
+    log.info(f"Report saved to {report_path}")
+
+    object_dict = {"cfg": cfg, "datamodule": datamodule}
+    return report, object_dict
+
+
+@hydra.main(version_base="1.3", config_path="../configs", config_name="benchmark.yaml")
+def main(cfg: DictConfig) -> Optional[float]:
+    """Main entry point for the data pipeline benchmark.
+
+    :param cfg: DictConfig configuration composed by Hydra.
+    """
+    extras(cfg)
+
+    report, _ = benchmark(cfg)
+
+    # best throughput, so the benchmark can drive hydra sweeps as well
+    return report["sweep"][0]["samples_per_sec"] if report["sweep"] else None
+
+
+if __name__ == "__main__":
+    main()
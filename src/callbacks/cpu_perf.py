@@ -0,0 +1,119 @@
+import time
+from typing import Any, List, Optional, Tuple
+
+import lightning as L
+from lightning.pytorch.callbacks import Callback
+from lightning.pytorch.trainer import Trainer
+
+from src.utils import RankedLogger
+from src.utils.cpu_perf import (
+    compare_throughput,
+    partition_cores,
+    pin_compute_threads,
+    restore_compute_threads,
+)
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+
+class CPUPerformance(Callback):
+    """Split the CPU cores between compute threads and DataLoader workers, report throughput.
+
+    At `setup`, every thread of the main process is pinned to the cores `partition_cores` leaves to
+    the compute threads, with one intra-op thread per core, until `teardown` restores the previous
+    affinity, e.g. for the next job of a Hydra multirun. Pair it with
+    `src.utils.cpu_perf.WorkerAffinity` as the `worker_init_fn` of the datamodule, with the same
+    `num_workers` and `cores_per_worker`, so the workers run on the other cores.
+
+    At the start of training, the forward and backward throughput of the network in the module's
+    `channels_last`/`bf16_autocast` mode is compared to the fp32 contiguous baseline on
+    `benchmark_steps` random batches and logged as `perf/baseline_samples_per_sec`,
+    `perf/samples_per_sec` and `perf/speedup`. The measured training throughput of every epoch is
+    logged as `perf/train_samples_per_sec`.
+    """
+
+    def __init__(
+        self,
+        num_workers: int = 0,
+        cores_per_worker: int = 1,
+        pin_threads: bool = True,
+        benchmark_steps: int = 10,
+        input_size: int = 224,
+    ) -> None:
+        """
+        :param num_workers: Number of DataLoader workers the cores are shared with.
+        :param cores_per_worker: Physical cores reserved for every worker.
+        :param pin_threads: Pin the main process to its compute cores.
+        :param benchmark_steps: Steps of the throughput comparison at the start of training, 0 to
+            skip it.
+        :param input_size: Side of the random square images of the comparison.
+        """
+        super().__init__()
+        self.partition = partition_cores(num_workers, cores_per_worker)
+        self.pin_threads = pin_threads
+        self.benchmark_steps = benchmark_steps
+        self.input_size = input_size
+
+        self.samples = 0
+        self.start: Optional[float] = None
+        self.previous: Optional[Tuple[List[int], int]] = None
+
+    def setup(self, trainer: Trainer, pl_module: L.LightningModule, stage: str) -> None:
+        if stage != "fit" or not self.pin_threads:
+            return
+        self.previous = pin_compute_threads(self.partition.compute)
+        log.info(
+            f"Compute threads on CPUs {self.partition.compute}, "
+            f"DataLoader workers on {self.partition.workers}"
+        )
+
+    def teardown(self, trainer: Trainer, pl_module: L.LightningModule, stage: str) -> None:
+        if self.previous is not None:
+            restore_compute_threads(*self.previous)
+            self.previous = None
+
+    def on_train_start(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        if self.benchmark_steps <= 0 or not trainer.is_global_zero:
+            return
+        if pl_module.device.type != "cpu":
+            return
+        channels_last = pl_module.hparams.get("channels_last", False)
+        bf16_autocast = getattr(pl_module, "bf16_autocast", False)
+        datamodule = trainer.datamodule
+        batch_size = datamodule.hparams.get("batch_size", 8) if datamodule is not None else 8
+        results = compare_throughput(
+            pl_module.net,
+            (batch_size, 3, self.input_size, self.input_size),
+            channels_last=channels_last,
+            bf16_autocast=bf16_autocast,
+            steps=self.benchmark_steps,
+        )
+        metrics = {f"perf/{name}": value for name, value in results.items()}
+        for logger in trainer.loggers:
+            logger.log_metrics(metrics, step=trainer.global_step)
+        log.info(
+            f"Throughput with channels_last={channels_last}, bf16_autocast={bf16_autocast}: "
+            f"{results['samples_per_sec']:.1f} samples/s, "
+            f"fp32 baseline {results['baseline_samples_per_sec']:.1f} samples/s, "
+            f"speed-up {results['speedup']:.2f}x"
+        )
+
+    def on_train_epoch_start(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        self.samples = 0
+        self.start = time.perf_counter()
+
+    def on_train_batch_end(
+        self,
+        trainer: Trainer,
+        pl_module: L.LightningModule,
+        outputs: Any,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        self.samples += len(batch[0])
+
+    def on_train_epoch_end(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        if self.start is None or not self.samples:
+            return
+        throughput = self.samples / (time.perf_counter() - self.start)
+        pl_module.log("perf/train_samples_per_sec", throughput, rank_zero_only=True)
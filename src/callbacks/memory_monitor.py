@@ -0,0 +1,186 @@
+from typing import Any, Dict, Iterable, List, Optional
+
+import lightning as L
+import psutil
+from lightning.pytorch.callbacks import Callback
+from lightning.pytorch.trainer import Trainer
+from torch.utils.data import DataLoader
+
+from src.utils import RankedLogger
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+MB = 1024**2
+
+
+def process_stats(process: psutil.Process) -> Optional[Dict[str, float]]:
+    """RSS, USS and shared memory in MB, thread count and open file handles of a process."""
+    try:
+        with process.oneshot():
+            info = process.memory_full_info()
+            handles = process.num_fds() if hasattr(process, "num_fds") else process.num_handles()
+            return {
+                "rss": info.rss / MB,
+                "uss": info.uss / MB,
+                "shared": getattr(info, "shared", 0) / MB,
+                "threads": process.num_threads(),
+                "files": handles,
+            }
+    except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
+        # workers can exit between listing and reading them
+        return None
+
+
+def _dataloaders(dataloaders: Any) -> List[DataLoader]:
+    if isinstance(dataloaders, DataLoader):
+        return [dataloaders]
+    if isinstance(dataloaders, dict):
+        dataloaders = list(dataloaders.values())
+    if isinstance(dataloaders, (list, tuple)):
+        return [loader for item in dataloaders for loader in _dataloaders(item)]
+    return []
+
+
+def dataloader_workers(trainer: Trainer) -> Optional[List[int]]:
+    """PIDs of the live worker processes of the train and val DataLoaders being iterated.
+
+    :return: The PIDs, or `None` when the DataLoaders use workers but none of their iterators can
+        be found, e.g. because a Lightning release moved them. All child processes are sampled
+        then.
+    """
+    loaders = _dataloaders(trainer.train_dataloader) + _dataloaders(trainer.val_dataloaders)
+    if not any(loader.num_workers for loader in loaders):
+        return []
+    # persistent workers keep their iterator on the DataLoader
+    iterators = [getattr(loader, "_iterator", None) for loader in loaders]
+    # otherwise only the data fetchers of the loops hold it, which is private Lightning state
+    for loop in (trainer.fit_loop, getattr(trainer.fit_loop.epoch_loop, "val_loop", None)):
+        fetcher = getattr(loop, "_data_fetcher", None)
+        # CombinedLoader -> its iterator -> one DataLoader iterator per dataloader
+        combined = getattr(getattr(fetcher, "iterator", None), "_iterator", None)
+        iterators += list(getattr(combined, "iterators", []))
+    iterators = [iterator for iterator in iterators if hasattr(iterator, "_workers")]
+    if not iterators:
+        return None
+    workers = {worker.pid: worker for iterator in iterators for worker in iterator._workers}
+    return [pid for pid, worker in workers.items() if worker.is_alive()]
+
+
+def sample(worker_pids: Optional[Iterable[int]] = None) -> Dict[str, float]:
+    """Memory of the main process and of the DataLoader workers, summed and of the largest one.
+
+    :param worker_pids: PIDs of the DataLoader workers, `None` for all child processes.
+    """
+    main = psutil.Process()
+    stats = process_stats(main)
+    if worker_pids is None:
+        processes = main.children(recursive=True)
+    else:
+        processes = []
+        for pid in worker_pids:
+            try:
+                processes.append(psutil.Process(pid))
+            except psutil.NoSuchProcess:
+                continue
+    workers = [s for s in (process_stats(process) for process in processes) if s is not None]
+    result = {
+        "main_rss_mb": stats["rss"],
+        "main_uss_mb": stats["uss"],
+        "main_shared_mb": stats["shared"],
+        "workers": len(workers),
+        "workers_rss_mb": sum(w["rss"] for w in workers),
+        "workers_uss_mb": sum(w["uss"] for w in workers),
+        # a per-worker copy of the dataset shows up in the largest worker, not only in the sum
+        "workers_uss_max_mb": max((w["uss"] for w in workers), default=0.0),
+        "workers_shared_mb": sum(w["shared"] for w in workers),
+        "threads": stats["threads"] + sum(w["threads"] for w in workers),
+        "open_files": stats["files"] + sum(w["files"] for w in workers),
+    }
+    # USS is memory private to a process, so it adds up without counting shared pages twice
+    result["total_uss_mb"] = result["main_uss_mb"] + result["workers_uss_mb"]
+    return result
+
+
+class MemoryMonitor(Callback):
+    """Sample the memory of the training process and its DataLoader workers with `psutil`.
+
+    Every `interval` training steps, the RSS, USS and shared memory of the main process, the sum
+    over the train and val DataLoader workers and the USS of the largest worker, the total thread
+    count and the open file handles are sampled. Other child processes, e.g. compile workers or a
+    logger service, are not counted, unless the DataLoader iterators cannot be found, then all
+    child processes are. At the end of every training epoch, the epoch peak of each
+    value is logged as `memory/<name>_peak` and the change of the total USS over the epoch as
+    `memory/total_uss_trend_mb`. When the peak total USS grew by more than `tolerance_mb` in each
+    of the last `patience` epochs, a warning is logged, or `RuntimeError` raised with
+    `raise_on_growth`.
+
+    Every rank samples its own processes, only the values of rank zero are logged.
+    """
+
+    def __init__(
+        self,
+        interval: int = 50,
+        patience: int = 3,
+        tolerance_mb: float = 16.0,
+        raise_on_growth: bool = False,
+    ) -> None:
+        """
+        :param interval: Sample every this many training steps.
+        :param patience: Number of consecutive growing epochs before alerting.
+        :param tolerance_mb: Growth of the peak total USS per epoch that is not counted.
+        :param raise_on_growth: Raise instead of warning.
+        """
+        super().__init__()
+        self.interval = interval
+        self.patience = patience
+        self.tolerance_mb = tolerance_mb
+        self.raise_on_growth = raise_on_growth
+
+        self.samples: List[Dict[str, float]] = []
+        self.peaks: List[float] = []
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {"peaks": self.peaks}
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        self.peaks = list(state_dict.get("peaks", []))
+
+    def on_train_epoch_start(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        self.samples = [sample(dataloader_workers(trainer))]
+
+    def on_train_batch_end(
+        self,
+        trainer: Trainer,
+        pl_module: L.LightningModule,
+        outputs: Any,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        if (batch_idx + 1) % self.interval == 0:
+            self.samples.append(sample(dataloader_workers(trainer)))
+
+    def on_train_epoch_end(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        self.samples.append(sample(dataloader_workers(trainer)))
+        peaks = {name: max(s[name] for s in self.samples) for name in self.samples[-1]}
+        metrics = {f"memory/{name}_peak": value for name, value in peaks.items()}
+        metrics["memory/total_uss_trend_mb"] = (
+            self.samples[-1]["total_uss_mb"] - self.samples[0]["total_uss_mb"]
+        )
+        pl_module.log_dict(metrics, rank_zero_only=True)
+        self.check_growth(peaks["total_uss_mb"], trainer.current_epoch)
+        self.samples = []
+
+    def check_growth(self, peak: float, epoch: int) -> None:
+        """Alert when the peak total USS grew in each of the last `patience` epochs."""
+        self.peaks.append(peak)
+        recent = self.peaks[-(self.patience + 1) :]
+        if len(recent) <= self.patience:
+            return
+        if all(after - before > self.tolerance_mb for before, after in zip(recent, recent[1:])):
+            message = (
+                f"Memory grew in each of the last {self.patience} epochs, peak total USS "
+                f"{' -> '.join(f'{value:.0f}' for value in recent)} MB at epoch {epoch}"
+            )
+            if self.raise_on_growth:
+                raise RuntimeError(message)
+            log.warning(message)
@@ -0,0 +1,146 @@
+import time
+from typing import Any, Dict, List, Optional, Sequence, Union
+
+import cv2
+import lightning as L
+import numpy as np
+import torch
+from lightning.pytorch.callbacks import Callback
+from lightning.pytorch.trainer import Trainer
+
+from src.utils import RankedLogger
+from src.utils.landmark_render import IMG_MEAN, IMG_STD, PRED_COLOR, draw_points
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+
+def detect_faces(image: np.ndarray, detector_backend: str = "ssd") -> List[Dict[str, int]]:
+    """Face boxes `{x, y, w, h}` of an RGB image, found by DeepFace."""
+    from deepface import DeepFace
+
+    # DeepFace expects BGR arrays, like `cv2.imread`
+    faces = DeepFace.extract_faces(
+        img_path=image[:, :, ::-1], detector_backend=detector_backend, enforce_detection=False
+    )
+    return [{key: int(face["facial_area"][key]) for key in ("x", "y", "w", "h")} for face in faces]
+
+
+class ProbeSetCallback(Callback):
+    """Predict the landmarks of the faces of a few fixed probe images every `every_n_epochs`.
+
+    The probe images are read, their faces detected and the crops resized to `input_size` once, at
+    `setup`, and kept as one uint8 batch. At the end of a training epoch, all probe faces go
+    through a single forward pass in eval mode, the keypoints are mapped back to the probe images,
+    and the annotated images are logged with the trainer's loggers that have a `log_image` method.
+    The forward time is logged as `probe/forward_ms` and `probe/ms_per_face`.
+    """
+
+    def __init__(
+        self,
+        img_paths: Union[str, Sequence[str]],
+        every_n_epochs: int = 1,
+        input_size: int = 224,
+        detector_backend: str = "ssd",
+        boxes: Optional[Sequence[Sequence[Dict[str, int]]]] = None,
+        log_key: str = "Predicted Image",
+    ) -> None:
+        """
+        :param img_paths: Probe image paths.
+        :param every_n_epochs: Run every this many training epochs.
+        :param input_size: Side of the square crops fed to the model.
+        :param detector_backend: DeepFace detector used to find the faces.
+        :param boxes: Optional face boxes `{x, y, w, h}` of every image, skipping the detection.
+        :param log_key: Key of the annotated images in the loggers.
+        """
+        super().__init__()
+        self.img_paths = [img_paths] if isinstance(img_paths, str) else list(img_paths)
+        self.every_n_epochs = every_n_epochs
+        self.input_size = input_size
+        self.detector_backend = detector_backend
+        self.boxes = [list(image_boxes) for image_boxes in boxes] if boxes is not None else None
+        self.log_key = log_key
+
+        self.images: List[np.ndarray] = []
+        self.faces: List[Dict[str, int]] = []
+        self.batch: Optional[torch.Tensor] = None
+
+    def setup(self, trainer: Trainer, pl_module: L.LightningModule, stage: str) -> None:
+        if self.batch is not None or not trainer.is_global_zero:
+            return
+        crops = []
+        for index, path in enumerate(self.img_paths):
+            image = cv2.cvtColor(cv2.imread(path), cv2.COLOR_BGR2RGB)
+            if self.boxes is not None:
+                boxes = self.boxes[index]
+            else:
+                boxes = detect_faces(image, self.detector_backend)
+            for box in boxes:
+                x, y = max(box["x"], 0), max(box["y"], 0)
+                bottom, right = box["y"] + box["h"], box["x"] + box["w"]
+                crop = image[y:bottom, x:right]
+                if crop.size == 0:
+                    continue
+                size = (self.input_size, self.input_size)
+                crops.append(cv2.resize(crop, size, interpolation=cv2.INTER_AREA))
+                self.faces.append(
+                    {"image": index, "x": x, "y": y, "w": crop.shape[1], "h": crop.shape[0]}
+                )
+            self.images.append(image)
+        if not crops:
+            log.warning(f"No faces found in the probe images {self.img_paths}")
+            return
+        self.batch = torch.from_numpy(np.stack(crops)).permute(0, 3, 1, 2).contiguous()
+        log.info(f"Cached {len(crops)} probe faces from {len(self.img_paths)} images")
+
+    def normalize(self, pl_module: L.LightningModule, batch: torch.Tensor) -> torch.Tensor:
+        if hasattr(pl_module, "normalize"):
+            return pl_module.normalize(batch)
+        mean = batch.new_tensor(IMG_MEAN, dtype=torch.float32).view(1, 3, 1, 1)
+        std = batch.new_tensor(IMG_STD, dtype=torch.float32).view(1, 3, 1, 1)
+        return (batch.float() / 255 - mean) / std
+
+    @torch.no_grad()
+    def predict(self, pl_module: L.LightningModule) -> torch.Tensor:
+        """(N, K, 2) keypoints of every probe face, in probe image pixels."""
+        batch = self.batch.to(pl_module.device, non_blocking=True)
+        training = pl_module.training
+        pl_module.eval()
+        if pl_module.device.type == "cuda":
+            torch.cuda.synchronize(pl_module.device)
+        start = time.perf_counter()
+        preds = pl_module(self.normalize(pl_module, batch)).float()
+        if pl_module.device.type == "cuda":
+            torch.cuda.synchronize(pl_module.device)
+        elapsed = (time.perf_counter() - start) * 1000
+        pl_module.train(training)
+
+        pl_module.log("probe/forward_ms", elapsed, rank_zero_only=True)
+        pl_module.log("probe/ms_per_face", elapsed / len(batch), rank_zero_only=True)
+
+        # keypoints are in [-0.5, 0.5] of the crop
+        sizes = torch.tensor([[face["w"], face["h"]] for face in self.faces], dtype=torch.float32)
+        origins = torch.tensor(
+            [[face["x"], face["y"]] for face in self.faces], dtype=torch.float32
+        )
+        return (preds.cpu() + 0.5) * sizes[:, None] + origins[:, None]
+
+    def annotate(self, keypoints: torch.Tensor) -> List[np.ndarray]:
+        images = [image.copy() for image in self.images]
+        for face, points in zip(self.faces, keypoints):
+            image = images[face["image"]]
+            x, y, w, h = face["x"], face["y"], face["w"], face["h"]
+            cv2.rectangle(image, (x, y), (x + w, y + h), (0, 255, 0))
+            radius = max(min(image.shape[:2]) // 200, 1)
+            tensor = torch.from_numpy(image).permute(2, 0, 1)[None]
+            draw_points(tensor, points[None], PRED_COLOR, radius)
+        return images
+
+    def on_train_epoch_end(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        if self.batch is None or not trainer.is_global_zero:
+            return
+        if (trainer.current_epoch + 1) % self.every_n_epochs != 0:
+            return
+        images = self.annotate(self.predict(pl_module))
+        for logger in trainer.loggers:
+            if hasattr(logger, "log_image"):
+                logger.log_image(key=self.log_key, images=images, step=trainer.global_step)
@@ -0,0 +1,257 @@
+import copy
+import os
+from typing import Any, Dict, Optional
+
+import lightning as L
+import torch
+from lightning.pytorch.callbacks import Callback
+from lightning.pytorch.trainer import Trainer
+from torch import Tensor, nn
+
+from src.models.components.channel_pruning import (
+    ChannelGraph,
+    l1_importance,
+    prune_group,
+    select_channels,
+    taylor_importance,
+    trace_channels,
+)
+from src.models.components.quantization import latency_ms as forward_latency_ms
+from src.utils import RankedLogger
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+
+class ChannelPruning(Callback):
+    """Structured channel pruning of the network toward a MACs or CPU latency budget.
+
+    Every `interval` epochs from `start_epoch`, at the end of the training epoch, the channels of
+    the network are ranked and the least important ones removed, until the network fits the budget
+    of the step. Over `num_steps` steps the budget shrinks geometrically from the original network
+    to `flops_ratio` of its MACs, or to `latency_ms` per face measured on CPU, with the epochs
+    between steps fine-tuning the pruned network. Channels tied by residual additions or
+    squeeze-excitation are pruned together (see `trace_channels`).
+
+    Importance is the L1 norm of the filters (`l1`) or the squared first-order Taylor term of the
+    loss accumulated over the training batches since the last step (`taylor`).
+
+    The layers are rebuilt with fewer channels, not masked, so the pruned network is smaller and
+    faster as is. Checkpoints hold the pruned shapes and load into the full architecture through
+    `DLIBLitModule.on_load_checkpoint`; at the end of fit, the pruned network itself is saved with
+    `torch.save` to `save_path`, by default `pruned_net.pt` next to the checkpoints.
+
+    Logs `pruning/macs`, `pruning/macs_ratio`, `pruning/params` and `pruning/latency_ms` at every
+    step. Best checkpoints monitored on a validation metric usually come from before the last step,
+    use `last.ckpt` or the saved network.
+
+    Only single-process training is supported. Under DDP and the other multi-process strategies,
+    the wrapper keeps the parameters it registered at setup, so the gradients of the rebuilt layers
+    would no longer be averaged across ranks; `setup` raises instead.
+    """
+
+    def __init__(
+        self,
+        target: str = "flops",
+        flops_ratio: float = 0.5,
+        latency_ms: Optional[float] = None,
+        importance: str = "l1",
+        start_epoch: int = 1,
+        num_steps: int = 4,
+        interval: int = 1,
+        min_channels: int = 8,
+        min_ratio: float = 0.1,
+        input_size: int = 224,
+        latency_steps: int = 20,
+        save_path: Optional[str] = None,
+    ) -> None:
+        """
+        :param target: `flops` for a MACs budget, `latency` for a measured CPU latency budget.
+        :param flops_ratio: MACs of the pruned network relative to the original one.
+        :param latency_ms: CPU latency budget of a forward pass of one face, in ms.
+        :param importance: Channel importance, `l1` or `taylor`.
+        :param start_epoch: Epoch of the first pruning step.
+        :param num_steps: Number of pruning steps.
+        :param interval: Epochs between pruning steps, fine-tuning the pruned network.
+        :param min_channels: Channels kept at least in every group.
+        :param min_ratio: Fraction of the channels of every group kept at least.
+        :param input_size: Side of the square inputs to trace and time the network with.
+        :param latency_steps: Timed forward passes per latency measurement.
+        :param save_path: Where to save the pruned network, `None` for next to the checkpoints.
+        """
+        super().__init__()
+        if target not in ("flops", "latency"):
+            raise ValueError(f"Unknown target {target}, expected flops or latency")
+        if target == "latency" and latency_ms is None:
+            raise ValueError("The latency target needs latency_ms")
+        if importance not in ("l1", "taylor"):
+            raise ValueError(f"Unknown importance {importance}, expected l1 or taylor")
+        self.target = target
+        self.flops_ratio = flops_ratio
+        self.latency_ms = latency_ms
+        self.importance = importance
+        self.start_epoch = start_epoch
+        self.num_steps = num_steps
+        self.interval = interval
+        self.min_channels = min_channels
+        self.min_ratio = min_ratio
+        self.input_size = input_size
+        self.latency_steps = latency_steps
+        self.save_path = save_path
+
+        self.steps_done = 0
+        self.base_macs: Optional[float] = None
+        self.base_latency: Optional[float] = None
+        self.graph: Optional[ChannelGraph] = None
+        self.scores: Dict[int, Tensor] = {}
+
+    def state_dict(self) -> Dict[str, Any]:
+        return {
+            "steps_done": self.steps_done,
+            "base_macs": self.base_macs,
+            "base_latency": self.base_latency,
+        }
+
+    def load_state_dict(self, state_dict: Dict[str, Any]) -> None:
+        self.steps_done = state_dict.get("steps_done", 0)
+        self.base_macs = state_dict.get("base_macs")
+        self.base_latency = state_dict.get("base_latency")
+
+    def trace(self, net: nn.Module) -> ChannelGraph:
+        device = next(net.parameters()).device
+        example = torch.randn(1, 3, self.input_size, self.input_size, device=device)
+        # eval mode, so tracing does not update the BN statistics
+        training = net.training
+        net.eval()
+        with torch.no_grad():
+            graph = trace_channels(net, example)
+        net.train(training)
+        return graph
+
+    def measure(self, net: nn.Module) -> float:
+        """CPU latency of a forward pass of one face, in ms."""
+        example = torch.randn(1, 3, self.input_size, self.input_size)
+        return forward_latency_ms(
+            copy.deepcopy(net).cpu().eval(), example, steps=self.latency_steps
+        )
+
+    def setup(self, trainer: Trainer, pl_module: L.LightningModule, stage: str) -> None:
+        if stage == "fit" and trainer.world_size > 1:
+            raise RuntimeError(
+                f"ChannelPruning rebuilds layers during fit, which {type(trainer.strategy).__name__}"
+                f" with {trainer.world_size} processes does not follow, train on a single device"
+            )
+
+    def on_train_start(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        if self.base_macs is None:
+            self.base_macs = self.trace(pl_module.net).macs()
+        if self.target == "latency" and self.base_latency is None:
+            self.base_latency = trainer.strategy.broadcast(self.measure(pl_module.net))
+        log.info(
+            f"Pruning from {self.base_macs / 1e6:.1f}M MACs"
+            + (f", {self.base_latency:.2f} ms on CPU" if self.base_latency is not None else "")
+        )
+
+    def on_after_backward(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        if self.importance != "taylor" or self.steps_done >= self.num_steps:
+            return
+        if self.graph is None:
+            self.graph = self.trace(pl_module.net)
+        for index, group in enumerate(self.graph.groups):
+            if group.prunable:
+                score = taylor_importance(group)
+                self.scores[index] = self.scores[index] + score if index in self.scores else score
+
+    def on_train_epoch_end(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        epoch = trainer.current_epoch
+        if (
+            self.steps_done >= self.num_steps
+            or epoch < self.start_epoch
+            or (epoch - self.start_epoch) % self.interval
+        ):
+            return
+        self.prune(trainer, pl_module)
+
+    def prune_to(
+        self, graph: ChannelGraph, target_macs: float, replaced: Dict[nn.Parameter, nn.Parameter]
+    ) -> None:
+        scores = {}
+        for index, group in enumerate(graph.groups):
+            if not group.prunable:
+                continue
+            if self.importance == "taylor" and index in self.scores:
+                scores[index] = self.scores[index]
+            else:
+                scores[index] = l1_importance(group)
+        keep = select_channels(graph, scores, target_macs, self.min_channels, self.min_ratio)
+        for index, channels in keep.items():
+            for old, new in prune_group(graph.groups[index], channels).items():
+                # a parameter pruned along both dimensions is replaced twice
+                origin = next((first for first, last in replaced.items() if last is old), old)
+                replaced[origin] = new
+        # the accumulated scores are of the channels before this pruning
+        self.scores = {}
+
+    def prune(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        net = pl_module.net
+        graph = self.graph if self.graph is not None else self.trace(net)
+        progress = (self.steps_done + 1) / self.num_steps
+        replaced: Dict[nn.Parameter, nn.Parameter] = {}
+        if self.target == "flops":
+            self.prune_to(graph, self.base_macs * self.flops_ratio**progress, replaced)
+        else:
+            budget = self.base_latency * (self.latency_ms / self.base_latency) ** progress
+            # latency is roughly proportional to MACs, re-measured to correct the estimate
+            previous = None
+            for _ in range(3):
+                current = trainer.strategy.broadcast(self.measure(net))
+                if current <= budget:
+                    break
+                if previous is not None and current > 0.95 * previous:
+                    # fixed per-layer overheads dominate, fewer channels don't help anymore
+                    log.warning(
+                        f"Pruning no longer lowers the latency of {current:.2f} ms, "
+                        f"budget {budget:.2f} ms"
+                    )
+                    break
+                self.prune_to(graph, graph.macs() * budget / current, replaced)
+                previous = current
+
+        # the optimizers train the new parameters, the moments of the old ones no longer match
+        for optimizer in trainer.optimizers:
+            for param_group in optimizer.param_groups:
+                param_group["params"] = [
+                    replaced.get(param, param) for param in param_group["params"]
+                ]
+            for param in replaced:
+                optimizer.state.pop(param, None)
+
+        self.steps_done += 1
+        self.graph = None
+        macs = graph.macs()
+        metrics = {
+            "pruning/macs": macs / 1e6,
+            "pruning/macs_ratio": macs / self.base_macs,
+            "pruning/params": sum(p.numel() for p in net.parameters()) / 1e6,
+            "pruning/latency_ms": self.measure(net),
+        }
+        pl_module.log_dict(metrics, rank_zero_only=True)
+        log.info(
+            f"Pruning step {self.steps_done}/{self.num_steps}: "
+            f"{metrics['pruning/macs']:.1f}M MACs ({metrics['pruning/macs_ratio']:.0%}), "
+            f"{metrics['pruning/params']:.2f}M params, "
+            f"{metrics['pruning/latency_ms']:.2f} ms on CPU"
+        )
+
+    def on_fit_end(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        if not self.steps_done or not trainer.is_global_zero:
+            return
+        path = self.save_path
+        if path is None:
+            checkpoint = trainer.checkpoint_callback
+            dirpath = trainer.default_root_dir
+            if checkpoint is not None and checkpoint.dirpath:
+                dirpath = checkpoint.dirpath
+            path = os.path.join(dirpath, "pruned_net.pt")
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        torch.save(pl_module.net, path)
+        log.info(f"Pruned network saved to {path}")
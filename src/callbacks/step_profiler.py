@@ -0,0 +1,231 @@
+import functools
+import json
+import os
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+import lightning as L
+import numpy as np
+import torch
+from lightning.pytorch.callbacks import Callback
+from lightning.pytorch.trainer import Trainer
+from torchmetrics import Metric
+
+from src.utils import RankedLogger
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+PHASES = (
+    "data_wait",
+    "h2d",
+    "forward",
+    "loss",
+    "backward",
+    "optimizer",
+    "metrics",
+    "logging",
+    "other",
+)
+
+
+class StepPhaseProfiler(Callback):
+    """Wall time of every training step, split into phases, summarized per epoch.
+
+    The phases come from callback hooks and from thin timing wrappers installed at `setup`:
+        - `data_wait`: from the end of the previous step to the start of the device transfer
+        - `h2d`: `strategy.batch_to_device`, including the module's batch transfer hooks
+        - `forward`: `pl_module.forward`
+        - `loss`: the forward of the `pl_module.<loss_attr>` module
+        - `metrics`: `update` of every torchmetrics child of the module (and `update_residual`)
+        - `logging`: `pl_module.log` and `pl_module.log_dict`
+        - `backward`: `on_before_backward` to `on_after_backward`
+        - `optimizer`: `on_before_optimizer_step` to the end of the step
+        - `other`: the rest of the step, like `zero_grad` and hooks
+
+    At the end of every training epoch, p50/p95/p99 of each phase and of the whole step are logged
+    as `profile/<phase>_p50_ms` etc., with `profile/data_wait_fraction` of the total step time.
+    CUDA work is asynchronous, so phase boundaries only measure launch time unless `sync_cuda`.
+    With `trace_path`, the first `trace_steps` steps are written as a Chrome trace
+    (chrome://tracing).
+    """
+
+    def __init__(
+        self,
+        sync_cuda: bool = False,
+        loss_attr: str = "criterion",
+        trace_path: Optional[str] = None,
+        trace_steps: int = 200,
+    ) -> None:
+        """
+        :param sync_cuda: Synchronize CUDA at every phase boundary, exact but slower.
+        :param loss_attr: Attribute of the module holding the loss `nn.Module`.
+        :param trace_path: Where to write the Chrome trace JSON, `None` to skip it.
+        :param trace_steps: Number of steps kept in the trace.
+        """
+        super().__init__()
+        self.sync_cuda = sync_cuda
+        self.loss_attr = loss_attr
+        self.trace_path = trace_path
+        self.trace_steps = trace_steps
+
+        self.steps: List[Dict[str, float]] = []
+        self.current: Dict[str, float] = defaultdict(float)
+        self.marks: Dict[str, float] = {}
+        self.events: List[Dict[str, Any]] = []
+        self.traced = 0
+        self.origin = time.perf_counter()
+        self.active = False
+        self._restore: List[Tuple[Any, str, Any]] = []
+        self._depth: Dict[str, int] = defaultdict(int)
+        self._cuda = False
+
+    def _now(self) -> float:
+        if self._cuda:
+            torch.cuda.synchronize()
+        return time.perf_counter()
+
+    def _record(self, phase: str, start: float, end: float) -> None:
+        self.current[phase] += end - start
+        self.marks.setdefault(f"{phase}_start", start)
+        if self.trace_path is not None and self.traced < self.trace_steps:
+            timing = {"ts": (start - self.origin) * 1e6, "dur": (end - start) * 1e6}
+            self.events.append({"name": phase, "ph": "X", "pid": 0, "tid": 0, **timing})
+
+    def _wrap(self, owner: Any, name: str, phase: str) -> None:
+        """Time the outermost calls of `owner.<name>` as `phase` during training batches."""
+        original = getattr(owner, name)
+
+        @functools.wraps(original)
+        def timed(*args: Any, **kwargs: Any) -> Any:
+            if not self.active or self._depth[phase]:
+                return original(*args, **kwargs)
+            self._depth[phase] += 1
+            start = self._now()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self._record(phase, start, self._now())
+                self._depth[phase] -= 1
+
+        self._restore.append((owner, name, owner.__dict__.get(name)))
+        setattr(owner, name, timed)
+
+    def setup(self, trainer: Trainer, pl_module: L.LightningModule, stage: str) -> None:
+        if stage != "fit" or self._restore:
+            return
+        self._cuda = self.sync_cuda and torch.cuda.is_available()
+        self._wrap(trainer.strategy, "batch_to_device", "h2d")
+        self._wrap(pl_module, "forward", "forward")
+        self._wrap(pl_module, "log", "logging")
+        self._wrap(pl_module, "log_dict", "logging")
+        loss = getattr(pl_module, self.loss_attr, None)
+        if isinstance(loss, torch.nn.Module):
+            self._wrap(loss, "forward", "loss")
+        for module in pl_module.modules():
+            if isinstance(module, Metric):
+                self._wrap(module, "update", "metrics")
+                if hasattr(module, "update_residual"):
+                    self._wrap(module, "update_residual", "metrics")
+
+    def teardown(self, trainer: Trainer, pl_module: L.LightningModule, stage: str) -> None:
+        for owner, name, original in reversed(self._restore):
+            if original is None:
+                delattr(owner, name)
+            else:
+                setattr(owner, name, original)
+        self._restore = []
+        self.write_trace()
+
+    def on_train_epoch_start(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        self.steps = []
+        self.current = defaultdict(float)
+        self.marks = {"step_end": self._now()}
+        self.active = True
+
+    def on_validation_start(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        self.active = False
+
+    def on_validation_end(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        # validation inside a training epoch is not data wait of the next step
+        if "step_end" in self.marks:
+            self.marks["step_end"] = self._now()
+            self.active = True
+
+    def on_train_batch_start(
+        self, trainer: Trainer, pl_module: L.LightningModule, batch: Any, batch_idx: int
+    ) -> None:
+        now = self._now()
+        # the device transfer runs between fetching the batch and this hook
+        start = self.marks.get("step_end", now)
+        self._record("data_wait", start, self.marks.get("h2d_start", now))
+        self.marks["step_start"] = start
+
+    def on_before_backward(
+        self, trainer: Trainer, pl_module: L.LightningModule, loss: torch.Tensor
+    ) -> None:
+        self.marks["backward"] = self._now()
+
+    def on_after_backward(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        if "backward" in self.marks:
+            self._record("backward", self.marks.pop("backward"), self._now())
+
+    def on_before_optimizer_step(
+        self, trainer: Trainer, pl_module: L.LightningModule, optimizer: Any
+    ) -> None:
+        self.marks["optimizer"] = self._now()
+
+    def on_train_batch_end(
+        self,
+        trainer: Trainer,
+        pl_module: L.LightningModule,
+        outputs: Any,
+        batch: Any,
+        batch_idx: int,
+    ) -> None:
+        now = self._now()
+        if "optimizer" in self.marks:
+            self._record("optimizer", self.marks.pop("optimizer"), now)
+        total = now - self.marks.get("step_start", now)
+        self.current["other"] = max(total - sum(self.current.values()), 0.0)
+        self.current["total"] = total
+        self.steps.append(dict(self.current))
+        self.current = defaultdict(float)
+        self.marks = {"step_end": now}
+        self.traced += 1
+
+    def summary(self) -> Dict[str, float]:
+        """p50/p95/p99 in ms of every phase over the epoch, and the data-wait fraction."""
+        results = {}
+        for phase in (*PHASES, "total"):
+            values = np.array([step.get(phase, 0.0) for step in self.steps]) * 1000
+            for q in (50, 95, 99):
+                results[f"{phase}_p{q}_ms"] = float(np.percentile(values, q))
+        total = sum(step["total"] for step in self.steps)
+        data_wait = sum(step.get("data_wait", 0.0) for step in self.steps)
+        results["data_wait_fraction"] = data_wait / max(total, 1e-12)
+        return results
+
+    def on_train_epoch_end(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        self.active = False
+        if not self.steps:
+            return
+        results = self.summary()
+        pl_module.log_dict(
+            {f"profile/{name}": value for name, value in results.items()}, rank_zero_only=True
+        )
+        p50 = {phase: results[f"{phase}_p50_ms"] for phase in PHASES}
+        log.info(
+            f"Epoch {trainer.current_epoch} step p50 {results['total_p50_ms']:.1f} ms, "
+            f"data wait {results['data_wait_fraction']:.0%}, "
+            + ", ".join(f"{phase} {value:.1f}" for phase, value in p50.items())
+        )
+
+    def write_trace(self) -> None:
+        if self.trace_path is None or not self.events:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.trace_path)), exist_ok=True)
+        with open(self.trace_path, "w") as file:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, file)
+        steps = min(self.traced, self.trace_steps)
+        log.info(f"Chrome trace of {steps} steps written to {self.trace_path}")
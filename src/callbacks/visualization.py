@@ -0,0 +1,155 @@
+import random
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, List, Optional, Sequence, Tuple
+
+import lightning as L
+import torch
+import torchvision
+from lightning.pytorch.callbacks import Callback
+from lightning.pytorch.trainer import Trainer
+
+from src.models.dlib_module import outputs_path
+from src.utils import RankedLogger
+from src.utils.landmark_render import render_grid, to_uint8
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+
+class ValidationVisualizer(Callback):
+    """Draw target and predicted landmarks of a few validation samples after each validation epoch.
+
+    Only `num_samples` samples are kept per epoch, picked by reservoir sampling over the validation
+    set of rank zero, or the validation samples at `indices`. The picked rows are converted to
+    uint8 and copied to the CPU right away, so memory does not grow with the validation set.
+    Rendering, saving to `save_path` and uploading to the loggers with a `log_image` method run on
+    a background thread; an epoch whose previous render is still running is skipped instead of
+    waiting for it.
+    """
+
+    def __init__(
+        self,
+        num_samples: int = 16,
+        indices: Optional[Sequence[int]] = None,
+        seed: int = 0,
+        save_path: Optional[str] = None,
+        log_key: str = "annotated_image",
+    ) -> None:
+        """
+        :param num_samples: Number of samples drawn per epoch. Ignored with `indices`.
+        :param indices: Fixed indices of validation samples to draw every epoch.
+        :param seed: Seed of the reservoir sampling, reused every epoch.
+        :param save_path: Where to save the drawn grid. Defaults to `test_outputs/val_end.png`.
+        :param log_key: Key of the image in the loggers.
+        """
+        super().__init__()
+        self.indices = (
+            {index: slot for slot, index in enumerate(indices)} if indices is not None else None
+        )
+        self.num_samples = len(self.indices) if self.indices is not None else num_samples
+        self.seed = seed
+        self.save_path = Path(save_path) if save_path is not None else outputs_path / "val_end.png"
+        self.log_key = log_key
+
+        self.samples: List[Optional[Tuple[torch.Tensor, torch.Tensor, torch.Tensor]]] = []
+        self.seen = 0
+        self.rng = random.Random(seed)
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.pending: Optional[Future] = None
+
+    def _active(self, trainer: Trainer) -> bool:
+        return trainer.is_global_zero and not trainer.sanity_checking
+
+    def on_validation_epoch_start(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        self.samples = [None] * self.num_samples if self.indices is not None else []
+        self.seen = 0
+        self.rng.seed(self.seed)
+
+    def _slots(self, batch_size: int) -> List[Tuple[int, int]]:
+        """(position in the batch, slot in `samples`) of every sample of the next batch to keep."""
+        slots = []
+        for position in range(batch_size):
+            index = self.seen + position
+            if self.indices is not None:
+                if index in self.indices:
+                    slots.append((position, self.indices[index]))
+            elif index < self.num_samples:
+                slots.append((position, index))
+            else:
+                slot = self.rng.randint(0, index)
+                if slot < self.num_samples:
+                    slots.append((position, slot))
+        return slots
+
+    @torch.no_grad()
+    def on_validation_batch_end(
+        self,
+        trainer: Trainer,
+        pl_module: L.LightningModule,
+        outputs: Any,
+        batch: Any,
+        batch_idx: int,
+        dataloader_idx: int = 0,
+    ) -> None:
+        # only landmark modules return their predictions
+        if not self._active(trainer) or dataloader_idx != 0:
+            return
+        if not isinstance(outputs, dict) or "preds" not in outputs:
+            return
+        images, preds, targets = batch[0], outputs["preds"], outputs["targets"]
+        slots = self._slots(len(images))
+        self.seen += len(images)
+        if not slots:
+            return
+
+        positions = torch.tensor([position for position, _ in slots], device=images.device)
+        images = to_uint8(images[positions]).cpu()
+        preds, targets = preds.detach()[positions].float().cpu(), targets[positions].float().cpu()
+        for row, (_, slot) in enumerate(slots):
+            sample = (images[row], targets[row], preds[row])
+            if slot < len(self.samples):
+                self.samples[slot] = sample
+            else:
+                self.samples.append(sample)
+
+    def on_validation_epoch_end(self, trainer: Trainer, pl_module: L.LightningModule) -> None:
+        samples = [sample for sample in self.samples if sample is not None]
+        self.samples = []
+        if not self._active(trainer) or not samples:
+            return
+        if self.pending is not None and not self.pending.done():
+            log.warning(
+                "Skipping the validation visualization, the previous one is still rendering"
+            )
+            return
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="val-visualizer")
+
+        images, targets, preds = (torch.stack(tensors) for tensors in zip(*samples))
+        self.pending = self.executor.submit(
+            self.render, images, targets, preds, list(trainer.loggers), trainer.global_step
+        )
+
+    def render(
+        self,
+        images: torch.Tensor,
+        targets: torch.Tensor,
+        preds: torch.Tensor,
+        loggers: list,
+        step: int,
+    ) -> None:
+        """Draw, save and upload one epoch of samples. Runs on the background thread."""
+        try:
+            grid = render_grid(images, targets, preds)
+            torchvision.utils.save_image(grid, self.save_path)
+            for logger in loggers:
+                if hasattr(logger, "log_image"):
+                    logger.log_image(key=self.log_key, images=[grid], step=step)
+        except Exception as e:
+            log.warning(f"Validation visualization failed: {e}")
+
+    def teardown(self, trainer: Trainer, pl_module: L.LightningModule, stage: str) -> None:
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+            self.pending = None
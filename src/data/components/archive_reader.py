@@ -0,0 +1,171 @@
+import gzip
+import json
+import os
+import struct
+import tarfile
+import zipfile
+import zlib
+from typing import Dict, List, Optional
+
+from tqdm import tqdm
+
+
+class ArchiveReader:
+    """Random access to the members of a `.zip` or `.tar` archive without extracting it.
+
+    A member index (`name -> data offset, size, compression`) is built once and saved next to the
+    archive as `<archive>.index.json`. `read` then seeks straight to the member data. Gzipped tars
+    are not seekable, so `open` recompresses them once into a plain `.tar` next to the original.
+
+    The file handle is opened lazily per process and dropped when pickled, so every DataLoader
+    worker reads through its own handle.
+    """
+
+    INDEX_VERSION = 1
+
+    def __init__(self, path: str, index_path: Optional[str] = None):
+        self.path = path
+        self.index_path = index_path or f"{path}.index.json"
+        self.kind = "zip" if zipfile.is_zipfile(path) else "tar"
+        self.index = self._load_index()
+        if self.index is None:
+            self.index = self.build_index()
+            self._save_index()
+        self._file = None
+        self._pid = None
+
+    @classmethod
+    def open(cls, path: str) -> "ArchiveReader":
+        """Open `path`, recompressing a `.tar.gz` / `.tgz` into a seekable `.tar` if needed."""
+        if path.endswith((".tar.gz", ".tgz")):
+            tar_path = path[:-3] if path.endswith(".tar.gz") else path[:-4] + ".tar"
+            if not os.path.isfile(tar_path):
+                cls.recompress(path, tar_path)
+            path = tar_path
+        return cls(path)
+
+    @staticmethod
+    def recompress(src: str, dst: str) -> None:
+        """Decompress a gzipped tar into a plain, seekable tar."""
+        tmp = f"{dst}.tmp"
+        with gzip.open(src, "rb") as fsrc, open(tmp, "wb") as fdst:
+            progress = tqdm(
+                desc=f"Recompressing {os.path.basename(src)}", unit="B", unit_scale=True
+            )
+            while True:
+                chunk = fsrc.read(1 << 24)
+                if not chunk:
+                    break
+                fdst.write(chunk)
+                progress.update(len(chunk))
+            progress.close()
+        os.replace(tmp, dst)
+
+    def _stat(self) -> List[int]:
+        stat = os.stat(self.path)
+        return [stat.st_size, stat.st_mtime_ns]
+
+    def _load_index(self) -> Optional[Dict[str, list]]:
+        try:
+            with open(self.index_path, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != self.INDEX_VERSION or data.get("archive") != self._stat():
+            return None
+        return data["members"]
+
+    def _save_index(self) -> None:
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w") as file:
+            json.dump(
+                {"version": self.INDEX_VERSION, "archive": self._stat(), "members": self.index},
+                file,
+            )
+        os.replace(tmp, self.index_path)
+
+    def build_index(self) -> Dict[str, list]:
+        """Map every regular member to `[data offset, stored size, file size, compression]`."""
+        index = {}
+        if self.kind == "zip":
+            archive = zipfile.ZipFile(self.path, "r", allowZip64=True)
+            with archive, open(self.path, "rb") as file:
+                for info in tqdm(archive.infolist(), desc="Indexing archive"):
+                    if info.is_dir():
+                        continue
+                    # the local header may carry a different extra field than the central directory
+                    file.seek(info.header_offset)
+                    header = struct.unpack(
+                        zipfile.structFileHeader, file.read(zipfile.sizeFileHeader)
+                    )
+                    offset = (
+                        info.header_offset
+                        + zipfile.sizeFileHeader
+                        + header[zipfile._FH_FILENAME_LENGTH]
+                        + header[zipfile._FH_EXTRA_FIELD_LENGTH]
+                    )
+                    index[info.filename] = [
+                        offset,
+                        info.compress_size,
+                        info.file_size,
+                        info.compress_type,
+                    ]
+        else:
+            with tarfile.open(self.path, "r:") as archive:
+                for member in tqdm(archive, desc="Indexing archive"):
+                    if member.isfile():
+                        name = member.name[2:] if member.name.startswith("./") else member.name
+                        index[name] = [
+                            member.offset_data,
+                            member.size,
+                            member.size,
+                            zipfile.ZIP_STORED,
+                        ]
+        return index
+
+    def _handle(self):
+        if self._file is None or self._pid != os.getpid():
+            self._file = open(self.path, "rb")
+            self._pid = os.getpid()
+        return self._file
+
+    def names(self) -> List[str]:
+        return list(self.index.keys())
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.index
+
+    def read(self, name: str) -> bytes:
+        offset, stored_size, file_size, compression = self.index[name]
+        file = self._handle()
+        file.seek(offset)
+        data = file.read(stored_size)
+        if compression == zipfile.ZIP_STORED:
+            return data
+        if compression == zipfile.ZIP_DEFLATED:
+            return zlib.decompressobj(-zlib.MAX_WBITS).decompress(data)
+        # other zip methods are rare, let zipfile handle them
+        with zipfile.ZipFile(self.path, "r", allowZip64=True) as archive:
+            return archive.read(name)
+
+    def extract(self, name: str, path: str) -> str:
+        """Extract a single member to `path`, keeping its relative path, and return it."""
+        target = os.path.join(path, name)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        tmp = f"{target}.tmp"
+        with open(tmp, "wb") as file:
+            file.write(self.read(name))
+        os.replace(tmp, target)
+        return target
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+        self._file = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_file"] = None
+        state["_pid"] = None
+        return state
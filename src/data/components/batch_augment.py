@@ -0,0 +1,184 @@
+import math
+from typing import Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import nn
+
+IMG_MEAN = [0.485, 0.456, 0.406]
+IMG_STD = [0.229, 0.224, 0.225]
+
+# index of the mirrored landmark of every point of the 68 point iBUG markup
+FLIP_PERMUTATION_68 = (
+    list(range(16, -1, -1))  # jaw
+    + list(range(26, 16, -1))  # brows
+    + list(range(27, 31))  # nose bridge
+    + list(range(35, 30, -1))  # nostrils
+    + [45, 44, 43, 42, 47, 46, 39, 38, 37, 36, 41, 40]  # eyes
+    + [54, 53, 52, 51, 50, 49, 48, 59, 58, 57, 56, 55]  # outer lips
+    + [64, 63, 62, 61, 60, 67, 66, 65]  # inner lips
+)
+
+
+class BatchAugment(nn.Module):
+    """Vectorized augmentation of a collated batch.
+
+    Runs on the `(B, C, H, W)` images and `(B, 68, 2)` keypoints of a batch, on whatever device the
+    batch lives on, so DataLoader workers only have to decode and crop. Keypoints are expected in
+    the `[-0.5, 0.5]` range produced by `TransformDLIB`.
+
+    Images keep their dtype and value space: uint8 batches are returned as uint8, float batches
+    are treated as normalized with `mean`/`std` and returned normalized.
+
+    :param degrees: Maximum absolute rotation in degrees.
+    :param translate: Maximum absolute shift as a fraction of the image size.
+    :param scale: Range of the scale factor.
+    :param affine_p: Probability of applying the random affine to a sample.
+    :param hflip_p: Probability of a horizontal flip. Landmark indices are mirrored with
+        `flip_permutation`.
+    :param vflip_p: Probability of a vertical flip.
+    :param brightness: Brightness factor is sampled from `[1 - brightness, 1 + brightness]`.
+    :param contrast: Contrast factor is sampled from `[1 - contrast, 1 + contrast]`.
+    :param saturation: Saturation factor is sampled from `[1 - saturation, 1 + saturation]`.
+    :param color_p: Probability of applying colour jitter to a sample.
+    :param mean: Mean used to normalize float batches.
+    :param std: Std used to normalize float batches.
+    :param flip_permutation: Landmark index permutation of a horizontal flip.
+    :param padding_mode: `grid_sample` padding mode.
+    """
+
+    def __init__(
+        self,
+        degrees: float = 10.0,
+        translate: float = 0.05,
+        scale: Tuple[float, float] = (0.95, 1.05),
+        affine_p: float = 0.5,
+        hflip_p: float = 0.5,
+        vflip_p: float = 0.0,
+        brightness: float = 0.2,
+        contrast: float = 0.2,
+        saturation: float = 0.2,
+        color_p: float = 0.5,
+        mean: Sequence[float] = IMG_MEAN,
+        std: Sequence[float] = IMG_STD,
+        flip_permutation: Optional[Sequence[int]] = FLIP_PERMUTATION_68,
+        padding_mode: str = "reflection",
+    ):
+        super().__init__()
+        self.degrees = degrees
+        self.translate = translate
+        self.scale = tuple(scale)
+        self.affine_p = affine_p
+        self.hflip_p = hflip_p
+        self.vflip_p = vflip_p
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.color_p = color_p
+        self.padding_mode = padding_mode
+        self.register_buffer("mean", torch.tensor(mean).view(1, -1, 1, 1), persistent=False)
+        self.register_buffer("std", torch.tensor(std).view(1, -1, 1, 1), persistent=False)
+        self.register_buffer(
+            "flip_permutation",
+            torch.tensor(
+                flip_permutation if flip_permutation is not None else [], dtype=torch.long
+            ),
+            persistent=False,
+        )
+
+    def _to_unit(self, images: torch.Tensor) -> torch.Tensor:
+        if images.dtype == torch.uint8:
+            return images.float().div_(255)
+        return images * self.std + self.mean
+
+    def _from_unit(self, images: torch.Tensor, dtype: torch.dtype) -> torch.Tensor:
+        if dtype == torch.uint8:
+            return images.mul_(255).round_().clamp_(0, 255).to(torch.uint8)
+        return ((images - self.mean) / self.std).to(dtype)
+
+    def _uniform(
+        self, low: float, high: float, batch_size: int, device: torch.device
+    ) -> torch.Tensor:
+        return torch.empty(batch_size, device=device).uniform_(low, high)
+
+    def _bernoulli(self, p: float, batch_size: int, device: torch.device) -> torch.Tensor:
+        return torch.rand(batch_size, device=device) < p
+
+    def sample_matrix(self, batch_size: int, height: int, width: int, device: torch.device):
+        """Sample (B, 3, 3) matrices mapping input to output coordinates, normalized to [-1, 1]
+        like `affine_grid`, and the mask of horizontally flipped samples."""
+        apply = self._bernoulli(self.affine_p, batch_size, device)
+        angle = self._uniform(-self.degrees, self.degrees, batch_size, device) * math.pi / 180
+        scale = self._uniform(self.scale[0], self.scale[1], batch_size, device)
+        shift = torch.empty(batch_size, 2, device=device).uniform_(-self.translate, self.translate)
+        angle = torch.where(apply, angle, torch.zeros_like(angle))
+        scale = torch.where(apply, scale, torch.ones_like(scale))
+        shift = torch.where(apply[:, None], shift, torch.zeros_like(shift))
+
+        # rotate and scale in pixel space, so non square images are not sheared
+        cos, sin = torch.cos(angle) * scale, torch.sin(angle) * scale
+        aspect = height / width
+        matrix = torch.zeros(batch_size, 3, 3, device=device)
+        matrix[:, 0, 0] = cos
+        matrix[:, 0, 1] = -sin * aspect
+        matrix[:, 1, 0] = sin / aspect
+        matrix[:, 1, 1] = cos
+        matrix[:, :2, 2] = 2 * shift
+        matrix[:, 2, 2] = 1
+
+        hflip = self._bernoulli(self.hflip_p, batch_size, device)
+        vflip = self._bernoulli(self.vflip_p, batch_size, device)
+        flip = torch.ones(batch_size, 3, device=device)
+        flip[:, 0] = torch.where(hflip, -1.0, 1.0)
+        flip[:, 1] = torch.where(vflip, -1.0, 1.0)
+        return flip[:, :, None] * matrix, hflip
+
+    @staticmethod
+    def _grayscale(images: torch.Tensor) -> torch.Tensor:
+        if images.shape[1] != 3:
+            return images.mean(dim=1, keepdim=True)
+        weights = images.new_tensor([0.299, 0.587, 0.114]).view(1, 3, 1, 1)
+        return (images * weights).sum(dim=1, keepdim=True)
+
+    def color_jitter(self, images: torch.Tensor) -> torch.Tensor:
+        """Per-sample brightness, contrast and saturation jitter of images in [0, 1]."""
+        batch_size, device = images.shape[0], images.device
+        apply = self._bernoulli(self.color_p, batch_size, device)
+
+        def factor(limit: float) -> torch.Tensor:
+            value = self._uniform(1 - limit, 1 + limit, batch_size, device)
+            return torch.where(apply, value, torch.ones_like(value)).view(-1, 1, 1, 1)
+
+        images = images * factor(self.brightness)
+        gray = self._grayscale(images)
+        mean = gray.mean(dim=(2, 3), keepdim=True)
+        images = (images - mean) * factor(self.contrast) + mean
+        gray = self._grayscale(images)
+        images = (images - gray) * factor(self.saturation) + gray
+        return images.clamp_(0, 1)
+
+    @torch.no_grad()
+    def forward(
+        self, images: torch.Tensor, keypoints: torch.Tensor
+    ) -> Tuple[torch.Tensor, torch.Tensor]:
+        batch_size, _, height, width = images.shape
+        dtype, device = images.dtype, images.device
+        images = self._to_unit(images)
+
+        matrix, hflip = self.sample_matrix(batch_size, height, width, device)
+        theta = torch.linalg.inv(matrix)[:, :2]
+        grid = F.affine_grid(theta, list(images.shape), align_corners=False)
+        images = F.grid_sample(
+            images, grid, mode="bilinear", padding_mode=self.padding_mode, align_corners=False
+        )
+
+        # [-0.5, 0.5] landmarks (pixel / size - 0.5) -> pixel centers in affine_grid coordinates
+        half_pixel = keypoints.new_tensor([1 / width, 1 / height])
+        points = 2 * keypoints.float() + half_pixel
+        points = points @ matrix[:, :2, :2].transpose(1, 2) + matrix[:, None, :2, 2]
+        if len(self.flip_permutation):
+            points = torch.where(hflip[:, None, None], points[:, self.flip_permutation], points)
+        keypoints = ((points - half_pixel) / 2).to(keypoints.dtype)
+
+        images = self.color_jitter(images)
+        return self._from_unit(images, dtype), keypoints
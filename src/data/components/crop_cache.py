@@ -0,0 +1,199 @@
+import io
+import json
+import os
+from typing import Any, Dict, Optional
+
+import numpy as np
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+
+class _ResizedCrops(Dataset):
+    """Loads the ROI crop of a DLIB/DLIB_LPA sample and resizes it to `size` x `size`."""
+
+    def __init__(self, data: Dataset, size: int, mode: str, quality: int):
+        self.data = data
+        self.size = size
+        self.mode = mode
+        self.quality = quality
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        sample = self.data[index]
+        image = sample["image"]
+        width, height = image.size
+        image = image.resize((self.size, self.size), Image.BILINEAR)
+        keypoints = np.asarray(sample["landmark"], dtype=np.float32) * np.array(
+            [self.size / width, self.size / height], dtype=np.float32
+        )
+        if self.mode == "jpeg":
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=self.quality)
+            return buffer.getvalue(), keypoints
+        return np.array(image, dtype=np.uint8), keypoints
+
+
+class CropCache(Dataset):
+    """Pre-cropped, pre-resized face crops of a DLIB/DLIB_LPA dataset.
+
+    Every ROI crop is decoded, cropped and resized once by `build`, so `__getitem__` no longer
+    touches the full resolution JPEG. Two storage modes are supported:
+        - `memmap`: a packed uint8 (N, size, size, 3) array read through a memory map
+        - `jpeg`: re-encoded crops kept in RAM as JPEG bytes, decoded on access
+
+    Keypoints are stored next to the crops in a float32 (N, 68, 2) sidecar, in crop pixels.
+    Samples have the same layout as the wrapped dataset: `{'image': ..., 'landmark': ...}`.
+    """
+
+    MODES = ("memmap", "jpeg")
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, "meta.json"), "r") as file:
+            self.meta = json.load(file)
+        self.mode = self.meta["mode"]
+        self.size = self.meta["size"]
+        self._images = None
+        self._offsets = None
+        self._keypoints = None
+        if self.mode == "jpeg":
+            # in RAM by design, forked DataLoader workers share these pages
+            self._images = np.fromfile(os.path.join(cache_dir, "images.bin"), dtype=np.uint8)
+            self._offsets = np.load(os.path.join(cache_dir, "offsets.npy"))
+
+    @classmethod
+    def open(
+        cls,
+        dataset: Dataset,
+        cache_dir: str,
+        size: int = 288,
+        mode: str = "memmap",
+        quality: int = 95,
+        num_workers: int = 0,
+    ) -> "CropCache":
+        """Open the cache in `cache_dir`, building it from `dataset` first if missing or stale.
+
+        :param dataset: A `DLIB` or `DLIB_LPA` dataset.
+        :param cache_dir: Directory of the cache.
+        :param size: Side of the stored crops. Keep it slightly above the training resolution.
+        :param mode: `memmap` or `jpeg`.
+        :param quality: JPEG quality used by the `jpeg` mode.
+        :param num_workers: Number of DataLoader workers used to build the cache.
+        """
+        if mode not in cls.MODES:
+            raise ValueError(f"Unknown crop cache mode '{mode}', expected one of {cls.MODES}")
+        key = cls.cache_key(dataset, size, mode, quality)
+        try:
+            with open(os.path.join(cache_dir, "meta.json"), "r") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            meta = None
+        if meta is None or meta.get("key") != key:
+            cls.build(dataset, cache_dir, size, mode, quality, num_workers)
+        return cls(cache_dir)
+
+    @staticmethod
+    def cache_key(dataset: Dataset, size: int, mode: str, quality: int) -> Dict[str, Any]:
+        labels = getattr(dataset, "img_labels", None)
+        return {
+            "dataset": type(dataset).__name__,
+            "length": len(dataset),
+            "labels": getattr(labels, "meta", None),
+            "decode_size": getattr(dataset, "decode_size", None),
+            "size": size,
+            "mode": mode,
+            "quality": quality if mode == "jpeg" else None,
+        }
+
+    @classmethod
+    def build(
+        cls,
+        dataset: Dataset,
+        cache_dir: str,
+        size: int = 288,
+        mode: str = "memmap",
+        quality: int = 95,
+        num_workers: int = 0,
+    ) -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, "meta.json")
+        if os.path.isfile(meta_path):
+            os.remove(meta_path)
+
+        length = len(dataset)
+        loader = DataLoader(
+            _ResizedCrops(dataset, size, mode, quality),
+            batch_size=None,
+            shuffle=False,
+            num_workers=num_workers,
+        )
+        keypoints = np.lib.format.open_memmap(
+            os.path.join(cache_dir, "keypoints.npy"),
+            mode="w+",
+            dtype=np.float32,
+            shape=(length, 68, 2),
+        )
+        progress = tqdm(loader, total=length, desc=f"Caching {size}px crops")
+        if mode == "memmap":
+            images = np.lib.format.open_memmap(
+                os.path.join(cache_dir, "images.npy"),
+                mode="w+",
+                dtype=np.uint8,
+                shape=(length, size, size, 3),
+            )
+            for index, (image, keypoint) in enumerate(progress):
+                images[index] = np.asarray(image)
+                keypoints[index] = np.asarray(keypoint)
+            images.flush()
+        else:
+            offsets = np.zeros(length + 1, dtype=np.int64)
+            with open(os.path.join(cache_dir, "images.bin"), "wb") as file:
+                for index, (image, keypoint) in enumerate(progress):
+                    file.write(image)
+                    offsets[index + 1] = offsets[index] + len(image)
+                    keypoints[index] = np.asarray(keypoint)
+            np.save(os.path.join(cache_dir, "offsets.npy"), offsets)
+        keypoints.flush()
+        del keypoints
+
+        with open(meta_path, "w") as file:
+            json.dump(
+                {
+                    "key": cls.cache_key(dataset, size, mode, quality),
+                    "mode": mode,
+                    "size": size,
+                    "length": length,
+                },
+                file,
+            )
+
+    def _load(self) -> None:
+        if self._keypoints is None:
+            self._keypoints = np.load(os.path.join(self.cache_dir, "keypoints.npy"), mmap_mode="r")
+            if self.mode == "memmap":
+                self._images = np.load(os.path.join(self.cache_dir, "images.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return self.meta["length"]
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError(f"Index {index} is out of range")
+        self._load()
+        if self.mode == "jpeg":
+            data = self._images[self._offsets[index] : self._offsets[index + 1]]
+            image = np.asarray(Image.open(io.BytesIO(data.tobytes())).convert("RGB"))
+        else:
+            image = np.array(self._images[index])
+        return {"image": image, "landmark": np.array(self._keypoints[index])}
+
+    def __getstate__(self):
+        # memory maps are re-opened by every worker, the in-RAM jpeg blob is kept
+        state = self.__dict__.copy()
+        state["_keypoints"] = None
+        if self.mode == "memmap":
+            state["_images"] = None
+        return state
@@ -0,0 +1,32 @@
+import math
+from typing import BinaryIO, Optional, Sequence, Tuple, Union
+
+from PIL import Image
+
+
+def open_reduced(
+    file: Union[str, BinaryIO],
+    roi_box: Sequence[float],
+    decode_size: Optional[int] = None,
+) -> Tuple[Image.Image, int]:
+    """Open an RGB image, decoding a JPEG at the smallest DCT scale keeping the ROI large enough.
+
+    JPEG decoders can scale by 1/2, 1/4 or 1/8 during decoding, at a cost that drops roughly with
+    the square of the factor. The factor is picked so that the side of `roi_box`, in original
+    pixels, stays at least `decode_size` pixels after decoding. Other formats, or
+    `decode_size=None`, decode at full resolution.
+
+    :return: The image and the reduction factor, divide original pixel coordinates by it.
+    """
+    image = Image.open(file)
+    if decode_size and image.format == "JPEG":
+        width, height = image.size
+        side = max(roi_box[2] - roi_box[0], roi_box[3] - roi_box[1])
+        if side > decode_size:
+            scale = decode_size / side
+            draft = image.draft("RGB", (math.ceil(width * scale), math.ceil(height * scale)))
+            if draft is not None:
+                # the box is the original size divided by the DCT scale in {1, 2, 4, 8}
+                _, box = draft
+                return image.convert("RGB"), round(width / box[2])
+    return image.convert("RGB"), 1
@@ -1,6 +1,6 @@
 from genericpath import isdir
 from torch.utils.data import Dataset
-from typing import Optional
+from typing import List, Optional, Tuple
 # from torchvision.io import read_image
 # import cv2
 import albumentations as A
@@ -9,111 +9,106 @@ import matplotlib.pyplot as plt
 # import PIL
 from PIL import Image, ImageDraw
 import torchvision.transforms.functional as TF
-import requests
-import pandas as pd
 import xml.etree.ElementTree as ET
+import io
 import os
-import tarfile
-from tqdm import tqdm
 import numpy as np
 from math import sqrt
+from src.data.components import fetch
+from src.data.components.archive_reader import ArchiveReader
+from src.data.components.decode import open_reduced
+from src.data.components.label_store import LabelStore
+from src.utils.landmark_render import annotate_image
 
 class DLIB(Dataset):
-  def __init__(self, transform: Optional[A.Compose] = None):
+  def __init__(self, transform: Optional[A.Compose] = None, from_archive: bool = False,
+               decode_size: Optional[int] = None, origin_path: Optional[str] = None):
     self.data_dir = None
     self.img_labels = None
     self.transform = transform
+    # read images straight from the (recompressed) archive instead of extracting it
+    self.from_archive = from_archive
+    self.reader = None
+    # decode JPEGs at a reduced DCT scale keeping the ROI >= this size, keypoints are scaled
+    self.decode_size = decode_size
     self.url = 'http://dlib.net/files/data/ibug_300W_large_face_landmark_dataset.tar.gz'
     self.file_name = 'ibug_300W_large_face_landmark_dataset.tar.gz'
-    self.origin_path = 'data/dlib'
+    # expected sha256 of the archive, verified after the download when set
+    self.sha256 = None
+    # root of the download, e.g. a dataset written by `src.data.components.synthetic`
+    self.origin_path = origin_path or 'data/dlib'
     self.folder_dir = 'ibug_300W_large_face_landmark_dataset'
     self.labels_file = 'labels_ibug_300W.xml'
+    self.store_dir = 'labels_store'
     self.class_labels = []
 
     self.prepare_data()
     self.prepare_labels()
 
   def download(self):
-    response = requests.get(self.url, stream=True)
-    total_size_in_bytes= int(response.headers.get('content-length', 0))
-    block_size = 1024
-    progress_bar = tqdm(total=total_size_in_bytes, unit='iB', unit_scale=True)
-    if not os.path.isdir(self.origin_path):
-        os.makedirs(self.origin_path)
-    with open(os.path.join(self.origin_path, self.file_name), 'wb') as file:
-        for data in response.iter_content(block_size):
-            progress_bar.update(len(data))
-            file.write(data)
-    progress_bar.close()
-    if total_size_in_bytes != 0 and progress_bar.n != total_size_in_bytes:
-        print("ERROR, something went wrong")
+    # parallel range requests, resumed after an interruption and checked against `self.sha256`
+    fetch.download(self.url, os.path.join(self.origin_path, self.file_name), sha256=self.sha256)
 
   def unzip(self):
-    file = tarfile.open(os.path.join(self.origin_path, self.file_name))
-    members = file.getmembers()
-    progress = tqdm(members)
-
-    for member in progress:
-      file.extract(member, self.origin_path)
-      progress.set_description(f"Extracting {member.name}")
-    file.close()
+    # members already extracted with the right size are skipped
+    fetch.extract(os.path.join(self.origin_path, self.file_name), self.origin_path)
 
   def prepare_data(self):
-    if not os.path.isfile(os.path.join(self.origin_path, self.file_name)):
+    labels_path = os.path.join(self.origin_path, self.folder_dir, self.labels_file)
+    # an extracted dataset is enough unless the images are read from the archive
+    archive_path = os.path.join(self.origin_path, self.file_name)
+    if not os.path.isfile(archive_path) and (self.from_archive or not os.path.isfile(labels_path)):
         self.download()
-    if not os.path.isfile(os.path.join(self.origin_path, self.folder_dir, self.labels_file)):
+    if self.from_archive:
+        self.prepare_archive()
+    elif not os.path.isfile(os.path.join(self.origin_path, self.folder_dir, self.labels_file)):
         self.unzip()
     if os.path.isdir(os.path.join(self.origin_path, self.folder_dir)):
         self.data_dir = os.path.join(self.origin_path, self.folder_dir)
 
+  def prepare_archive(self):
+    """Index the archive and extract only the labels file, images are read from the archive."""
+    if self.reader is None:
+      self.reader = ArchiveReader.open(os.path.join(self.origin_path, self.file_name))
+    if not os.path.isfile(os.path.join(self.origin_path, self.folder_dir, self.labels_file)):
+      self.reader.extract(f"{self.folder_dir}/{self.labels_file}", self.origin_path)
+
+  def open_image(self, file_name: str):
+    """Path of an image on disk, or a file object over its bytes in the archive."""
+    if self.reader is not None:
+      return io.BytesIO(self.reader.read(f"{self.folder_dir}/{file_name}"))
+    return os.path.join(self.data_dir, file_name)
+
   def prepare_labels(self):
     if self.data_dir is None:
       self.prepare_data()
 
     if self.img_labels is None:
       labels_dir = os.path.join(self.data_dir, self.labels_file)
-      xml_data = open(labels_dir, 'r').read()
-      root = ET.XML(xml_data)
-      data = []
-
-      for image in root.findall('images/image'):
-          file_name = image.get('file')
-          img_width = image.get('width')
-          img_height = image.get('height')
-
-          row = {
-              'File name': file_name,
-              'Image width': img_width,
-              'Image height': img_height,
-          }
-
-          for box in image.findall('box'):
-              top = box.get('top')
-              left = box.get('left')
-              box_width = box.get('width')
-              box_height = box.get('height')
-              row.update({
-                  'top': top,
-                  'left': left,
-                  'box_width': box_width,
-                  'box_height': box_height,
-              })
-
-              for part in box.findall('part'):
-                  name = part.get('name')
-                  x = part.get('x')
-                  y = part.get('y')
-
-                  row.update({
-                      f"Point {name}": (x, y)
-                  })
-                  self.class_labels.append(name)
-
-          data.append(row)
-
-      df = pd.DataFrame(data)
-      if not df.empty:
-        self.img_labels = df
+      store = LabelStore.open(
+        os.path.join(self.origin_path, self.store_dir), [labels_dir], self.parse_labels
+      )
+      if len(store) > 0:
+        self.img_labels = store
+
+  @staticmethod
+  def parse_labels(labels_dir: str) -> Tuple[List[str], np.ndarray]:
+    """Parse the 300W xml into image file names and a (N, 68, 2) landmark array."""
+    root = ET.parse(labels_dir).getroot()
+    file_names = []
+    landmarks = []
+
+    for image in root.findall('images/image'):
+        points = None
+        # keep the last box of an image, as the columns of the old DataFrame did
+        for box in image.findall('box'):
+            points = [(float(part.get('x')), float(part.get('y'))) for part in box.findall('part')]
+        if points is None or len(points) != 68:
+          continue
+        file_names.append(image.get('file'))
+        landmarks.append(points)
+
+    return file_names, np.array(landmarks, dtype=np.float32).reshape(-1, 68, 2)
 
   def __len__(self):
     if self.img_labels is None:
@@ -151,31 +146,17 @@ class DLIB(Dataset):
       self.prepare_labels()
       
     if self.data_dir is not None and self.img_labels is not None:
-      img_path = os.path.join(self.data_dir, self.img_labels.iloc[index, 0])
-      bbox = self.img_labels.loc[index, 'top':'box_height']
-      landmark = self.img_labels.iloc[index, -68:]
-      image = Image.open(img_path).convert('RGB')
-      roi_box = self.parse_roi_box_from_landmark(landmark)
-      area = (roi_box[0], roi_box[1], roi_box[2], roi_box[3])
-      # width = int(float(bbox['box_width']) + float(bbox['box_width']) * 0.1)
-      # height = int(float(bbox['box_height']) + float(bbox['box_height']) * 0.1)
-      # left = int(float(bbox['left']) - float(width) * 0.05)
-      # top = int(float(bbox['top']) - float(height) * 0.05)
-      # left, top, width, height = int(bbox['left']), int(bbox['top']), int(bbox['box_width']), int(bbox['box_height'])
-      # right = left + width
-      # lower = top + height
-      # area = (left, top, right, lower)
+      landmark = self.img_labels.landmarks[index]
+      roi_box = self.img_labels.roi_boxes[index]
+      source = self.open_image(self.img_labels.file_name(index))
+      image, factor = open_reduced(source, roi_box, self.decode_size)
+      area = tuple(float(v) / factor for v in roi_box)
       image = image.crop(area)
 
       # image = np.asarray(image)
-      keypoints = []
-      for i in range(68):
-        #  x = int(landmark[i][0]) - int(bbox['left'])
-        #  y = int(landmark[i][1]) - int(bbox['top'])
-        x = int(landmark[i][0]) - int(roi_box[0])
-        y = int(landmark[i][1]) - int(roi_box[1])
-        keypoints.append((x, y))
-      keypoints = np.array(keypoints)
+      keypoints = landmark.astype(np.int64) - roi_box[:2].astype(np.int64)
+      if factor > 1:
+        keypoints = keypoints.astype(np.float32) / factor
       # image = TF.to_tensor(image)
       # image = image.permute(1,2,0)
       # image = read_image(img_path)
@@ -199,10 +180,7 @@ class DLIB(Dataset):
 
   @staticmethod
   def image_annotation(image: Image, keypoints: np.ndarray)->Image:
-     draw = ImageDraw.Draw(image)
-     for i in range(keypoints.shape[0]):
-        draw.ellipse(xy=(keypoints[i][0]-1, keypoints[i][1]-1, keypoints[i][0]+1, keypoints[i][1]+1), fill=(0, 255, 0))
-     return image
+     return Image.fromarray(annotate_image(np.asarray(image.convert('RGB')), keypoints))
      
 
 if __name__ == '__main__':
@@ -1,27 +1,43 @@
 from torch.utils.data import Dataset
 import gdown
 import zipfile
-from tqdm import tqdm
+import io
 import os
 import typing
 from typing import Optional
 import albumentations as A
 from PIL import Image, ImageDraw
-import pandas as pd
 import numpy as np
 from math import sqrt
 import matplotlib.pyplot as plt
+from src.data.components import fetch
+from src.data.components.archive_reader import ArchiveReader
+from src.data.components.decode import open_reduced
+from src.data.components.label_store import LabelStore
+from src.utils.landmark_render import annotate_image
 
 class DLIB_LPA(Dataset):
-  def __init__(self, transform: Optional[A.Compose] = None):
+  def __init__(self, transform: Optional[A.Compose] = None, from_archive: bool = False,
+               decode_size: Optional[int] = None, origin_path: Optional[str] = None):
       self.data_dir = None
       self.img_labels = None
       self.transform = transform
+      # read images straight from the zip instead of extracting it
+      self.from_archive = from_archive
+      self.reader = None
+      # decode JPEGs at a reduced DCT scale keeping the ROI >= this size, keypoints are scaled
+      self.decode_size = decode_size
       self.url = 'https://drive.google.com/file/d/1JK2-1GKnL2dJ7rQMxq1RZrbPpl7klfs9/view?usp=sharing'
       self.id = '1JK2-1GKnL2dJ7rQMxq1RZrbPpl7klfs9'
+      self.download_url = ('https://drive.usercontent.google.com/download'
+                           f'?id={self.id}&export=download&confirm=t')
+      # expected sha256 of the zip, verified after the download when set
+      self.sha256 = None
       self.file_name = '300WLPA_2d.zip'
-      self.origin_path = 'data/300W'
+      # root of the download, e.g. a dataset written by `src.data.components.synthetic`
+      self.origin_path = origin_path or 'data/300W'
       self.folder_dir = '300WLPA_2d'
+      self.store_dir = 'labels_store'
       self.labels_files = ['300WLPA_AFW_1.txt', '300WLPA_HELEN_1.txt', '300WLPA_HELEN_10001.txt', '300WLPA_HELEN_20001.txt', '300WLPA_HELEN_30001.txt', '300WLPA_LFPW.txt']
       if not os.path.exists(self.origin_path):
           os.makedirs(self.origin_path)
@@ -30,53 +46,83 @@ class DLIB_LPA(Dataset):
       self.prepare_labels()
 
   def download(self):
-      gdown.download(url=self.url, output=os.path.join(self.origin_path, self.file_name), quiet=False, use_cookies=False, fuzzy=True) #id=self.id,
+      output = os.path.join(self.origin_path, self.file_name)
+      try:
+          # parallel range requests against the direct download endpoint, resumed if interrupted
+          fetch.download(self.download_url, output, sha256=self.sha256)
+          if not zipfile.is_zipfile(output):
+              os.remove(output)
+              raise IOError("Google Drive returned a page instead of the zip")
+      except IOError:
+          gdown.download(output=output, quiet=False, use_cookies=False, id=self.id, resume=True)
+          if self.sha256 is not None and fetch.sha256sum(output) != self.sha256:
+              os.remove(output)
+              raise IOError(f"Checksum mismatch for {self.file_name}")
 
   def unzip(self):
-      file_name = os.path.join(self.origin_path, self.file_name)
-      with zipfile.ZipFile(file_name, mode='r', allowZip64=True) as file:
-          members = file.infolist()
-          progress = tqdm(members)
-          for member in progress:
-              try:
-                  file.extract(member, self.origin_path)
-                  progress.set_description(f"Extracting {member.filename}")
-              except zipfile.error as e:
-                  pass
-      file.close()
+      # members already extracted with the right size are skipped, as are corrupt ones
+      archive_path = os.path.join(self.origin_path, self.file_name)
+      fetch.extract(archive_path, self.origin_path, skip_errors=True)
 
   def prepare_data(self):
-      if not os.path.isfile(os.path.join(self.origin_path, self.file_name)):
+      folder = os.path.join(self.origin_path, self.folder_dir)
+      extracted = all(os.path.isfile(os.path.join(folder, name)) for name in self.labels_files)
+      # an extracted dataset is enough unless the images are read from the zip
+      archive_path = os.path.join(self.origin_path, self.file_name)
+      if not os.path.isfile(archive_path) and (self.from_archive or not extracted):
           self.download()
-      for labels_file in self.labels_files:
-          if not os.path.isfile(os.path.join(self.origin_path, self.folder_dir, labels_file)):
-              self.unzip()
+      if self.from_archive:
+          self.prepare_archive()
+      elif not extracted:
+          self.unzip()
       if os.path.isdir(os.path.join(self.origin_path, self.folder_dir)):
           self.data_dir = os.path.join(self.origin_path, self.folder_dir)
 
+  def prepare_archive(self):
+      """Index the zip and extract only the labels files, images are read from the zip."""
+      if self.reader is None:
+          self.reader = ArchiveReader.open(os.path.join(self.origin_path, self.file_name))
+      for labels_file in self.labels_files:
+          if not os.path.isfile(os.path.join(self.origin_path, self.folder_dir, labels_file)):
+              self.reader.extract(f"{self.folder_dir}/{labels_file}", self.origin_path)
+
+  def open_image(self, file_name: str):
+      """Path of an image on disk, or a file object over its bytes in the zip."""
+      if self.reader is not None:
+          return io.BytesIO(self.reader.read(f"{self.folder_dir}/{file_name}"))
+      return os.path.join(self.data_dir, file_name)
+
   def prepare_labels(self):
       if self.data_dir is None:
           self.prepare_data()
     
       if self.img_labels is None:
-          data = []
-          for labels_file in self.labels_files:
-              labels_dir = os.path.join(self.data_dir, labels_file)
-              with open(labels_dir, 'r') as file:
-                  lines = file.readlines()
-                  for line in lines:
-                      values = line.split()
-                      file_name = values[0]
-                      row = {'File name': file_name}
-                      points = list(map(float, values[1:]))
-                      for i in range(68):
-                          row.update({
-                              f"Point {i + 1}": (points[i], points[i+68])
-                              })
-                      data.append(row)
-          df = pd.DataFrame(data)
-          if not df.empty:
-              self.img_labels = df
+          labels_dirs = [
+              os.path.join(self.data_dir, labels_file) for labels_file in self.labels_files
+          ]
+          store = LabelStore.open(
+              os.path.join(self.origin_path, self.store_dir), labels_dirs, self.parse_labels
+          )
+          if len(store) > 0:
+              self.img_labels = store
+
+  @staticmethod
+  def parse_labels(labels_dir: str) -> typing.Tuple[typing.List[str], np.ndarray]:
+      """Parse one 300WLPA_*.txt file into image file names and a (N, 68, 2) landmark array.
+
+      Every line is `file_name x_1 ... x_68 y_1 ... y_68`.
+      """
+      file_names = []
+      points = []
+      with open(labels_dir, 'r') as file:
+          for line in file:
+              values = line.split()
+              if not values:
+                  continue
+              file_names.append(values[0])
+              points.append(values[1:137])
+      points = np.array(points, dtype=np.float32).reshape(-1, 2, 68)
+      return file_names, points.transpose(0, 2, 1)
 
   def __len__(self):
       if self.img_labels is None:
@@ -114,19 +160,13 @@ class DLIB_LPA(Dataset):
           self.prepare_labels()
 
       if self.data_dir is not None and self.img_labels is not None:
-          img_path = os.path.join(self.data_dir, self.img_labels.iloc[index, 0])
-          landmark = self.img_labels.iloc[index, -68:]
-          # keypoints = np.array(landmark)
-          image = Image.open(img_path).convert('RGB')
-          roi_box = self.parse_roi_box_from_landmark(landmark)
-          area = (roi_box[0], roi_box[1], roi_box[2], roi_box[3])
+          landmark = self.img_labels.landmarks[index]
+          roi_box = self.img_labels.roi_boxes[index].tolist()
+          source = self.open_image(self.img_labels.file_name(index))
+          image, factor = open_reduced(source, roi_box, self.decode_size)
+          area = tuple(value / factor for value in roi_box)
           image = image.crop(area)
-          keypoints = []
-          for i in range(68):
-              x = landmark[i][0] - roi_box[0]
-              y = landmark[i][1] - roi_box[1]
-              keypoints.append((x, y))
-          keypoints = np.array(keypoints)
+          keypoints = (landmark - np.array(roi_box[:2], dtype=np.float32)) / factor
           sample = {'image': image, 'landmark': keypoints, 'box': roi_box} #, 'box': roi_box
       return sample
 
@@ -142,7 +182,4 @@ class DLIB_LPA(Dataset):
 
   @staticmethod
   def image_annotation(image: Image, keypoints: np.ndarray)->Image:
-      draw = ImageDraw.Draw(image)
-      for i in range(keypoints.shape[0]):
-          draw.ellipse(xy=(keypoints[i][0]-1, keypoints[i][1]-1, keypoints[i][0]+1, keypoints[i][1]+1), fill=(0, 255, 0))
-      return image
\ No newline at end of file
+      return Image.fromarray(annotate_image(np.asarray(image.convert('RGB')), keypoints))
\ No newline at end of file
@@ -0,0 +1,341 @@
+import hashlib
+import json
+import os
+import tarfile
+import threading
+import time
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, List, Optional, Tuple
+
+import requests
+from tqdm import tqdm
+
+from src.data.components.archive_reader import ArchiveReader
+
+BLOCK_SIZE = 1 << 20
+
+
+def sha256sum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _probe(session: requests.Session, url: str, timeout: float) -> Tuple[Optional[int], bool]:
+    """Return the size of `url` and whether the server answers byte range requests."""
+    headers = {"Range": "bytes=0-0"}
+    with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+        response.raise_for_status()
+        if response.status_code == 206 and "/" in response.headers.get("Content-Range", ""):
+            total = response.headers["Content-Range"].rsplit("/", 1)[1]
+            return (int(total) if total.isdigit() else None), True
+        length = response.headers.get("Content-Length")
+        return (int(length) if length is not None else None), False
+
+
+def _retry(fn, retries: int, what: str):
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except (requests.RequestException, IOError) as e:
+            if attempt == retries:
+                raise IOError(f"Failed to download {what} after {retries + 1} attempts") from e
+            time.sleep(min(2**attempt, 30))
+
+
+def download(
+    url: str,
+    path: str,
+    sha256: Optional[str] = None,
+    num_connections: int = 8,
+    chunk_size: int = 1 << 23,
+    retries: int = 5,
+    timeout: float = 60,
+    session: Optional[requests.Session] = None,
+) -> str:
+    """Download `url` to `path` over parallel HTTP range requests, resuming any previous attempt.
+
+    The file is assembled in `<path>.part`; `<path>.part.json` records the finished chunks, so an
+    interrupted download only fetches the missing ones. Servers without range support are read
+    over one connection, resuming from the end of the partial file where possible. The result is
+    checked against the announced size and, if given, `sha256` before it is moved to `path`.
+
+    :param url: URL of the file.
+    :param path: Destination path.
+    :param sha256: Expected hex digest. A mismatching download is deleted and `IOError` is raised.
+    :param num_connections: Number of parallel range requests.
+    :param chunk_size: Size of a range request.
+    :param retries: Retries per chunk, with exponential backoff.
+    :param timeout: Socket timeout of every request.
+    :param session: Optional `requests.Session` to reuse.
+    :return: `path`.
+    """
+    if os.path.isfile(path):
+        if sha256 is None or sha256sum(path) == sha256:
+            return path
+        os.remove(path)
+
+    session = session or requests.Session()
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    part_path, state_path = f"{path}.part", f"{path}.part.json"
+    size, ranges = _probe(session, url, timeout)
+
+    if ranges and size:
+        options = (num_connections, chunk_size, retries, timeout)
+        _download_ranges(session, url, part_path, state_path, size, *options)
+    else:
+        _download_stream(session, url, part_path, size, retries, timeout)
+
+    if size is not None and os.path.getsize(part_path) != size:
+        raise IOError(f"Downloaded {os.path.getsize(part_path)} bytes of {url}, expected {size}")
+    if sha256 is not None:
+        digest = sha256sum(part_path)
+        if digest != sha256:
+            os.remove(part_path)
+            if os.path.isfile(state_path):
+                os.remove(state_path)
+            raise IOError(f"Checksum mismatch for {url}: expected sha256 {sha256}, got {digest}")
+    os.replace(part_path, path)
+    if os.path.isfile(state_path):
+        os.remove(state_path)
+    return path
+
+
+def _download_ranges(
+    session: requests.Session,
+    url: str,
+    part_path: str,
+    state_path: str,
+    size: int,
+    num_connections: int,
+    chunk_size: int,
+    retries: int,
+    timeout: float,
+) -> None:
+    chunks = [(start, min(start + chunk_size, size) - 1) for start in range(0, size, chunk_size)]
+    state = {"url": url, "size": size, "chunk_size": chunk_size, "done": []}
+    try:
+        with open(state_path, "r") as file:
+            saved = json.load(file)
+        same = all(saved.get(key) == state[key] for key in ("url", "size", "chunk_size"))
+        if same and os.path.isfile(part_path):
+            state["done"] = saved["done"]
+    except (OSError, ValueError):
+        pass
+    if not state["done"]:
+        with open(part_path, "wb") as file:
+            file.truncate(size)
+    done = set(state["done"])
+    todo = [index for index in range(len(chunks)) if index not in done]
+
+    lock = threading.Lock()
+    progress = tqdm(
+        total=size,
+        initial=size - sum(chunks[i][1] - chunks[i][0] + 1 for i in todo),
+        unit="B",
+        unit_scale=True,
+        desc=f"Downloading {os.path.basename(part_path[:-5])}",
+    )
+
+    def fetch(index: int) -> None:
+        start, end = chunks[index]
+
+        def attempt() -> None:
+            written = 0
+            headers = {"Range": f"bytes={start}-{end}"}
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                response.raise_for_status()
+                if response.status_code != 206:
+                    raise IOError(f"Server ignored the range request for bytes {start}-{end}")
+                # every chunk seeks its own handle, `os.pwrite` does not exist on Windows
+                with open(part_path, "r+b") as file:
+                    file.seek(start)
+                    for block in response.iter_content(BLOCK_SIZE):
+                        file.write(block)
+                        written += len(block)
+                        progress.update(len(block))
+            if written != end - start + 1:
+                progress.update(-written)
+                raise IOError(f"Got {written} bytes for range {start}-{end}")
+
+        _retry(attempt, retries, f"bytes {start}-{end} of {url}")
+        with lock:
+            done.add(index)
+            state["done"] = sorted(done)
+            with open(f"{state_path}.tmp", "w") as state_file:
+                json.dump(state, state_file)
+            os.replace(f"{state_path}.tmp", state_path)
+
+    with ThreadPoolExecutor(max_workers=num_connections) as pool:
+        for future in [pool.submit(fetch, index) for index in todo]:
+            future.result()
+    progress.close()
+
+
+def _download_stream(
+    session: requests.Session,
+    url: str,
+    part_path: str,
+    size: Optional[int],
+    retries: int,
+    timeout: float,
+) -> None:
+    name = os.path.basename(part_path[:-5])
+    progress = tqdm(total=size, unit="B", unit_scale=True, desc=f"Downloading {name}")
+
+    def attempt() -> None:
+        offset = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+            response.raise_for_status()
+            # 200 means the server sent the whole file again
+            mode = "ab" if response.status_code == 206 else "wb"
+            progress.reset(total=size)
+            progress.update(offset if mode == "ab" else 0)
+            with open(part_path, mode) as file:
+                for block in response.iter_content(BLOCK_SIZE):
+                    file.write(block)
+                    progress.update(len(block))
+        if size is not None and os.path.getsize(part_path) < size:
+            raise IOError(f"Connection closed after {os.path.getsize(part_path)} of {size} bytes")
+
+    _retry(attempt, retries, url)
+    progress.close()
+
+
+def _target(dest: str, name: str) -> str:
+    target = os.path.abspath(os.path.join(dest, name))
+    if os.path.commonpath([target, os.path.abspath(dest)]) != os.path.abspath(dest):
+        raise IOError(f"Archive member {name} points outside of {dest}")
+    return target
+
+
+def _is_present(target: str, size: int) -> bool:
+    return os.path.isfile(target) and os.path.getsize(target) == size
+
+
+def _write(target: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp = f"{target}.tmp"
+    with open(tmp, "wb") as file:
+        file.write(data)
+    os.replace(tmp, target)
+
+
+def extract(
+    archive_path: str,
+    dest: str,
+    members: Optional[Iterable[str]] = None,
+    num_workers: int = 8,
+    skip_errors: bool = False,
+) -> List[str]:
+    """Extract `archive_path` into `dest`, skipping members already present with the right size.
+
+    Zip and tar members are extracted in parallel by `num_workers` threads, each reading through
+    its own handle. A gzipped tar is a single compressed stream, so it is first decompressed once
+    into a plain `.tar` next to it, the same file `ArchiveReader.open` uses. Other compressed tars
+    are extracted sequentially, still skipping the members already on disk.
+
+    :param archive_path: A `.zip`, `.tar`, `.tar.gz` or `.tgz` file.
+    :param dest: Destination directory.
+    :param members: Only extract these member names.
+    :param num_workers: Number of extraction threads.
+    :param skip_errors: Skip zip members that fail to decompress or their CRC check instead of
+        raising.
+    :return: The names of the extracted members.
+    """
+    wanted = set(members) if members is not None else None
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path, "r", allowZip64=True) as archive:
+            infos = [
+                info
+                for info in archive.infolist()
+                if not info.is_dir()
+                and (wanted is None or info.filename in wanted)
+                and not _is_present(_target(dest, info.filename), info.file_size)
+            ]
+        local = threading.local()
+        archives = []
+
+        def extract_zip(info: zipfile.ZipInfo) -> Optional[str]:
+            if getattr(local, "archive", None) is None:
+                local.archive = zipfile.ZipFile(archive_path, "r", allowZip64=True)
+                archives.append(local.archive)
+            try:
+                data = local.archive.read(info)
+            except zipfile.error:
+                if not skip_errors:
+                    raise
+                return None
+            _write(_target(dest, info.filename), data)
+            return info.filename
+
+        try:
+            return _run(extract_zip, infos, num_workers)
+        finally:
+            for archive in archives:
+                archive.close()
+
+    if archive_path.endswith((".tar.gz", ".tgz")):
+        tar_path = (
+            archive_path[:-3] if archive_path.endswith(".tar.gz") else archive_path[:-4] + ".tar"
+        )
+        if not os.path.isfile(tar_path):
+            ArchiveReader.recompress(archive_path, tar_path)
+        return extract(tar_path, dest, members, num_workers, skip_errors)
+
+    try:
+        archive = tarfile.open(archive_path, "r:")
+    except tarfile.ReadError:
+        return _extract_stream(archive_path, dest, wanted)
+    with archive:
+        infos = [
+            info
+            for info in archive
+            if info.isfile()
+            and (wanted is None or info.name in wanted)
+            and not _is_present(_target(dest, info.name), info.size)
+        ]
+    local = threading.local()
+    files = []
+
+    def extract_tar(info: tarfile.TarInfo) -> str:
+        # a handle per thread instead of `os.pread`, which does not exist on Windows
+        if getattr(local, "file", None) is None:
+            local.file = open(archive_path, "rb")
+            files.append(local.file)
+        local.file.seek(info.offset_data)
+        _write(_target(dest, info.name), local.file.read(info.size))
+        return info.name
+
+    try:
+        return _run(extract_tar, infos, num_workers)
+    finally:
+        for file in files:
+            file.close()
+
+
+def _run(fn, items: list, num_workers: int) -> List[str]:
+    names = []
+    with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as pool:
+        for name in tqdm(pool.map(fn, items), total=len(items), desc="Extracting"):
+            if name is not None:
+                names.append(name)
+    return names
+
+
+def _extract_stream(archive_path: str, dest: str, wanted: Optional[set]) -> List[str]:
+    names = []
+    with tarfile.open(archive_path, "r|*") as archive:
+        for info in tqdm(archive, desc="Extracting"):
+            if not info.isfile() or (wanted is not None and info.name not in wanted):
+                continue
+            target = _target(dest, info.name)
+            if _is_present(target, info.size):
+                continue
+            _write(target, archive.extractfile(info).read())
+            names.append(info.name)
+    return names
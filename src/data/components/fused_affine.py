@@ -0,0 +1,171 @@
+import math
+import random
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from albumentations.core.transforms_interface import DualTransform
+
+
+class FusedAffine(DualTransform):
+    """Geometric part of the landmark training pipeline applied with a single warp.
+
+    Composes `ShiftScaleRotate -> Resize -> CenterCrop -> HorizontalFlip -> VerticalFlip -> Rotate`
+    into one affine matrix per sample and warps the source crop straight to the output size, so
+    every pixel is resampled once instead of up to four times. Keypoints are transformed with the
+    same matrix. Each step keeps the sampling ranges and probabilities of its albumentations
+    counterpart; flips do not permute landmark indices, exactly as `HorizontalFlip` does.
+
+    Args:
+        height, width: output size (the center crop).
+        resize_height, resize_width: intermediate resize the center crop is taken from.
+        shift_limit, scale_limit, rotate_limit, shift_scale_rotate_p: as in `ShiftScaleRotate`.
+        hflip_p, vflip_p: probabilities of the horizontal and vertical flips.
+        extra_rotate_limit, extra_rotate_p: as in the trailing `Rotate`.
+        interpolation: OpenCV interpolation flag of the warp.
+        border_mode: OpenCV border mode of the warp.
+        value: padding value if border_mode is cv2.BORDER_CONSTANT.
+    """
+
+    def __init__(
+        self,
+        height: int = 224,
+        width: int = 224,
+        resize_height: int = 256,
+        resize_width: int = 256,
+        shift_limit: float = 0.05,
+        scale_limit: float = 0.05,
+        rotate_limit: float = 10,
+        shift_scale_rotate_p: float = 0.5,
+        hflip_p: float = 0.5,
+        vflip_p: float = 0.5,
+        extra_rotate_limit: float = 90,
+        extra_rotate_p: float = 0.5,
+        interpolation: int = cv2.INTER_LINEAR,
+        border_mode: int = cv2.BORDER_REFLECT_101,
+        value: Optional[Sequence[float]] = None,
+        always_apply: bool = True,
+        p: float = 1.0,
+    ):
+        super().__init__(always_apply, p)
+        self.height = height
+        self.width = width
+        self.resize_height = resize_height
+        self.resize_width = resize_width
+        self.shift_limit = shift_limit
+        self.scale_limit = scale_limit
+        self.rotate_limit = rotate_limit
+        self.shift_scale_rotate_p = shift_scale_rotate_p
+        self.hflip_p = hflip_p
+        self.vflip_p = vflip_p
+        self.extra_rotate_limit = extra_rotate_limit
+        self.extra_rotate_p = extra_rotate_p
+        self.interpolation = interpolation
+        self.border_mode = border_mode
+        self.value = value
+
+    def get_params(self) -> Dict[str, Any]:
+        params = {"angle": 0.0, "scale": 1.0, "dx": 0.0, "dy": 0.0, "extra_angle": 0.0}
+        if random.random() < self.shift_scale_rotate_p:
+            params.update(
+                angle=random.uniform(-self.rotate_limit, self.rotate_limit),
+                scale=random.uniform(1 - self.scale_limit, 1 + self.scale_limit),
+                dx=random.uniform(-self.shift_limit, self.shift_limit),
+                dy=random.uniform(-self.shift_limit, self.shift_limit),
+            )
+        params["hflip"] = random.random() < self.hflip_p
+        params["vflip"] = random.random() < self.vflip_p
+        if random.random() < self.extra_rotate_p:
+            params["extra_angle"] = random.uniform(
+                -self.extra_rotate_limit, self.extra_rotate_limit
+            )
+        return params
+
+    @staticmethod
+    def _rotation(center: Tuple[float, float], angle: float, scale: float = 1.0) -> np.ndarray:
+        matrix = np.eye(3)
+        matrix[:2] = cv2.getRotationMatrix2D(center, angle, scale)
+        return matrix
+
+    def get_matrix(self, rows: int, cols: int, **params) -> np.ndarray:
+        """3x3 matrix mapping source pixel coordinates to output pixel coordinates."""
+        # ShiftScaleRotate, about the center of the source crop
+        matrix = self._rotation(
+            ((cols - 1) * 0.5, (rows - 1) * 0.5), params["angle"], params["scale"]
+        )
+        matrix[0, 2] += params["dx"] * cols
+        matrix[1, 2] += params["dy"] * rows
+
+        # Resize, mapping pixel centers like cv2.resize, then CenterCrop
+        sx, sy = self.resize_width / cols, self.resize_height / rows
+        x0 = (self.resize_width - self.width) // 2
+        y0 = (self.resize_height - self.height) // 2
+        resize_crop = np.array(
+            [
+                [sx, 0.0, 0.5 * sx - 0.5 - x0],
+                [0.0, sy, 0.5 * sy - 0.5 - y0],
+                [0.0, 0.0, 1.0],
+            ]
+        )
+        matrix = resize_crop @ matrix
+
+        # flips
+        flip = np.eye(3)
+        if params["hflip"]:
+            flip[0, 0], flip[0, 2] = -1.0, self.width - 1
+        if params["vflip"]:
+            flip[1, 1], flip[1, 2] = -1.0, self.height - 1
+        matrix = flip @ matrix
+
+        # Rotate, about the center of the output
+        if params["extra_angle"]:
+            center = ((self.width - 1) * 0.5, (self.height - 1) * 0.5)
+            matrix = self._rotation(center, params["extra_angle"]) @ matrix
+        return matrix
+
+    def apply(self, img: np.ndarray, **params) -> np.ndarray:
+        matrix = self.get_matrix(**params)
+        return cv2.warpAffine(
+            img,
+            matrix[:2],
+            dsize=(self.width, self.height),
+            flags=self.interpolation,
+            borderMode=self.border_mode,
+            borderValue=self.value,
+        )
+
+    def apply_to_keypoints(self, keypoints: Sequence, **params) -> List:
+        if not len(keypoints):
+            return []
+        matrix = self.get_matrix(**params)
+        points = np.array([keypoint[:2] for keypoint in keypoints], dtype=np.float64)
+        points = points @ matrix[:2, :2].T + matrix[:2, 2]
+        rotation = math.atan2(matrix[1, 0], matrix[0, 0])
+        scale = math.sqrt(abs(np.linalg.det(matrix[:2, :2])))
+        return [
+            (x, y, (keypoint[2] + rotation) % (2 * math.pi), keypoint[3] * scale)
+            + tuple(keypoint[4:])
+            for (x, y), keypoint in zip(points.tolist(), keypoints)
+        ]
+
+    def apply_to_keypoint(self, keypoint, **params):
+        return self.apply_to_keypoints([keypoint], **params)[0]
+
+    def get_transform_init_args_names(self) -> Tuple[str, ...]:
+        return (
+            "height",
+            "width",
+            "resize_height",
+            "resize_width",
+            "shift_limit",
+            "scale_limit",
+            "rotate_limit",
+            "shift_scale_rotate_p",
+            "hflip_p",
+            "vflip_p",
+            "extra_rotate_limit",
+            "extra_rotate_p",
+            "interpolation",
+            "border_mode",
+            "value",
+        )
@@ -0,0 +1,169 @@
+import json
+import os
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+LabelParser = Callable[[str], Tuple[List[str], np.ndarray]]
+
+
+def roi_boxes_from_landmarks(landmarks: np.ndarray) -> np.ndarray:
+    """Vectorized version of `parse_roi_box_from_landmark` for a whole (N, 68, 2) array.
+
+    The box is the square around the landmarks, grown to the length of its diagonal.
+    """
+    landmarks = np.asarray(landmarks, dtype=np.float64)
+    mins = landmarks.min(axis=1)  # (N, 2)
+    maxs = landmarks.max(axis=1)  # (N, 2)
+    center = (mins + maxs) / 2
+    radius = (maxs - mins).max(axis=1) / 2  # (N,)
+    llength = np.sqrt(2.0) * 2 * radius
+    roi_boxes = np.empty((len(landmarks), 4), dtype=np.float32)
+    roi_boxes[:, 0:2] = center - llength[:, None] / 2
+    roi_boxes[:, 2:4] = roi_boxes[:, 0:2] + llength[:, None]
+    return roi_boxes
+
+
+class LabelStore:
+    """Compact, memory-mappable index of landmark annotations.
+
+    The store is a directory holding:
+        - `landmarks.npy`: float32 (N, 68, 2) landmark coordinates
+        - `roi_boxes.npy`: float32 (N, 4) precomputed ROI boxes (left, top, right, bottom)
+        - `names.npy`: uint8 blob with every image file name (utf-8) concatenated
+        - `offsets.npy`: int64 (N + 1) offset table into `names.npy`
+        - `meta.json`: size/mtime of every label file and its row range, used to update
+          incrementally
+
+    Arrays are opened with `mmap_mode='r'` lazily in each process and are never pickled, so
+    DataLoader workers share the page cache instead of holding their own copy of the labels.
+    """
+
+    VERSION = 1
+    ARRAYS = ("landmarks", "roi_boxes", "names", "offsets")
+
+    def __init__(self, store_dir: str):
+        self.store_dir = store_dir
+        with open(os.path.join(store_dir, "meta.json"), "r") as file:
+            self.meta = json.load(file)
+        self._arrays: Optional[Dict[str, np.ndarray]] = None
+
+    @classmethod
+    def open(cls, store_dir: str, label_files: Sequence[str], parser: LabelParser) -> "LabelStore":
+        """Load the store in `store_dir`, (re)building it first if any label file changed.
+
+        :param store_dir: Directory of the store.
+        :param label_files: Label files the store is built from, in order.
+        :param parser: Function mapping a label file to its file names and (n, 68, 2) landmarks.
+        """
+        sources = [cls._source_stat(path) for path in label_files]
+        meta = cls._read_meta(store_dir)
+        if meta is None or [s[:3] for s in meta["sources"]] != sources:
+            cls.build(store_dir, label_files, parser, previous=meta)
+        return cls(store_dir)
+
+    @classmethod
+    def build(
+        cls,
+        store_dir: str,
+        label_files: Sequence[str],
+        parser: LabelParser,
+        previous: Optional[dict] = None,
+    ) -> None:
+        """Write the store, re-parsing only the label files that changed since `previous`."""
+        os.makedirs(store_dir, exist_ok=True)
+        reusable = {}
+        if previous is not None:
+            old = cls(store_dir)
+            for path, size, mtime, start, stop in previous["sources"]:
+                reusable[(path, size, mtime)] = (
+                    [old.file_name(i) for i in range(start, stop)],
+                    np.array(old.landmarks[start:stop]),
+                )
+            old.close()
+
+        names: List[str] = []
+        landmarks: List[np.ndarray] = []
+        sources = []
+        for path in label_files:
+            stat = cls._source_stat(path)
+            if tuple(stat) in reusable:
+                file_names, points = reusable[tuple(stat)]
+            else:
+                file_names, points = parser(path)
+            start = len(names)
+            names.extend(file_names)
+            landmarks.append(np.asarray(points, dtype=np.float32).reshape(-1, 68, 2))
+            sources.append([*stat, start, len(names)])
+
+        landmarks = np.concatenate(landmarks) if landmarks else np.zeros((0, 68, 2), np.float32)
+        encoded = [name.encode("utf-8") for name in names]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(name) for name in encoded])
+        arrays = {
+            "landmarks": landmarks,
+            "roi_boxes": roi_boxes_from_landmarks(landmarks),
+            "names": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "offsets": offsets,
+        }
+        for key, array in arrays.items():
+            tmp_path = os.path.join(store_dir, f"{key}.tmp.npy")
+            np.save(tmp_path, array)
+            os.replace(tmp_path, os.path.join(store_dir, f"{key}.npy"))
+
+        # meta is written last, so an interrupted build is detected as stale
+        tmp_path = os.path.join(store_dir, "meta.json.tmp")
+        with open(tmp_path, "w") as file:
+            json.dump({"version": cls.VERSION, "sources": sources}, file)
+        os.replace(tmp_path, os.path.join(store_dir, "meta.json"))
+
+    @classmethod
+    def _read_meta(cls, store_dir: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(store_dir, "meta.json"), "r") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return None
+        if meta.get("version") != cls.VERSION:
+            return None
+        if not all(os.path.isfile(os.path.join(store_dir, f"{key}.npy")) for key in cls.ARRAYS):
+            return None
+        return meta
+
+    @staticmethod
+    def _source_stat(path: str) -> list:
+        stat = os.stat(path)
+        return [os.path.abspath(path), stat.st_size, stat.st_mtime_ns]
+
+    def _load(self) -> Dict[str, np.ndarray]:
+        if self._arrays is None:
+            self._arrays = {
+                key: np.load(os.path.join(self.store_dir, f"{key}.npy"), mmap_mode="r")
+                for key in self.ARRAYS
+            }
+        return self._arrays
+
+    def close(self) -> None:
+        self._arrays = None
+
+    @property
+    def landmarks(self) -> np.ndarray:
+        return self._load()["landmarks"]
+
+    @property
+    def roi_boxes(self) -> np.ndarray:
+        return self._load()["roi_boxes"]
+
+    def file_name(self, index: int) -> str:
+        arrays = self._load()
+        start, stop = arrays["offsets"][index], arrays["offsets"][index + 1]
+        return arrays["names"][start:stop].tobytes().decode("utf-8")
+
+    def __len__(self) -> int:
+        return self.meta["sources"][-1][4] if self.meta["sources"] else 0
+
+    def __getstate__(self) -> dict:
+        # never pickle the memory maps, every worker re-opens them on first access
+        state = self.__dict__.copy()
+        state["_arrays"] = None
+        return state
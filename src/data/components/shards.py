@@ -0,0 +1,234 @@
+import io
+import json
+import os
+import random
+import tarfile
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import torch.distributed as dist
+from PIL import Image
+from torch.utils.data import DataLoader, Dataset, IterableDataset, get_worker_info
+from tqdm import tqdm
+
+
+class _EncodedSamples(Dataset):
+    """Encodes the samples of a DLIB/DLIB_LPA style dataset as `(jpeg bytes, npy bytes)`."""
+
+    def __init__(self, data: Dataset, quality: int):
+        self.data = data
+        self.quality = quality
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        sample = self.data[index]
+        image = sample["image"]
+        if not isinstance(image, Image.Image):
+            image = Image.fromarray(np.asarray(image))
+        image_buffer = io.BytesIO()
+        image.convert("RGB").save(image_buffer, format="JPEG", quality=self.quality)
+        landmark_buffer = io.BytesIO()
+        np.save(landmark_buffer, np.asarray(sample["landmark"], dtype=np.float32))
+        return image_buffer.getvalue(), landmark_buffer.getvalue()
+
+
+def _add_member(archive: tarfile.TarFile, name: str, data: bytes) -> None:
+    info = tarfile.TarInfo(name)
+    info.size = len(data)
+    archive.addfile(info, io.BytesIO(data))
+
+
+def write_shards(
+    dataset: Dataset,
+    shard_dir: str,
+    shard_size: int = 1000,
+    quality: int = 95,
+    num_workers: int = 0,
+    key: Optional[Any] = None,
+) -> None:
+    """Write `dataset` into fixed-size tar shards for sequential reading.
+
+    Every sample is stored as `<index>.jpg` (the ROI crop) and `<index>.npy` (its keypoints).
+    `index.json` lists the shards with their sample counts and the `key` they were built for.
+
+    :param dataset: A `DLIB`, `DLIB_LPA` or `CropCache` dataset, or a `Subset` of one.
+    :param shard_dir: Output directory.
+    :param shard_size: Number of samples per shard.
+    :param quality: JPEG quality of the stored crops.
+    :param num_workers: Number of DataLoader workers used to load and encode samples.
+    :param key: Anything JSON serializable identifying the source, see
+        `ShardedIterableDataset.is_valid`.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    index_path = os.path.join(shard_dir, "index.json")
+    if os.path.isfile(index_path):
+        os.remove(index_path)
+
+    loader = DataLoader(
+        _EncodedSamples(dataset, quality), batch_size=None, shuffle=False, num_workers=num_workers
+    )
+    shards: List[List[Any]] = []
+    archive = None
+    progress = tqdm(loader, total=len(dataset), desc="Writing shards")
+    for index, (image, landmark) in enumerate(progress):
+        if index % shard_size == 0:
+            if archive is not None:
+                archive.close()
+            name = f"shard-{len(shards):05d}.tar"
+            archive = tarfile.open(os.path.join(shard_dir, name), "w")
+            shards.append([name, 0])
+        _add_member(archive, f"{index:08d}.jpg", image)
+        _add_member(archive, f"{index:08d}.npy", landmark)
+        shards[-1][1] += 1
+    if archive is not None:
+        archive.close()
+
+    with open(index_path, "w") as file:
+        json.dump({"key": key, "shard_size": shard_size, "shards": shards}, file)
+
+
+class ShardedIterableDataset(IterableDataset):
+    """Streams samples from the tar shards written by `write_shards`.
+
+    Shards are shuffled every epoch and split across DDP ranks first and DataLoader workers second,
+    then samples are shuffled within an in-memory buffer of `buffer_size` samples. Every shard is
+    read front to back, so the disk only sees sequential reads.
+
+    With DDP, only full shards are used and their number is truncated to a multiple of the world
+    size, so every rank yields the same number of samples. A split with fewer full shards than
+    ranks is split by sample instead: every rank reads all shards and keeps every `world_size`-th
+    sample, up to the same count on every rank. The shard order depends on `seed` and
+    an epoch counter that each worker advances on every pass: keep `persistent_workers=True` when
+    `num_workers > 0` so all workers agree on the epoch.
+
+    :param shard_dir: Directory written by `write_shards`.
+    :param transform: Callable mapping a raw `{'image', 'landmark'}` sample to the training sample,
+        e.g. `TransformDLIB.apply`.
+    :param shuffle: Whether to shuffle shards and samples.
+    :param buffer_size: Size of the shuffle buffer.
+    :param seed: Base seed of the shard and buffer shuffling.
+    """
+
+    def __init__(
+        self,
+        shard_dir: str,
+        transform: Optional[Callable[[Dict[str, Any]], Any]] = None,
+        shuffle: bool = True,
+        buffer_size: int = 1000,
+        seed: int = 42,
+    ):
+        super().__init__()
+        self.shard_dir = shard_dir
+        self.transform = transform
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.epoch = 0
+        with open(os.path.join(shard_dir, "index.json"), "r") as file:
+            self.meta = json.load(file)
+
+    @staticmethod
+    def is_valid(shard_dir: str, key: Any) -> bool:
+        """Whether `shard_dir` holds complete shards written for `key`."""
+        try:
+            with open(os.path.join(shard_dir, "index.json"), "r") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return False
+        return meta.get("key") == key
+
+    @staticmethod
+    def _world() -> Tuple[int, int]:
+        if dist.is_available() and dist.is_initialized():
+            return dist.get_rank(), dist.get_world_size()
+        return 0, 1
+
+    def _split_samples(self, world_size: int) -> bool:
+        """Whether samples rather than shards are split across ranks, see the class docstring."""
+        full = sum(count == self.meta["shard_size"] for _, count in self.meta["shards"])
+        return world_size > 1 and full < world_size
+
+    def _rank_shards(self, world_size: int) -> List[List[Any]]:
+        shards = self.meta["shards"]
+        if world_size > 1 and not self._split_samples(world_size):
+            shards = [shard for shard in shards if shard[1] == self.meta["shard_size"]]
+            shards = shards[: len(shards) - len(shards) % world_size]
+        return shards
+
+    def set_epoch(self, epoch: int) -> None:
+        self.epoch = epoch
+
+    def __len__(self):
+        _, world_size = self._world()
+        return sum(count for _, count in self._rank_shards(world_size)) // world_size
+
+    def _process_shards(self, rng: random.Random) -> List[Tuple[str, int]]:
+        """Shards of this rank and worker with the position of their first sample in the epoch."""
+        rank, world_size = self._world()
+        shards = self._rank_shards(world_size)
+        if self.shuffle:
+            shards = list(shards)
+            rng.shuffle(shards)
+        starts = np.cumsum([0] + [count for _, count in shards[:-1]]).tolist()
+        shards = [(name, start) for (name, _), start in zip(shards, starts)]
+        if not self._split_samples(world_size):
+            shards = shards[rank::world_size]
+        info = get_worker_info()
+        if info is not None:
+            shards = shards[info.id :: info.num_workers]
+        return shards
+
+    def _rank_samples(self, shards: List[Tuple[str, int]]) -> Iterator[Dict[str, Any]]:
+        rank, world_size = self._world()
+        if not self._split_samples(world_size):
+            for name, _ in shards:
+                yield from self._read_shard(name)
+            return
+        end = len(self) * world_size
+        for name, start in shards:
+            for position, sample in enumerate(self._read_shard(name), start):
+                if position < end and position % world_size == rank:
+                    yield sample
+
+    def _read_shard(self, name: str) -> Iterator[Dict[str, Any]]:
+        sample = {}
+        with tarfile.open(os.path.join(self.shard_dir, name), "r|") as archive:
+            for member in archive:
+                data = archive.extractfile(member).read()
+                if member.name.endswith(".jpg"):
+                    sample["image"] = Image.open(io.BytesIO(data)).convert("RGB")
+                else:
+                    sample["landmark"] = np.load(io.BytesIO(data))
+                if len(sample) == 2:
+                    yield sample
+                    sample = {}
+
+    def __iter__(self):
+        # same shard order on every rank and worker, different every epoch
+        rng = random.Random(self.seed + self.epoch)
+        shards = self._process_shards(rng)
+        self.epoch += 1
+
+        info = get_worker_info()
+        buffer_rng = random.Random(
+            self.seed + self.epoch * 1000 + (info.id if info is not None else 0)
+        )
+        buffer: List[Dict[str, Any]] = []
+        for sample in self._rank_samples(shards):
+            if not self.shuffle:
+                yield self._apply(sample)
+                continue
+            if len(buffer) < self.buffer_size:
+                buffer.append(sample)
+                continue
+            index = buffer_rng.randrange(len(buffer))
+            buffer[index], sample = sample, buffer[index]
+            yield self._apply(sample)
+        buffer_rng.shuffle(buffer)
+        for sample in buffer:
+            yield self._apply(sample)
+
+    def _apply(self, sample: Dict[str, Any]) -> Any:
+        return self.transform(sample) if self.transform is not None else sample
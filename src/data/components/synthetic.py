@@ -0,0 +1,243 @@
+import argparse
+import os
+import tarfile
+import xml.etree.ElementTree as ET
+import zipfile
+from typing import Iterator, List, Optional, Tuple
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFilter
+from tqdm import tqdm
+
+DLIB_FOLDER = "ibug_300W_large_face_landmark_dataset"
+DLIB_LABELS_FILE = "labels_ibug_300W.xml"
+DLIB_ARCHIVE = "ibug_300W_large_face_landmark_dataset.tar.gz"
+LPA_FOLDER = "300WLPA_2d"
+LPA_LABELS_FILES = [
+    "300WLPA_AFW_1.txt",
+    "300WLPA_HELEN_1.txt",
+    "300WLPA_HELEN_10001.txt",
+    "300WLPA_HELEN_20001.txt",
+    "300WLPA_HELEN_30001.txt",
+    "300WLPA_LFPW.txt",
+]
+LPA_ARCHIVE = "300WLPA_2d.zip"
+
+
+def _ellipse(
+    center: Tuple[float, float], axes: Tuple[float, float], angles: np.ndarray
+) -> np.ndarray:
+    return np.stack(
+        [center[0] + axes[0] * np.cos(angles), center[1] + axes[1] * np.sin(angles)], axis=1
+    )
+
+
+def mean_shape() -> np.ndarray:
+    """A frontal 68-point face in the iBUG 300W order, spanning about [-1, 1] horizontally.
+
+    x grows to the right of the image and y downwards, as in image coordinates.
+    """
+    theta = np.radians(np.linspace(-100, 100, 17))
+    jaw = np.stack([np.sin(theta), -0.2 + np.cos(theta)], axis=1)
+    brow_x = np.linspace(-0.8, -0.15, 5)
+    right_brow = np.stack(
+        [brow_x, -0.55 - 0.12 * np.sin(np.linspace(0.2, np.pi - 0.2, 5))], axis=1
+    )
+    left_brow = right_brow[::-1] * np.array([-1, 1])
+    bridge = np.stack([np.zeros(4), np.linspace(-0.4, 0.05, 4)], axis=1)
+    nostrils = np.stack(
+        [np.linspace(-0.2, 0.2, 5), 0.15 + 0.04 * np.cos(np.linspace(-np.pi / 2, np.pi / 2, 5))],
+        axis=1,
+    )
+    # corner, two top points, corner, two bottom points, clockwise from the image-left corner
+    eye_angles = np.radians([180, 240, 300, 0, 60, 120])
+    right_eye = _ellipse((-0.45, -0.3), (0.16, 0.07), eye_angles)
+    left_eye = _ellipse((0.45, -0.3), (0.16, 0.07), eye_angles)
+    outer_mouth = _ellipse((0.0, 0.45), (0.35, 0.15), np.radians(np.linspace(180, 510, 12)))
+    inner_mouth = _ellipse((0.0, 0.45), (0.25, 0.05), np.radians(np.linspace(180, 495, 8)))
+    brows_nose = [right_brow, left_brow, bridge, nostrils]
+    parts = [jaw, *brows_nose, right_eye, left_eye, outer_mouth, inner_mouth]
+    return np.concatenate(parts).astype(np.float32)
+
+
+def random_landmarks(rng: np.random.Generator, width: int, height: int) -> np.ndarray:
+    """A randomly posed 68-point face inside a `width` x `height` image."""
+    shape = mean_shape()
+    # yaw: compress the side turning away, roll: rotate, plus some per-point jitter
+    yaw = rng.uniform(-0.4, 0.4)
+    shape[:, 0] *= np.where(shape[:, 0] * yaw > 0, 1 - abs(yaw), 1)
+    shape[:, 0] += 0.3 * yaw * (1 - shape[:, 1] ** 2).clip(0)
+    roll = np.radians(rng.uniform(-20, 20))
+    rotation = np.array(
+        [[np.cos(roll), -np.sin(roll)], [np.sin(roll), np.cos(roll)]], dtype=np.float32
+    )
+    shape = shape @ rotation.T + rng.normal(0, 0.015, shape.shape)
+    half_width = rng.uniform(0.12, 0.3) * min(width, height)
+    center = np.array([rng.uniform(0.35, 0.65) * width, rng.uniform(0.4, 0.6) * height])
+    return (shape * half_width + center).astype(np.float32)
+
+
+def render_face(
+    rng: np.random.Generator, width: int, height: int, landmarks: np.ndarray
+) -> Image.Image:
+    """Draw a crude face following `landmarks` over a smooth random background."""
+    background = rng.integers(
+        0, 255, (max(height // 64, 2), max(width // 64, 2), 3), dtype=np.uint8
+    )
+    image = Image.fromarray(background).resize((width, height), Image.BICUBIC)
+    draw = ImageDraw.Draw(image)
+    skin = tuple(int(v) for v in rng.integers(90, 230, 3))
+    dark = tuple(int(v * 0.4) for v in skin)
+    jaw, brows = landmarks[:17], (landmarks[17:22], landmarks[22:27])
+    top = brows[0][:, 1].min() - (jaw[:, 1].max() - brows[0][:, 1].min()) * 0.3
+    face = np.concatenate([jaw, [[jaw[-1, 0], top], [jaw[0, 0], top]]])
+    draw.polygon([tuple(p) for p in face], fill=skin)
+    line_width = max(int(np.ptp(jaw[:, 0]) / 60), 1)
+    for brow in brows:
+        draw.line([tuple(p) for p in brow], fill=dark, width=2 * line_width)
+    draw.line([tuple(p) for p in landmarks[27:31]], fill=dark, width=line_width)
+    draw.line([tuple(p) for p in landmarks[31:36]], fill=dark, width=line_width)
+    for eye in (landmarks[36:42], landmarks[42:48]):
+        draw.polygon([tuple(p) for p in eye], fill=(240, 240, 240), outline=dark)
+        center = eye.mean(axis=0)
+        radius = np.ptp(eye[:, 1]) * 0.4
+        draw.ellipse([*(center - radius), *(center + radius)], fill=dark)
+    draw.polygon([tuple(p) for p in landmarks[48:60]], fill=(160, 60, 60))
+    draw.polygon([tuple(p) for p in landmarks[60:68]], fill=(60, 20, 20))
+    return image.filter(ImageFilter.GaussianBlur(radius=1))
+
+
+def generate(
+    num_images: int,
+    seed: int = 0,
+    min_size: int = 480,
+    max_size: int = 1600,
+) -> Iterator[Tuple[Image.Image, np.ndarray]]:
+    """Yield `num_images` synthetic `(image, landmarks)` pairs at 300W-like resolutions."""
+    rng = np.random.default_rng(seed)
+    for _ in range(num_images):
+        width = int(rng.integers(min_size, max_size + 1))
+        height = int(width * rng.choice([0.75, 1.0, 1.33]))
+        landmarks = random_landmarks(rng, width, height)
+        yield render_face(rng, width, height, landmarks), landmarks
+
+
+def write_dlib(
+    origin_path: str,
+    num_images: int = 200,
+    seed: int = 0,
+    min_size: int = 480,
+    max_size: int = 1600,
+    quality: int = 90,
+    archive: bool = False,
+) -> str:
+    """Write a synthetic dataset in the layout of the extracted dlib 300W download.
+
+    `DLIB(origin_path=origin_path)` then loads it without downloading anything. With `archive`,
+    the `.tar.gz` is written as well, for the `from_archive` path.
+
+    :return: `origin_path`.
+    """
+    folder = os.path.join(origin_path, DLIB_FOLDER)
+    os.makedirs(os.path.join(folder, "synthetic"), exist_ok=True)
+    dataset = ET.Element("dataset")
+    ET.SubElement(dataset, "name").text = "Synthetic iBUG 300W"
+    images = ET.SubElement(dataset, "images")
+    samples = generate(num_images, seed, min_size, max_size)
+    progress = tqdm(samples, total=num_images, desc="Writing synthetic 300W")
+    for index, (image, landmarks) in enumerate(progress):
+        file_name = f"synthetic/{index:05d}.jpg"
+        image.save(os.path.join(folder, file_name), quality=quality)
+        element = ET.SubElement(
+            images, "image", file=file_name, width=str(image.width), height=str(image.height)
+        )
+        left, top = np.floor(landmarks.min(axis=0)).astype(int)
+        right, bottom = np.ceil(landmarks.max(axis=0)).astype(int)
+        box = ET.SubElement(
+            element,
+            "box",
+            top=str(top),
+            left=str(left),
+            width=str(right - left),
+            height=str(bottom - top),
+        )
+        for part, (x, y) in enumerate(np.rint(landmarks).astype(int)):
+            ET.SubElement(box, "part", name=f"{part:02d}", x=str(x), y=str(y))
+    ET.ElementTree(dataset).write(os.path.join(folder, DLIB_LABELS_FILE))
+
+    if archive:
+        with tarfile.open(os.path.join(origin_path, DLIB_ARCHIVE), "w:gz") as file:
+            file.add(folder, arcname=DLIB_FOLDER)
+    return origin_path
+
+
+def write_lpa(
+    origin_path: str,
+    num_images: int = 200,
+    seed: int = 0,
+    min_size: int = 480,
+    max_size: int = 1600,
+    quality: int = 90,
+    archive: bool = False,
+) -> str:
+    """Write a synthetic dataset in the layout of the extracted 300W-LPA zip.
+
+    Images are spread over the six `300WLPA_*.txt` label files, one
+    `name x_1 ... x_68 y_1 ... y_68` line each. `DLIB_LPA(origin_path=origin_path)` then loads it
+    without downloading anything. With `archive`, the zip is written as well, for the
+    `from_archive` path.
+
+    :return: `origin_path`.
+    """
+    folder = os.path.join(origin_path, LPA_FOLDER)
+    lines: List[List[str]] = [[] for _ in LPA_LABELS_FILES]
+    samples = generate(num_images, seed, min_size, max_size)
+    progress = tqdm(samples, total=num_images, desc="Writing synthetic 300W-LPA")
+    for index, (image, landmarks) in enumerate(progress):
+        part = index % len(LPA_LABELS_FILES)
+        subset = LPA_LABELS_FILES[part].split("_")[1]
+        file_name = f"{subset}/synthetic_{index:05d}.jpg"
+        os.makedirs(os.path.join(folder, subset), exist_ok=True)
+        image.save(os.path.join(folder, file_name), quality=quality)
+        values = np.concatenate([landmarks[:, 0], landmarks[:, 1]])
+        lines[part].append(" ".join([file_name, *(f"{v:.3f}" for v in values)]))
+    for labels_file, part_lines in zip(LPA_LABELS_FILES, lines):
+        with open(os.path.join(folder, labels_file), "w") as file:
+            file.write("\n".join(part_lines) + "\n")
+
+    if archive:
+        with zipfile.ZipFile(os.path.join(origin_path, LPA_ARCHIVE), "w") as file:
+            for root, _, files in os.walk(folder):
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    file.write(path, os.path.relpath(path, origin_path))
+    return origin_path
+
+
+def main(args: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Write a synthetic 300W dataset for offline tests and benchmarks."
+    )
+    parser.add_argument("layout", choices=["dlib", "lpa"])
+    parser.add_argument("origin_path", help="use it as `data.data_dir`")
+    parser.add_argument("--num-images", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--min-size", type=int, default=480)
+    parser.add_argument("--max-size", type=int, default=1600)
+    parser.add_argument("--quality", type=int, default=90)
+    parser.add_argument("--archive", action="store_true", help="also write the downloaded archive")
+    args = parser.parse_args(args)
+    write = write_dlib if args.layout == "dlib" else write_lpa
+    write(
+        args.origin_path,
+        num_images=args.num_images,
+        seed=args.seed,
+        min_size=args.min_size,
+        max_size=args.max_size,
+        quality=args.quality,
+        archive=args.archive,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict
+
+import albumentations as A
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Dataset
+from tqdm import tqdm
+
+
+def transform_key(transform: Any) -> Any:
+    """JSON serializable description of an albumentations transform, else its `repr`."""
+    try:
+        return A.to_dict(transform)
+    except Exception:
+        return repr(transform)
+
+
+def hash_key(key: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class TensorCache(Dataset):
+    """Fully transformed samples of a deterministic split, e.g. `TransformDLIB` over val.
+
+    `build` runs the wrapped dataset once and stores every `(image, landmark)` pair in two
+    memory-mapped `.npy` files, so later epochs replay the split without decoding, cropping or
+    normalizing anything. Images keep the dtype emitted by the transform (float32, or uint8 with
+    `uint8_transport`). The cache is rebuilt whenever `key` changes, see `open`.
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        with open(os.path.join(cache_dir, "meta.json"), "r") as file:
+            self.meta = json.load(file)
+        self._images = None
+        self._landmarks = None
+
+    @classmethod
+    def open(
+        cls, dataset: Dataset, cache_dir: str, key: Dict[str, Any], num_workers: int = 0
+    ) -> "TensorCache":
+        """Open the cache in `cache_dir`, building it from `dataset` if missing or stale.
+
+        The cache is stale when built for another `key`.
+
+        :param dataset: A dataset of deterministic `(CHW image tensor, landmark array)` samples.
+        :param cache_dir: Directory of the cache.
+        :param key: Anything JSON serializable identifying the split and its transform.
+        :param num_workers: Number of DataLoader workers used to build the cache.
+        """
+        digest = hash_key(key)
+        try:
+            with open(os.path.join(cache_dir, "meta.json"), "r") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            meta = None
+        if meta is None or meta.get("key") != digest:
+            cls.build(dataset, cache_dir, digest, num_workers)
+        return cls(cache_dir)
+
+    @staticmethod
+    def build(dataset: Dataset, cache_dir: str, digest: str, num_workers: int = 0) -> None:
+        os.makedirs(cache_dir, exist_ok=True)
+        meta_path = os.path.join(cache_dir, "meta.json")
+        if os.path.isfile(meta_path):
+            os.remove(meta_path)
+
+        length = len(dataset)
+        loader = DataLoader(dataset, batch_size=None, shuffle=False, num_workers=num_workers)
+        images = landmarks = None
+        progress = tqdm(loader, total=length, desc="Caching transformed samples")
+        for index, (image, landmark) in enumerate(progress):
+            image = image.numpy() if isinstance(image, torch.Tensor) else np.asarray(image)
+            landmark = np.asarray(landmark, dtype=np.float32)
+            if images is None:
+                images = np.lib.format.open_memmap(
+                    os.path.join(cache_dir, "images.npy"),
+                    mode="w+",
+                    dtype=image.dtype,
+                    shape=(length, *image.shape),
+                )
+                landmarks = np.lib.format.open_memmap(
+                    os.path.join(cache_dir, "landmarks.npy"),
+                    mode="w+",
+                    dtype=np.float32,
+                    shape=(length, *landmark.shape),
+                )
+            if image.shape != images.shape[1:]:
+                raise ValueError(
+                    f"Sample {index} has shape {image.shape}, expected {images.shape[1:]}: "
+                    "the transform must produce a fixed image size to be cached"
+                )
+            images[index] = image
+            landmarks[index] = landmark
+        if images is not None:
+            images.flush()
+            landmarks.flush()
+        del images, landmarks
+
+        with open(meta_path, "w") as file:
+            json.dump({"key": digest, "length": length}, file)
+
+    def _load(self) -> None:
+        if self._images is None:
+            self._images = np.load(os.path.join(self.cache_dir, "images.npy"), mmap_mode="r")
+            self._landmarks = np.load(os.path.join(self.cache_dir, "landmarks.npy"), mmap_mode="r")
+
+    def __len__(self):
+        return self.meta["length"]
+
+    def __getitem__(self, index):
+        if index < 0 or index >= len(self):
+            raise IndexError(f"Index {index} is out of range")
+        self._load()
+        return torch.from_numpy(np.array(self._images[index])), np.array(self._landmarks[index])
+
+    def __getstate__(self):
+        # memory maps are re-opened by every worker
+        state = self.__dict__.copy()
+        state["_images"] = None
+        state["_landmarks"] = None
+        return state
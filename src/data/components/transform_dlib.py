@@ -14,9 +14,11 @@ from hydra.utils import instantiate
 import numpy as np
 from PIL import Image, ImageDraw
 from torchvision.transforms import ToTensor
+from src.data.components.transport import strip_normalize
+from src.utils.landmark_render import draw_landmarks
 
 class TransformDLIB(Dataset):
-    def __init__(self, data: DLIB, transform: Optional[A.Compose] = None):
+    def __init__(self, data: DLIB, transform: Optional[A.Compose] = None, uint8: bool = False):
         self.data = data
         self.transform = transform
         if self.transform is None:
@@ -24,11 +26,18 @@ class TransformDLIB(Dataset):
                 Normalize(),
                 ToTensorV2(),
             ], keypoint_params=A.KeypointParams(format='xy', remove_invisible=False))
+        # emit uint8 CHW images, normalization is done on the batch by the LightningModule
+        self.uint8 = uint8
+        if self.uint8:
+            self.transform = strip_normalize(self.transform)
     def __getitem__(self, index):
         # TODO: transform image and keypoint using self.transform
         # TODO: convert keypoints range to [0, 1] by diving it with the width and height
         # image shape: (H, W, C)
-        sample = self.data[index]
+        return self.apply(self.data[index])
+
+    def apply(self, sample):
+        """Transform a raw `{'image', 'landmark'}` sample to `(image, landmark in [-0.5, 0.5])`."""
         image = sample['image']
         landmark = sample['landmark']
         # print(landmark)
@@ -50,25 +59,9 @@ class TransformDLIB(Dataset):
         return image, landmark.astype(np.float32)
     
     @staticmethod
-    def tensors_annotation(images: torch.Tensor, keypoints: np.ndarray)->Image:
-        IMG_MEAN = [0.485, 0.456, 0.406]
-        IMG_STD = [0.229, 0.224, 0.225]
-
-        def denormalize(x, mean=IMG_MEAN, std=IMG_STD)->torch.Tensor:
-            # x: (B, C, H, W)
-            tensor = x.clone().permute(1, 2, 3, 0) # (C, H, W, B)
-            for t, m, s in zip(tensor, mean, std):
-                t.mul_(s).add_(m)
-            return torch.clamp(tensor, 0, 1).permute(3, 0, 1, 2) # (B, C, H, W)
-        
-        images = denormalize(images)
-        saved_imgs = []
-        for img, keypoint in zip(images, keypoints):
-            img = img.permute(1, 2, 0).numpy() * 255 # (H, W, C)
-            keypoint = (keypoint + 0.5) * np.array([img.shape[1], img.shape[0]]) #W, H
-            img = DLIB.image_annotation(Image.fromarray(img.astype(np.uint8)), keypoint)
-            saved_imgs.append(ToTensor()(img))
-        return torch.stack(saved_imgs)
+    def tensors_annotation(images: torch.Tensor, keypoints: np.ndarray) -> torch.Tensor:
+        # (B, C, H, W) float images in [0, 1] with the keypoints drawn in green
+        return draw_landmarks(images, torch.as_tensor(keypoints)).float() / 255
     
     @staticmethod
     def tensor_annotation(image: torch.Tensor, keypoint: np.ndarray)->Image:
@@ -76,6 +69,8 @@ class TransformDLIB(Dataset):
         IMG_STD = [0.229, 0.224, 0.225]
 
         def denormalize(x, mean=IMG_MEAN, std=IMG_STD)->torch.Tensor:
+            if x.dtype == torch.uint8:
+                return x.float() / 255
             tensor = x.clone()
             for t, m, s in zip(tensor, mean, std):
                 t.mul_(s).add_(m)
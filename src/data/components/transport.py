@@ -0,0 +1,40 @@
+from typing import List, Tuple
+
+import albumentations as A
+import numpy as np
+import torch
+from torch.utils.data import get_worker_info
+
+
+def strip_normalize(transform: A.Compose) -> A.Compose:
+    """Return `transform` without its `Normalize` steps, so `ToTensorV2` emits uint8 CHW tensors.
+
+    Normalization then happens on the collated batch, see `DLIBLitModule.normalize`.
+    """
+    keypoints = transform.processors.get("keypoints")
+    bboxes = transform.processors.get("bboxes")
+    return A.Compose(
+        [t for t in transform.transforms if not isinstance(t, A.Normalize)],
+        bbox_params=bboxes.params if bboxes is not None else None,
+        keypoint_params=keypoints.params if keypoints is not None else None,
+        additional_targets=transform.additional_targets,
+        p=transform.p,
+    )
+
+
+def uint8_collate(
+    batch: List[Tuple[torch.Tensor, np.ndarray]]
+) -> Tuple[torch.Tensor, torch.Tensor]:
+    """Collate `(uint8 CHW image, landmark)` samples into one contiguous uint8 batch.
+
+    Inside a DataLoader worker the batch buffer is allocated once in shared memory, so the
+    images are copied a single time and cross the worker queue at a quarter of the float32 size.
+    """
+    images, landmarks = zip(*batch)
+    out = None
+    if get_worker_info() is not None:
+        shape = (len(images), *images[0].shape)
+        out = torch.empty(shape, dtype=images[0].dtype).share_memory_()
+    images = torch.stack(images, 0, out=out)
+    landmarks = torch.from_numpy(np.stack(landmarks).astype(np.float32, copy=False))
+    return images, landmarks
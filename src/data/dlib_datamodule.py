@@ -1,4 +1,5 @@
-from typing import Any, Dict, Optional, Tuple
+import os
+from typing import Any, Callable, Dict, Optional, Tuple
 import pyrootutils
 pyrootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
 
@@ -6,6 +7,11 @@ import torch
 from lightning import LightningDataModule
 from torch.utils.data import ConcatDataset, DataLoader, Dataset, random_split
 from src.data.components.dlib import DLIB
+from src.data.components.crop_cache import CropCache
+from src.data.components.shards import ShardedIterableDataset, write_shards
+from src.data.components.tensor_cache import TensorCache, hash_key, transform_key
+from src.data.components.transport import uint8_collate
+from src.utils.landmark_render import render_grid
 from src.data.components.transform_dlib import TransformDLIB
 from torchvision.transforms import transforms
 import matplotlib.pyplot as plt
@@ -34,6 +40,14 @@ class DLIBDataModule(LightningDataModule):
         batch_size: int = 64,
         num_workers: int = 4,
         pin_memory: bool = False,
+        crop_cache: Optional[Dict[str, Any]] = None,
+        uint8_transport: bool = False,
+        from_archive: bool = False,
+        streaming: Optional[Dict[str, Any]] = None,
+        split_seed: int = 42,
+        cache_eval: bool = False,
+        decode_size: Optional[int] = None,
+        worker_init_fn: Optional[Callable[[int], None]] = None,
     ):
         super().__init__()
 
@@ -59,9 +73,39 @@ class DLIBDataModule(LightningDataModule):
 
         Do not use it to assign state (self.x = y).
         """
-        dataset = DLIB()
+        dataset = self.create_dataset()
         dataset.prepare_data()
         dataset.prepare_labels()
+        data = self.load_dataset(dataset)
+        if self.hparams.streaming:
+            shard_dir = self.shard_dir(dataset.origin_path)
+            key = self.shard_key(data, dataset)
+            if not ShardedIterableDataset.is_valid(shard_dir, key):
+                data_train, _, _ = self.split(data)
+                write_shards(
+                    data_train,
+                    shard_dir,
+                    shard_size=self.hparams.streaming.get("shard_size", 1000),
+                    quality=self.hparams.streaming.get("quality", 95),
+                    num_workers=self.hparams.num_workers,
+                    key=key,
+                )
+        if self.hparams.cache_eval:
+            _, data_val, data_test = self.split(data)
+            self.load_eval_cache(
+                "val",
+                TransformDLIB(
+                    data_val, self.hparams.transform_val, uint8=self.hparams.uint8_transport
+                ),
+                dataset,
+            )
+            self.load_eval_cache(
+                "test",
+                TransformDLIB(
+                    data_test, self.hparams.transform_val, uint8=self.hparams.uint8_transport
+                ),
+                dataset,
+            )
 
     def setup(self, stage: Optional[str] = None):
         """Load data. Set variables: `self.data_train`, `self.data_val`, `self.data_test`.
@@ -71,23 +115,116 @@ class DLIBDataModule(LightningDataModule):
         """
         # load and split datasets only if not loaded already
         if not self.data_train and not self.data_val and not self.data_test:
-            dataset = DLIB()
-            self.data_train, self.data_val, self.data_test = random_split(
-                dataset=dataset,
-                lengths=self.hparams.train_val_test_split,
-                generator=torch.Generator().manual_seed(42),
+            origin = self.create_dataset()
+            dataset = self.load_dataset(origin)
+            self.data_train, self.data_val, self.data_test = self.split(dataset)
+            self.data_train = TransformDLIB(
+                self.data_train, self.hparams.transform_train, uint8=self.hparams.uint8_transport
+            )
+            if self.hparams.streaming:
+                # the train split is read sequentially from the shards written by `prepare_data`
+                self.data_train = ShardedIterableDataset(
+                    self.shard_dir(origin.origin_path),
+                    transform=self.data_train.apply,
+                    buffer_size=self.hparams.streaming.get("buffer_size", 1000),
+                    seed=self.hparams.streaming.get("seed", 42),
+                )
+            self.data_val = TransformDLIB(
+                self.data_val, self.hparams.transform_val, uint8=self.hparams.uint8_transport
             )
-            self.data_train = TransformDLIB(self.data_train, self.hparams.transform_train)
-            self.data_val = TransformDLIB(self.data_val, self.hparams.transform_val)
-            self.data_test = TransformDLIB(self.data_test, self.hparams.transform_val)
+            self.data_test = TransformDLIB(
+                self.data_test, self.hparams.transform_val, uint8=self.hparams.uint8_transport
+            )
+            if self.hparams.cache_eval:
+                self.data_val = self.load_eval_cache("val", self.data_val, origin)
+                self.data_test = self.load_eval_cache("test", self.data_test, origin)
+
+    def create_dataset(self) -> DLIB:
+        return DLIB(
+            from_archive=self.hparams.from_archive,
+            decode_size=self.hparams.decode_size,
+            origin_path=self.hparams.data_dir,
+        )
+
+    def load_dataset(self, dataset: DLIB) -> Dataset:
+        """Wrap `dataset` with its ROI crop cache if `crop_cache` is set, building it if needed.
+
+        `crop_cache` holds the arguments of `CropCache.open`, e.g. `{size: 288, mode: memmap}`.
+        """
+        if not self.hparams.crop_cache:
+            return dataset
+        cache_cfg = dict(self.hparams.crop_cache)
+        cache_dir = cache_cfg.pop("cache_dir", None)
+        if cache_dir is None:
+            size, mode = cache_cfg.get("size", 288), cache_cfg.get("mode", "memmap")
+            cache_dir = os.path.join(dataset.origin_path, f"crops_{size}_{mode}")
+        return CropCache.open(dataset, cache_dir, **cache_cfg)
+
+    def split(self, dataset: Dataset) -> Tuple[Dataset, Dataset, Dataset]:
+        return random_split(
+            dataset=dataset,
+            lengths=self.hparams.train_val_test_split,
+            generator=torch.Generator().manual_seed(self.hparams.split_seed),
+        )
+
+    def load_eval_cache(self, name: str, data: Dataset, origin: Dataset) -> Dataset:
+        """Replace the transformed `name` split with its `TensorCache`, building it if needed.
+
+        The cache directory is named after a hash of the split seed, split ratios, decode size,
+        transform config and source labels, so changing any of them builds a fresh cache next to
+        the old one.
+        """
+        if len(data) == 0:
+            return data
+        key = {
+            "split": name,
+            "split_ratios": list(self.hparams.train_val_test_split),
+            "split_seed": self.hparams.split_seed,
+            "length": len(data),
+            "labels": getattr(origin.img_labels, "meta", None),
+            "crop_cache": dict(self.hparams.crop_cache) if self.hparams.crop_cache else None,
+            "decode_size": self.hparams.decode_size,
+            "transform": transform_key(data.transform),
+            "uint8": self.hparams.uint8_transport,
+        }
+        cache_dir = os.path.join(origin.origin_path, f"{name}_tensors_{hash_key(key)[:12]}")
+        return TensorCache.open(data, cache_dir, key, num_workers=self.hparams.num_workers)
+
+    def shard_dir(self, origin_path: str) -> str:
+        """Train shard directory, `streaming.shard_dir` or `<origin_path>/shards_<shard_size>`."""
+        shard_dir = self.hparams.streaming.get("shard_dir")
+        if shard_dir is None:
+            shard_dir = os.path.join(
+                origin_path, f"shards_{self.hparams.streaming.get('shard_size', 1000)}"
+            )
+        return shard_dir
+
+    def shard_key(self, dataset: Dataset, origin: Dataset) -> Dict[str, Any]:
+        """Identifies the train split the shards hold, so they are rewritten when it changes."""
+        crop_cache = dict(self.hparams.crop_cache) if self.hparams.crop_cache else None
+        return {
+            "length": len(dataset),
+            "labels": getattr(origin.img_labels, "meta", None),
+            "split": list(self.hparams.train_val_test_split),
+            "split_seed": self.hparams.split_seed,
+            "crop_cache": crop_cache,
+            "decode_size": self.hparams.decode_size,
+            "shard_size": self.hparams.streaming.get("shard_size", 1000),
+            "quality": self.hparams.streaming.get("quality", 95),
+        }
 
     def train_dataloader(self):
+        streaming = bool(self.hparams.streaming)
         return DataLoader(
             dataset=self.data_train,
             batch_size=self.hparams.batch_size,
             num_workers=self.hparams.num_workers,
             pin_memory=self.hparams.pin_memory,
-            shuffle=True,
+            worker_init_fn=self.hparams.worker_init_fn,
+            collate_fn=uint8_collate if self.hparams.uint8_transport else None,
+            # shards are shuffled by the dataset, persistent workers keep its epoch counter
+            shuffle=not streaming,
+            persistent_workers=streaming and self.hparams.num_workers > 0,
         )
 
     def val_dataloader(self):
@@ -96,6 +233,8 @@ class DLIBDataModule(LightningDataModule):
             batch_size=self.hparams.batch_size,
             num_workers=self.hparams.num_workers,
             pin_memory=self.hparams.pin_memory,
+            worker_init_fn=self.hparams.worker_init_fn,
+            collate_fn=uint8_collate if self.hparams.uint8_transport else None,
             shuffle=False,
         )
 
@@ -105,6 +244,8 @@ class DLIBDataModule(LightningDataModule):
             batch_size=self.hparams.batch_size,
             num_workers=self.hparams.num_workers,
             pin_memory=self.hparams.pin_memory,
+            worker_init_fn=self.hparams.worker_init_fn,
+            collate_fn=uint8_collate if self.hparams.uint8_transport else None,
             shuffle=False,
         )
 
@@ -122,29 +263,7 @@ class DLIBDataModule(LightningDataModule):
 
     @staticmethod
     def batch_visualize(images: torch.Tensor, keypoints: np.ndarray)->None:
-        IMG_MEAN = [0.485, 0.456, 0.406]
-        IMG_STD = [0.229, 0.224, 0.225]
-
-        def denormalize(x, mean=IMG_MEAN, std=IMG_STD)->torch.Tensor:
-            # x: (B, C, H, W)
-            tensor = x.clone().permute(1, 2, 3, 0) # (C, H, W, B)
-            for t, m, s in zip(tensor, mean, std):
-                t.mul_(s).add_(m)
-            return torch.clamp(tensor, 0, 1).permute(3, 0, 1, 2) # (B, C, H, W)
-        
-        images = denormalize(images)
-        fig = plt.figure(figsize=(20, 20))
-        for i in range(len(images)):
-            image = images[i].permute(1, 2, 0).numpy() * 255
-            keypoint = (keypoints[i] + 0.5) * np.array([image.shape[1], image.shape[0]]) #W, H
-            ax = fig.add_subplot(8, 8, i+1, xticks=[], yticks=[])
-            x_values = [x for x, y in keypoint]
-            y_values = [y for x, y in keypoint]
-            plt.scatter(x_values, y_values, s=10, marker='.', c='r')
-            plt.imshow(image.astype(np.uint8))
-            plt.axis('off')
-        plt.savefig('batch.png')    
-        plt.show()
+        torchvision.utils.save_image(render_grid(images, torch.as_tensor(keypoints)), "batch.png")
 
 @hydra.main(version_base=None, config_path="../../configs/", config_name="train.yaml")
 def main(cfg: DictConfig):
@@ -0,0 +1,91 @@
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import torch
+from torch import Tensor
+from torchmetrics.metric import Metric
+from torchmetrics.utilities.data import dim_zero_cat
+
+from src.models.components.nme import per_sample_nme
+
+
+class CED(Metric):
+    """Cumulative error distribution of the per-sample NME, with failure rates and AUC.
+
+    Per-sample errors are computed for the whole batch in one tensor op and kept either as a
+    `cat` state (exact, memory grows with the test set) or, with `num_bins`, as a fixed-bin
+    histogram over `[0, max(max_error, thresholds)]` plus an overflow bin (constant memory,
+    thresholds and the curve are rounded to bin edges). Both states are synced across DDP ranks.
+
+    `compute` returns:
+        - `nme`: mean per-sample NME
+        - `fr@<t>`: fraction of samples with an error above every threshold `t`
+        - `auc@<max_error>`: area under the CED curve up to `max_error`, normalized to [0, 1]
+
+    `curve` returns the CED curve itself.
+    """
+
+    is_differentiable = False
+    higher_is_better = None
+    full_state_update = False
+
+    def __init__(
+        self,
+        thresholds: Sequence[float] = (0.08, 0.10),
+        max_error: float = 0.10,
+        num_bins: Optional[int] = None,
+        keypoint_indices: Sequence[int] = (36, 45),
+        **kwargs: Any,
+    ) -> None:
+        super().__init__(**kwargs)
+        self.thresholds = tuple(thresholds)
+        self.max_error = max_error
+        self.num_bins = num_bins
+        self.keypoint_indices = tuple(keypoint_indices)
+        self.hist_range = max(max_error, *self.thresholds)
+        if num_bins is None:
+            self.add_state("errors", default=[], dist_reduce_fx="cat")
+        else:
+            self.add_state(
+                "hist", default=torch.zeros(num_bins + 1, dtype=torch.long), dist_reduce_fx="sum"
+            )
+        self.add_state(
+            "error_sum", default=torch.tensor(0.0, dtype=torch.float64), dist_reduce_fx="sum"
+        )
+        self.add_state("total", default=torch.tensor(0), dist_reduce_fx="sum")
+
+    def update(self, preds: Tensor, target: Tensor) -> None:
+        errors = per_sample_nme(preds.detach(), target, self.keypoint_indices)
+        if self.num_bins is None:
+            self.errors.append(errors)
+        else:
+            index = (errors / self.hist_range * self.num_bins).long().clamp(0, self.num_bins)
+            self.hist += torch.bincount(index, minlength=self.num_bins + 1)
+        self.error_sum += errors.sum().double()
+        self.total += errors.numel()
+
+    def _cdf(self, x: Tensor) -> Tensor:
+        """Fraction of samples with an error <= every value of `x`."""
+        total = self.total.clamp(min=1)
+        if self.num_bins is None:
+            if isinstance(self.errors, list) and not self.errors:
+                return x.new_zeros(x.shape)
+            errors = dim_zero_cat(self.errors).sort().values
+            return torch.searchsorted(errors, x.to(errors.dtype), right=True).float() / total
+        # bin k covers [k, k + 1) * width, so the edge at k counts bins 0 .. k - 1
+        edges = (x / self.hist_range * self.num_bins).round().long().clamp(0, self.num_bins)
+        cumulative = torch.cat([self.hist.new_zeros(1), self.hist.cumsum(0)])
+        return cumulative[edges].float() / total
+
+    def curve(self, steps: int = 100) -> Tuple[Tensor, Tensor]:
+        """The CED curve: `steps + 1` errors up to `max_error` and the fraction of samples below."""
+        x = torch.linspace(0, self.max_error, steps + 1, device=self.total.device)
+        return x, self._cdf(x)
+
+    def compute(self) -> Dict[str, Tensor]:
+        results = {"nme": (self.error_sum / self.total.clamp(min=1)).float()}
+        thresholds = torch.tensor(self.thresholds, device=self.total.device)
+        for threshold, below in zip(self.thresholds, self._cdf(thresholds)):
+            results[f"fr@{threshold:.2f}"] = 1 - below
+        x, y = self.curve(self.num_bins or 1000)
+        results[f"auc@{self.max_error:.2f}"] = torch.trapezoid(y, x) / self.max_error
+        return results
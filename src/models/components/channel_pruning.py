@@ -0,0 +1,413 @@
+import operator
+from dataclasses import dataclass, field
+from typing import Dict, List, Mapping, Optional, Sequence, Tuple
+
+import torch
+import torch.nn.functional as F
+from torch import Tensor, fx, nn
+from torch.fx.passes.shape_prop import ShapeProp
+
+# modules and functions that keep the channels of their input
+PASSTHROUGH_MODULES = (
+    nn.ReLU,
+    nn.ReLU6,
+    nn.Hardswish,
+    nn.Hardsigmoid,
+    nn.SiLU,
+    nn.GELU,
+    nn.Sigmoid,
+    nn.Tanh,
+    nn.Dropout,
+    nn.Identity,
+    nn.MaxPool2d,
+    nn.AvgPool2d,
+    nn.AdaptiveAvgPool2d,
+    nn.AdaptiveMaxPool2d,
+)
+PASSTHROUGH_FUNCTIONS = {
+    F.relu,
+    F.relu6,
+    F.hardswish,
+    F.hardsigmoid,
+    F.silu,
+    F.gelu,
+    F.dropout,
+    torch.relu,
+    torch.sigmoid,
+    torch.tanh,
+    F.adaptive_avg_pool2d,
+    F.adaptive_max_pool2d,
+    F.max_pool2d,
+    F.avg_pool2d,
+}
+PASSTHROUGH_METHODS = {"relu", "sigmoid", "tanh", "contiguous", "clone", "relu_", "sigmoid_"}
+# elementwise ops tying the channels of their operands together
+ELEMENTWISE = {operator.add, operator.iadd, operator.mul, operator.imul, torch.add, torch.mul}
+ELEMENTWISE_METHODS = {"add", "add_", "mul", "mul_"}
+
+
+@dataclass
+class ChannelGroup:
+    """Channels pruned together: the outputs of `producers` and the inputs of `consumers`.
+
+    Residual additions and squeeze-excitation multiplications tie several producers into one group.
+    Groups reaching the network input or output, or ops the analysis does not know, are `frozen`.
+    """
+
+    size: int
+    producers: List[nn.Module] = field(default_factory=list)
+    consumers: List[nn.Module] = field(default_factory=list)
+    frozen: bool = False
+
+    @property
+    def prunable(self) -> bool:
+        return not self.frozen and any(
+            isinstance(m, (nn.Conv2d, nn.Linear)) for m in self.producers
+        )
+
+
+@dataclass
+class ChannelGraph:
+    """The channel groups of a network and the cost of its layers as a function of their sizes."""
+
+    groups: List[ChannelGroup]
+    # (in group or None, out group or None, MACs per input and output channel) of every conv and
+    # linear call
+    costs: List[Tuple[Optional[int], Optional[int], float]]
+
+    def macs(self, sizes: Optional[Sequence[int]] = None) -> float:
+        """Multiply-accumulates per sample for the given group sizes, by default the current."""
+        sizes = [group.size for group in self.groups] if sizes is None else sizes
+        total = 0.0
+        for in_group, out_group, factor in self.costs:
+            in_size = sizes[in_group] if in_group is not None else 1
+            out_size = sizes[out_group] if out_group is not None else 1
+            total += factor * in_size * out_size
+        return total
+
+
+def _is_depthwise(module: nn.Module) -> bool:
+    if not isinstance(module, nn.Conv2d):
+        return False
+    return module.groups > 1 and module.groups == module.in_channels == module.out_channels
+
+
+def trace_channels(net: nn.Module, example_inputs: Tensor) -> ChannelGraph:
+    """Trace `net` with torch.fx and find its channel groups.
+
+    Convolutions (dense and depthwise), linear layers, batch norms, activations, pooling, flatten
+    to (B, C) and elementwise add/mul are understood; every other op freezes the channels it
+    touches.
+    """
+    traced = fx.symbolic_trace(net)
+    ShapeProp(traced).propagate(example_inputs)
+
+    parent: List[int] = []
+    groups: List[ChannelGroup] = []
+
+    def new_group(size: int, frozen: bool = False) -> int:
+        parent.append(len(parent))
+        groups.append(ChannelGroup(size, frozen=frozen))
+        return len(parent) - 1
+
+    def find(index: int) -> int:
+        while parent[index] != index:
+            parent[index] = parent[parent[index]]
+            index = parent[index]
+        return index
+
+    def union(first: int, second: int) -> int:
+        first, second = find(first), find(second)
+        if first != second:
+            parent[second] = first
+        return first
+
+    channels: Dict[fx.Node, int] = {}
+    raw_costs: List[Tuple[Optional[int], Optional[int], float]] = []
+
+    def shape(node: fx.Node) -> Optional[torch.Size]:
+        meta = node.meta.get("tensor_meta") if isinstance(node, fx.Node) else None
+        return getattr(meta, "shape", None)
+
+    def freeze_inputs(node: fx.Node) -> None:
+        for arg in node.all_input_nodes:
+            if arg in channels:
+                groups[find(channels[arg])].frozen = True
+
+    def new_output(node: fx.Node, frozen: bool = True) -> None:
+        out_shape = shape(node)
+        if out_shape is not None and len(out_shape) >= 2:
+            channels[node] = new_group(out_shape[1], frozen=frozen)
+
+    for node in traced.graph.nodes:
+        inputs = [arg for arg in node.args if isinstance(arg, fx.Node) and arg in channels]
+        if node.op == "placeholder":
+            new_output(node)
+        elif node.op == "output":
+            freeze_inputs(node)
+        elif node.op == "call_module":
+            module = traced.get_submodule(node.target)
+            source = None
+            if node.args and isinstance(node.args[0], fx.Node):
+                source = channels.get(node.args[0])
+            out_shape = shape(node)
+            if isinstance(module, nn.Conv2d) and source is not None:
+                kernel = module.kernel_size[0] * module.kernel_size[1]
+                spatial = out_shape[2] * out_shape[3] * kernel
+                if _is_depthwise(module):
+                    channels[node] = source
+                    groups[source].producers.append(module)
+                    raw_costs.append((None, source, spatial))
+                elif module.groups == 1:
+                    groups[source].consumers.append(module)
+                    channels[node] = new_group(module.out_channels)
+                    groups[channels[node]].producers.append(module)
+                    raw_costs.append((source, channels[node], spatial))
+                else:
+                    freeze_inputs(node)
+                    new_output(node)
+                    filters = module.in_channels * module.out_channels / module.groups
+                    raw_costs.append((None, None, spatial * filters))
+            elif isinstance(module, nn.Linear) and source is not None and len(out_shape) == 2:
+                groups[source].consumers.append(module)
+                channels[node] = new_group(module.out_features)
+                groups[channels[node]].producers.append(module)
+                raw_costs.append((source, channels[node], 1.0))
+            elif isinstance(module, nn.modules.batchnorm._BatchNorm) and source is not None:
+                channels[node] = source
+                groups[source].producers.append(module)
+            elif isinstance(module, PASSTHROUGH_MODULES) and source is not None:
+                channels[node] = source
+            else:
+                freeze_inputs(node)
+                new_output(node)
+                if isinstance(module, (nn.Conv2d, nn.Linear)):
+                    # every output value is a dot product over one filter
+                    outputs = out_shape.numel() / out_shape[0] / module.weight.shape[0]
+                    raw_costs.append((None, None, float(module.weight.numel()) * outputs))
+        elif node.op in ("call_function", "call_method"):
+            target = node.target
+            passthrough = target in PASSTHROUGH_FUNCTIONS or target in PASSTHROUGH_METHODS
+            if passthrough and len(inputs) == 1:
+                channels[node] = channels[inputs[0]]
+            elif target in ELEMENTWISE or target in ELEMENTWISE_METHODS:
+                sizes = {shape(arg)[1] for arg in inputs}
+                if len(sizes) == 1 and inputs:
+                    group = channels[inputs[0]]
+                    for arg in inputs[1:]:
+                        group = union(group, channels[arg])
+                    channels[node] = group
+                else:
+                    freeze_inputs(node)
+                    new_output(node)
+            elif target in (torch.flatten, "flatten") and len(inputs) == 1:
+                in_shape = shape(inputs[0])
+                start = node.args[1] if len(node.args) > 1 else node.kwargs.get("start_dim", 0)
+                if start == 1 and in_shape is not None and in_shape[2:].numel() == 1:
+                    channels[node] = channels[inputs[0]]
+                else:
+                    freeze_inputs(node)
+                    new_output(node)
+            else:
+                freeze_inputs(node)
+                new_output(node)
+        else:
+            new_output(node)
+
+    # merge the groups tied together, keeping the trace order
+    roots: Dict[int, int] = {}
+    merged: List[ChannelGroup] = []
+    for index, group in enumerate(groups):
+        root = find(index)
+        if root not in roots:
+            roots[root] = len(merged)
+            merged.append(ChannelGroup(groups[root].size))
+        target = merged[roots[root]]
+        target.producers += [
+            m for m in group.producers if all(m is not p for p in target.producers)
+        ]
+        target.consumers += [
+            m for m in group.consumers if all(m is not c for c in target.consumers)
+        ]
+        target.frozen |= group.frozen
+    # a module called on several groups would be pruned inconsistently
+    owners: Dict[Tuple[int, str], List[ChannelGroup]] = {}
+    for group in merged:
+        for module in group.producers:
+            owners.setdefault((id(module), "out"), []).append(group)
+        for module in group.consumers:
+            owners.setdefault((id(module), "in"), []).append(group)
+    for shared in owners.values():
+        if len(shared) > 1:
+            for group in shared:
+                group.frozen = True
+
+    def remap(index: Optional[int]) -> Optional[int]:
+        return None if index is None else roots[find(index)]
+
+    return ChannelGraph(merged, [(remap(i), remap(o), factor) for i, o, factor in raw_costs])
+
+
+def l1_importance(group: ChannelGroup) -> Tensor:
+    """Sum over the producers of the L1 norm of every output channel, normalized by its mean."""
+    score = torch.zeros(group.size)
+    for module in group.producers:
+        if isinstance(module, (nn.Conv2d, nn.Linear)):
+            norms = module.weight.detach().abs().flatten(1).sum(dim=1).float().cpu()
+            score += norms / norms.mean().clamp(min=1e-12)
+    return score
+
+
+def taylor_importance(group: ChannelGroup) -> Tensor:
+    """Squared first-order Taylor estimate (sum(w * dL/dw))^2 of the loss change of removing a
+    channel, for every channel.
+
+    Uses the gradients of the last backward pass, sum it over batches for a stable score.
+    """
+    score = torch.zeros(group.size)
+    for module in group.producers:
+        for param in (module.weight, module.bias):
+            if param is not None and param.grad is not None:
+                products = (param.detach() * param.grad).reshape(group.size, -1)
+                score += products.sum(dim=1).float().cpu()
+    return score**2
+
+
+def _slice(
+    module: nn.Module,
+    name: str,
+    keep: Tensor,
+    dim: int,
+    replaced: Dict[nn.Parameter, nn.Parameter],
+) -> None:
+    """Keep the `keep` entries of `dim` of a parameter or buffer, recording replaced parameters."""
+    tensor = getattr(module, name, None)
+    if tensor is None:
+        return
+    sliced = tensor.detach().index_select(dim, keep.to(tensor.device)).contiguous()
+    if isinstance(tensor, nn.Parameter):
+        # a new Parameter, the autograd graph of the old one may still expect the old shape
+        parameter = nn.Parameter(sliced, requires_grad=tensor.requires_grad)
+        replaced[tensor] = parameter
+        setattr(module, name, parameter)
+    else:
+        setattr(module, name, sliced)
+
+
+def prune_group(group: ChannelGroup, keep: Tensor) -> Dict[nn.Parameter, nn.Parameter]:
+    """Physically remove the channels of `group` not in the sorted indices `keep`.
+
+    :return: The new parameter replacing every old one, to update optimizers with.
+    """
+    keep = keep.sort().values
+    replaced: Dict[nn.Parameter, nn.Parameter] = {}
+    for module in group.producers:
+        if _is_depthwise(module):
+            _slice(module, "weight", keep, 0, replaced)
+            _slice(module, "bias", keep, 0, replaced)
+            module.in_channels = module.out_channels = module.groups = len(keep)
+        elif isinstance(module, nn.Conv2d):
+            _slice(module, "weight", keep, 0, replaced)
+            _slice(module, "bias", keep, 0, replaced)
+            module.out_channels = len(keep)
+        elif isinstance(module, nn.Linear):
+            _slice(module, "weight", keep, 0, replaced)
+            _slice(module, "bias", keep, 0, replaced)
+            module.out_features = len(keep)
+        elif isinstance(module, nn.modules.batchnorm._BatchNorm):
+            for name in ("weight", "bias", "running_mean", "running_var"):
+                _slice(module, name, keep, 0, replaced)
+            module.num_features = len(keep)
+    for module in group.consumers:
+        _slice(module, "weight", keep, 1, replaced)
+        if isinstance(module, nn.Conv2d):
+            module.in_channels = len(keep)
+        else:
+            module.in_features = len(keep)
+    group.size = len(keep)
+    return replaced
+
+
+def select_channels(
+    graph: ChannelGraph,
+    scores: Mapping[int, Tensor],
+    target_macs: float,
+    min_channels: int = 8,
+    min_ratio: float = 0.1,
+) -> Dict[int, Tensor]:
+    """Channels to keep in every prunable group so that the network fits `target_macs`.
+
+    The channels with the lowest scores, normalized by the mean score of their group so groups are
+    comparable, are removed first, keeping at least `min_channels` or `min_ratio` of every group.
+
+    :return: Sorted channel indices to keep, by group index, for the groups that lose channels.
+    """
+    sizes = [group.size for group in graph.groups]
+    candidates = []
+    for index, score in scores.items():
+        normalized = score / score.mean().clamp(min=1e-12)
+        for channel in normalized.argsort().tolist():
+            candidates.append((float(normalized[channel]), index, channel))
+    candidates.sort()
+
+    floors = {index: max(min_channels, int(min_ratio * sizes[index] + 0.5)) for index in scores}
+    removed: Dict[int, List[int]] = {index: [] for index in scores}
+    for _, index, channel in candidates:
+        if graph.macs(sizes) <= target_macs:
+            break
+        if sizes[index] <= floors[index]:
+            continue
+        removed[index].append(channel)
+        sizes[index] -= 1
+
+    keep = {}
+    for index, channels in removed.items():
+        if channels:
+            mask = torch.ones(graph.groups[index].size, dtype=torch.bool)
+            mask[channels] = False
+            keep[index] = mask.nonzero().flatten()
+    return keep
+
+
+def resize_to_state_dict(
+    net: nn.Module, state_dict: Mapping[str, Tensor], prefix: str = ""
+) -> None:
+    """Resize the layers of a freshly built `net` to the pruned shapes of a state dict to load.
+
+    Parameters are resized in place, so optimizers created before keep referring to them.
+    """
+    for name, module in net.named_modules():
+        key = f"{prefix}{name}." if name else prefix
+        shapes = {
+            param: state_dict[key + param].shape
+            for param, _ in module.named_parameters(recurse=False)
+            if key + param in state_dict
+        }
+        shapes.update(
+            {
+                buffer: state_dict[key + buffer].shape
+                for buffer, _ in module.named_buffers(recurse=False)
+                if key + buffer in state_dict
+            }
+        )
+        if all(getattr(module, item).shape == size for item, size in shapes.items()):
+            continue
+        depthwise = _is_depthwise(module)
+        for item, size in shapes.items():
+            tensor = getattr(module, item)
+            resized = tensor.new_empty(size)
+            if isinstance(tensor, nn.Parameter):
+                tensor.data = resized
+            else:
+                setattr(module, item, resized)
+        if isinstance(module, nn.Conv2d):
+            module.out_channels = module.weight.shape[0]
+            if depthwise:
+                module.in_channels = module.groups = module.out_channels
+            else:
+                module.in_channels = module.weight.shape[1] * module.groups
+        elif isinstance(module, nn.Linear):
+            module.out_features, module.in_features = module.weight.shape
+        elif isinstance(module, nn.modules.batchnorm._BatchNorm):
+            stats = module.running_mean if module.running_mean is not None else module.weight
+            module.num_features = stats.shape[0]
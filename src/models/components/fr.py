@@ -8,7 +8,7 @@ import math
 import numpy as np
 from torchmetrics.metric import Metric
 from torchmetrics.utilities.checks import _check_same_shape
-from src.models.components.nme import NME
+from src.models.components.nme import per_sample_nme
 
 class FR(Metric): #Failure Rate
     is_differentiable = True
@@ -24,19 +24,9 @@ class FR(Metric): #Failure Rate
         self.add_state("total", default=tensor(0), dist_reduce_fx="sum")
 
     def update(self, preds: Tensor, target: Tensor)->None:
-        _check_same_shape(preds, target)
-        device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-        nme = NME().to(device)
-        preds = preds.to(device)
-        target = target.to(device)
-        for p, t in zip(preds, target):
-            p = p.unsqueeze(0)
-            t = t.unsqueeze(0)
-            err_i = nme(p, t)
-            # print(err_i)
-            if err_i > self.threshold:
-                self.count += 1
-            self.total += 1
+        errors = per_sample_nme(preds, target)
+        self.count += (errors > self.threshold).sum()
+        self.total += errors.numel()
 
     def compute(self)->Tensor:
         return self.count/self.total
@@ -0,0 +1,102 @@
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+import torch
+from torch import Tensor, nn
+from torchmetrics.metric import Metric
+from torchmetrics.utilities.checks import _check_same_shape
+
+from src.models.components.loss import SoftWingLoss
+
+# iBUG 300W 68-point regions, as (start, end) ranges of keypoint indices
+REGIONS = {
+    "jaw": (0, 17),
+    "brows": (17, 27),
+    "nose": (27, 36),
+    "eyes": (36, 48),
+    "mouth": (48, 68),
+}
+
+
+class LandmarkCriterion(nn.Module):
+    """Landmark loss that also hands back the residual it was computed from.
+
+    `forward` returns `(loss, residual)` with `residual = preds - target`, so `LandmarkMetrics` can
+    reuse it instead of subtracting again.
+    """
+
+    def __init__(self, loss: Optional[SoftWingLoss] = None) -> None:
+        super().__init__()
+        self.loss = loss if loss is not None else SoftWingLoss()
+
+    def forward(self, preds: Tensor, target: Tensor) -> Tuple[Tensor, Tensor]:
+        residual = preds - target
+        if self.loss.use_target_weight:
+            return self.loss(preds, target), residual
+        return self.loss.loss_from_delta(residual.abs()) * self.loss.loss_weight, residual
+
+
+class LandmarkMetrics(Metric):
+    """MAE, NME under several normalizations and per-region NME from one residual per batch.
+
+    All values are accumulated as sums in a single state vector, so a batch costs one
+    point-to-point norm, three normalizing distances from the targets and one sync across DDP
+    ranks.
+
+    `compute` returns:
+        - `err`: mean absolute error over every coordinate, as `MeanAbsoluteError`
+        - `nme`: NME normalized by the outer eye corners (36, 45), as `NME`
+        - `nme_ip`: NME normalized by the distance between the eye centers
+        - `nme_bbox`: NME normalized by the diagonal of the target bounding box
+        - `nme_<region>`: inter-ocular NME over the points of every region in `REGIONS`
+    """
+
+    is_differentiable = False
+    higher_is_better = False
+    full_state_update = False
+
+    def __init__(self, keypoint_indices: Sequence[int] = (36, 45), **kwargs: Any) -> None:
+        super().__init__(**kwargs)
+        self.keypoint_indices = tuple(keypoint_indices)
+        self.names = ["err", "nme", "nme_ip", "nme_bbox", *(f"nme_{region}" for region in REGIONS)]
+        self.add_state(
+            "sums", default=torch.zeros(len(self.names), dtype=torch.float64), dist_reduce_fx="sum"
+        )
+        self.add_state("samples", default=torch.tensor(0), dist_reduce_fx="sum")
+        self.add_state("values", default=torch.tensor(0), dist_reduce_fx="sum")
+
+    def update(self, preds: Tensor, target: Tensor) -> None:
+        _check_same_shape(preds, target)
+        self.update_residual(preds.detach() - target, target)
+
+    def update_residual(self, residual: Tensor, target: Tensor) -> None:
+        """Accumulate a batch from `residual = preds - target` and the (B, K, 2) targets."""
+        residual, target = residual.detach(), target.detach()
+        distances = torch.linalg.norm(residual, dim=-1)
+        norms = torch.stack(self.normalizers(target), dim=1)
+
+        per_sample = distances.mean(dim=1, keepdim=True) / norms
+        regions = torch.stack(
+            [distances[:, start:end].mean(dim=1) for start, end in REGIONS.values()], dim=1
+        )
+        regions = regions / norms[:, :1]
+
+        sums = torch.cat([residual.abs().sum().view(1), per_sample.sum(dim=0), regions.sum(dim=0)])
+        self.sums += sums.double()
+        self.samples += residual.shape[0]
+        self.values += residual.numel()
+
+    def normalizers(self, target: Tensor) -> Tuple[Tensor, Tensor, Tensor]:
+        """Inter-ocular, inter-pupil and bounding box diagonal distances of the targets, (B,)."""
+        first, second = self.keypoint_indices
+        inter_ocular = torch.linalg.norm(target[:, first] - target[:, second], dim=-1)
+        inter_pupil = torch.linalg.norm(
+            target[:, 36:42].mean(dim=1) - target[:, 42:48].mean(dim=1), dim=-1
+        )
+        bbox = torch.linalg.norm(target.amax(dim=1) - target.amin(dim=1), dim=-1)
+        return inter_ocular, inter_pupil, bbox
+
+    def compute(self) -> Dict[str, Tensor]:
+        counts = torch.cat([self.values.view(1), self.samples.repeat(len(self.names) - 1)])
+        counts = counts.clamp(min=1)
+        values = (self.sums / counts).float()
+        return dict(zip(self.names, values))
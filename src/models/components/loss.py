@@ -22,7 +22,10 @@ class SoftWingLoss(nn.Module):
                                                       self.epsilon)
 
     def criterion(self, pred, target):
-        delta = (target - pred).abs()
+        return self.loss_from_delta((target - pred).abs())
+
+    def loss_from_delta(self, delta):
+        """Loss from the absolute residual `|target - pred|` of shape (B, K, 2), unweighted."""
         losses = torch.where(
             delta < self.omega1, delta,
             self.omega2 * torch.log(1.0 + delta / self.epsilon) + self.B)
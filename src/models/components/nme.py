@@ -7,6 +7,25 @@ import numpy as np
 from torchmetrics.metric import Metric
 from torchmetrics.utilities.checks import _check_same_shape
 
+
+def per_sample_nme(
+    preds: Tensor, target: Tensor, keypoint_indices: Sequence[int] = (36, 45)
+) -> Tensor:
+    """Point-to-point error of every sample, normalized by the distance of two target keypoints.
+
+    :param preds: (B, K, 2) predicted keypoints.
+    :param target: (B, K, 2) target keypoints.
+    :param keypoint_indices: The two keypoints of the normalizing distance, the outer eye
+        corners by default.
+    :return: (B,) errors.
+    """
+    _check_same_shape(preds, target)
+    interoccular = torch.linalg.norm(
+        target[:, keypoint_indices[0], :] - target[:, keypoint_indices[1], :], dim=-1
+    )
+    return torch.linalg.norm(preds - target, dim=-1).mean(dim=-1) / interoccular
+
+
 class NME(Metric):
     is_differentiable = True
     higher_is_better = False
@@ -0,0 +1,165 @@
+import copy
+import os
+import statistics
+import time
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+import torch
+from torch import Tensor, nn
+from torch.ao.quantization import (
+    get_default_qat_qconfig_mapping,
+    get_default_qconfig_mapping,
+)
+from torch.ao.quantization.quantize_fx import convert_fx, prepare_fx, prepare_qat_fx
+
+from src.models.components.ced import CED
+from src.models.components.landmark_metrics import LandmarkMetrics
+
+
+def calibration_batches(
+    dataloader: Iterable[Any], normalize: Callable[[Tensor], Tensor], num_batches: int
+) -> Iterator[Tensor]:
+    """The first `num_batches` normalized float image batches of `dataloader`."""
+    for index, (x, _) in enumerate(dataloader):
+        if index >= num_batches:
+            break
+        yield normalize(x).float()
+
+
+def quantize_static(
+    net: nn.Module, calibration: Iterable[Tensor], example_inputs: Tensor, backend: str = "x86"
+) -> nn.Module:
+    """Static int8 post-training quantization of a copy of `net` with torch.ao FX graph mode.
+
+    `prepare_fx` fuses Conv+BN(+ReLU) and inserts observers for the default qconfig of `backend`
+    (per-channel weights, histogram activations), the observers see every `calibration` batch and
+    `convert_fx` replaces the observed modules with int8 kernels. Runs on CPU.
+
+    :param net: The float network, left untouched.
+    :param calibration: Normalized float image batches.
+    :param example_inputs: An input batch to trace the network with.
+    :param backend: Quantized engine, `x86`, `fbgemm`, `onednn` or `qnnpack` (ARM).
+    :return: The int8 network.
+    """
+    torch.backends.quantized.engine = backend
+    net = copy.deepcopy(net).cpu().eval()
+    prepared = prepare_fx(net, get_default_qconfig_mapping(backend), (example_inputs,))
+    with torch.no_grad():
+        for x in calibration:
+            prepared(x.cpu())
+    return convert_int8(prepared)
+
+
+def prepare_qat(net: nn.Module, example_inputs: Tensor, backend: str = "x86") -> nn.Module:
+    """Fuse Conv+BN(+ReLU) of `net` and insert fake quantization for quantization-aware training.
+
+    The fused modules keep updating their BN statistics until `freeze_bn_stats` and the observers
+    until `disable_observer`, both applied with `module.apply`. `convert_int8` gives the int8
+    network.
+    """
+    torch.backends.quantized.engine = backend
+    return prepare_qat_fx(net.train(), get_default_qat_qconfig_mapping(backend), (example_inputs,))
+
+
+def convert_int8(prepared: nn.Module) -> nn.Module:
+    """The int8 CPU network of a copy of a network prepared by `prepare_qat` or `prepare_fx`."""
+    return convert_fx(copy.deepcopy(prepared).cpu().eval())
+
+
+def save_torchscript(net: nn.Module, example_inputs: Tensor, path: str) -> None:
+    """Trace, freeze and save a (quantized) network as TorchScript, loadable without this repo."""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with torch.no_grad():
+        traced = torch.jit.freeze(torch.jit.trace(net.eval(), example_inputs))
+    torch.jit.save(traced, path)
+
+
+def quantize_onnx(
+    net: nn.Module,
+    calibration: Iterable[Tensor],
+    example_inputs: Tensor,
+    path: str,
+    per_channel: bool = True,
+) -> Callable[[Tensor], Tensor]:
+    """Static int8 quantization with ONNX Runtime, for deployments that run the model with it.
+
+    The float network is exported to `<path>.fp32.onnx`, ONNX Runtime fuses Conv+BN while
+    optimizing it, calibrates on `calibration` and writes the QDQ int8 model to `path`.
+
+    :return: A function running the int8 model with ONNX Runtime on float image batches.
+    """
+    import onnxruntime
+    from onnxruntime.quantization import (
+        CalibrationDataReader,
+        QuantFormat,
+        QuantType,
+        quantize_static,
+    )
+
+    float_path = f"{os.path.splitext(path)[0]}.fp32.onnx"
+    torch.onnx.export(
+        copy.deepcopy(net).cpu().eval(),
+        (example_inputs,),
+        float_path,
+        input_names=["image"],
+        output_names=["keypoints"],
+        dynamic_axes={"image": {0: "batch"}, "keypoints": {0: "batch"}},
+        dynamo=False,
+    )
+
+    class Reader(CalibrationDataReader):
+        def __init__(self) -> None:
+            self.batches = iter(calibration)
+
+        def get_next(self) -> Optional[Dict[str, Any]]:
+            x = next(self.batches, None)
+            return None if x is None else {"image": x.cpu().numpy()}
+
+    quantize_static(
+        float_path,
+        path,
+        Reader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=per_channel,
+        activation_type=QuantType.QUInt8,
+        weight_type=QuantType.QInt8,
+    )
+    session = onnxruntime.InferenceSession(path, providers=["CPUExecutionProvider"])
+
+    def run(x: Tensor) -> Tensor:
+        return torch.from_numpy(session.run(None, {"image": x.cpu().numpy()})[0])
+
+    return run
+
+
+@torch.no_grad()
+def evaluate_landmarks(
+    net: Callable[[Tensor], Tensor],
+    dataloader: Iterable[Any],
+    normalize: Callable[[Tensor], Tensor],
+    max_batches: Optional[int] = None,
+) -> Dict[str, float]:
+    """NME, failure rates and AUC of `net` on a dataloader, on CPU."""
+    metrics, ced = LandmarkMetrics(), CED(thresholds=(0.08, 0.10), max_error=0.10)
+    for index, (x, y) in enumerate(dataloader):
+        if max_batches is not None and index >= max_batches:
+            break
+        preds = net(normalize(x).float()).float()
+        metrics.update(preds, y)
+        ced.update(preds, y)
+    results = {**metrics.compute(), **ced.compute()}
+    return {name: float(value) for name, value in results.items()}
+
+
+@torch.no_grad()
+def latency_ms(
+    net: Callable[[Tensor], Tensor], example_inputs: Tensor, steps: int = 20, warmup: int = 5
+) -> float:
+    """Median wall time of a forward pass of `net` on `example_inputs`, in ms."""
+    times = []
+    for step in range(warmup + steps):
+        start = time.perf_counter()
+        net(example_inputs)
+        if step >= warmup:
+            times.append((time.perf_counter() - start) * 1000)
+    return statistics.median(times)
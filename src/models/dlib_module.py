@@ -1,16 +1,21 @@
-from typing import Any
+from typing import Any, Dict, Optional
 
 import torch, os
 from lightning import LightningModule
+from lightning.pytorch.utilities import rank_zero_warn
+from torch.ao.nn.intrinsic.qat import freeze_bn_stats
+from torch.ao.quantization import disable_observer
 from torchmetrics import MinMetric, MeanMetric
-from torchmetrics.regression import MeanAbsoluteError
-from src.models.components.nme import NME
 #from src.models.components.softwingloss import SoftWingLoss
-from src.models.components.loss import SoftWingLoss
-from src.models.components.fr import FR
-import torchvision, wandb, pyrootutils
+from src.models.components.landmark_metrics import LandmarkCriterion, LandmarkMetrics
+from src.models.components.ced import CED
+from src.models.components.channel_pruning import resize_to_state_dict
+from src.models.components.quantization import convert_int8, prepare_qat, save_torchscript
+from src.utils import RankedLogger
+from src.utils.compile import CompiledFallback, set_compile_cache
+from src.utils.cpu_perf import bf16_supported
+import pyrootutils
 import numpy as np
-from PIL import ImageDraw, Image
 
 # find root of this file
 path = pyrootutils.find_root(search_from=__file__, indicator=".project-root")
@@ -21,72 +26,7 @@ outputs_path = path / "test_outputs"
 if not os.path.exists(outputs_path):
     os.makedirs(outputs_path)
 
-def draw_batch(images, targets, preds) -> torch.Tensor:
-    # helper function
-    def denormalize(images, mean=[0.485, 0.456, 0.406], std=[0.229, 0.224, 0.225]) -> torch.Tensor:
-        """Reverse COLOR transform"""
-        # clone: make a copy
-        # permute: [batch, 3, H, W] -> [3, H, W, batch]
-        tmp = images.clone().permute(1, 2, 3, 0)
-
-        # denormalize
-        for t, m, s in zip(tmp, mean, std):
-            t.mul_(s).add_(m)
-
-        # clamp: limit value to [0, 1]
-        # permute: [3, H, W, batch] -> [batch, 3, H, W]
-        return torch.clamp(tmp, 0, 1).permute(3, 0, 1, 2)
-    
-    def annotate_image(image, targets, preds):
-        """Draw target & pred landmarks on image"""
-        # create an ImageDraw object
-        draw = ImageDraw.Draw(image)
-
-        # draw target_landmarks on image (green)
-        for x, y in targets:
-            draw.ellipse([(x-2, y-2), (x+2, y+2)], fill=(0, 255, 0))
-
-        # draw pred_landmarks on image (red)
-        for x, y in preds:
-            draw.ellipse([(x-2, y-2), (x+2, y+2)], fill=(255, 0, 0))
-
-        return image
-    
-    # denormalize
-    images = denormalize(images)
-
-    # set an empty list
-    images_to_save = []
-    
-    # device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
-    # images = images.to(device)
-    # targets = targets.to(device)
-    # preds = preds.to(device)
-
-    # loop through each sample in batch
-    for i, t, p in zip(images, targets, preds):
-        # get size of x
-        # i = i.cpu().permute(1, 2, 0).numpy() * 255
-        i = i.permute(1, 2, 0) * 255
-        height, width, _ = i.shape
-
-        # denormalize landmarks -> pixel coordinates
-        # t = (t.cpu()) * np.array([width, height])
-        # p = (p.cpu()) * np.array([width, height])
-        device = t.device
-        t = (t + 0.5) * torch.tensor([width, height], device=device)
-        device = p.device
-        p = (p + 0.5) * torch.tensor([width, height], device=device)
-
-        # draw landmarks on cropped image
-        # annotated_image = annotate_image(Image.fromarray(i.astype(np.uint8)), t, p)
-        i = torchvision.transforms.functional.to_pil_image(i.to(torch.uint8).permute(2, 0, 1))
-        annotated_image = annotate_image(i, t, p)
-
-        # save drawed cropped image
-        images_to_save.append(torchvision.transforms.ToTensor()(annotated_image))
-
-    return torch.stack(images_to_save)
+log = RankedLogger(__name__, rank_zero_only=True)
 
 class DLIBLitModule(LightningModule):
     """Example of LightningModule for MNIST classification.
@@ -108,29 +48,60 @@ class DLIBLitModule(LightningModule):
         net: torch.nn.Module,
         optimizer: torch.optim.Optimizer,
         scheduler: torch.optim.lr_scheduler,
+        batch_augment: Optional[torch.nn.Module] = None,
+        channels_last: bool = False,
+        bf16_autocast: bool = False,
+        compile: bool = False,
+        compile_mode: Optional[str] = None,
+        compile_dynamic: Optional[bool] = None,
+        compile_loss: bool = False,
+        compile_cache_dir: Optional[str] = None,
+        qat: Optional[Dict[str, Any]] = None,
     ):
         super().__init__()
 
         # this line allows to access init params with 'self.hparams' attribute
         # also ensures init params will be stored in ckpt
-        self.save_hyperparameters(logger=False, ignore="net")
+        self.save_hyperparameters(logger=False, ignore=["net", "batch_augment"])
 
         self.net = net
 
+        # NHWC convolutions are faster with oneDNN on CPU (and with tensor cores on GPU)
+        if channels_last:
+            self.net = self.net.to(memory_format=torch.channels_last)
+
+        # bf16 autocast of the forward pass on CPU, only worth it with native bf16 instructions
+        self.bf16_autocast = bf16_autocast
+        if bf16_autocast and not bf16_supported():
+            rank_zero_warn(
+                "bf16_autocast is enabled but the CPU has no AVX512-BF16/AMX support, "
+                "running in fp32"
+            )
+            self.bf16_autocast = False
+
+        # optional augmentation of the whole collated training batch (see `BatchAugment`)
+        self.batch_augment = batch_augment
+
+        # ImageNet statistics normalizing uint8 batches, see `uint8_transport` of the datamodules
+        self.register_buffer(
+            "mean", torch.tensor([0.485, 0.456, 0.406]).view(1, 3, 1, 1) * 255, persistent=False
+        )
+        self.register_buffer(
+            "std", torch.tensor([0.229, 0.224, 0.225]).view(1, 3, 1, 1) * 255, persistent=False
+        )
+
         # loss function
         # self.criterion = torch.nn.MSELoss()
-        self.criterion = SoftWingLoss()
+        # SoftWingLoss that also returns the residual `preds - target` for the metrics below
+        self.criterion = LandmarkCriterion()
 
-        # metric objects for calculating and averaging accuracy across batches
-        self.train_err = MeanAbsoluteError()
-        self.val_err = MeanAbsoluteError()
-        self.test_err = MeanAbsoluteError()
+        # MAE, NME under several normalizations and per-region NME, all from the step's residual
+        self.train_metrics = LandmarkMetrics()
+        self.val_metrics = LandmarkMetrics()
+        self.test_metrics = LandmarkMetrics()
 
-        self.train_nme = NME()
-        self.val_nme = NME()
-        self.test_nme = NME()
-
-        self.test_fr = FR()
+        # per-sample test errors: failure rates, AUC and the CED curve
+        self.test_ced = CED(thresholds=(0.08, 0.10), max_error=0.10)
 
         # for averaging loss across batches
         self.train_loss = MeanMetric()
@@ -139,13 +110,53 @@ class DLIBLitModule(LightningModule):
 
         # for tracking least so far validation error
         self.val_err_least = MinMetric()
-        
-        # to make use of all the outputs from each validation_step()
-        self.validation_step_outputs = []
+
+        # `torch.compile` of the net (and the loss), built in `setup`
+        self.compiled_net: Optional[CompiledFallback] = None
+        self.compiled_criterion: Optional[CompiledFallback] = None
+
+        # quantization-aware training, the fake-quantized net is built in `setup`
+        self.qat_prepared = False
 
     def forward(self, x: torch.Tensor):
+        if self.compiled_net is not None:
+            return self.compiled_net(x)
         return self.net(x)
 
+    def setup(self, stage: str):
+        # fake quantization is inserted for every stage, so QAT checkpoints load in `src/eval.py`
+        if self.hparams.qat and not self.qat_prepared:
+            init_ckpt = self.hparams.qat.get("init_ckpt") if stage == "fit" else None
+            if init_ckpt:
+                # fine-tune the float net of a trained checkpoint
+                checkpoint = torch.load(init_ckpt, map_location="cpu", weights_only=False)
+                state_dict = checkpoint["state_dict"]
+                resize_to_state_dict(self.net, state_dict, prefix="net.")
+                net_state = {k[4:]: v for k, v in state_dict.items() if k.startswith("net.")}
+                self.net.load_state_dict(net_state)
+            self.prepare_qat_net(self.hparams.qat)
+        self.compile_net()
+
+    def prepare_qat_net(self, qat: Dict[str, Any]):
+        """Insert fake quantization into the net for quantization-aware training."""
+        size = qat.get("input_size", 224)
+        example = torch.randn(1, 3, size, size, device=self.device)
+        self.net = prepare_qat(self.net, example, backend=qat.get("backend", "x86"))
+        self.qat_prepared = True
+        # a compiled net would still run the float one
+        self.compiled_net = None
+
+    def compile_net(self):
+        # compiled for every stage, so `src/eval.py` runs the same kernels, loaded from the cache
+        if not self.hparams.compile or self.compiled_net is not None:
+            return
+        if self.hparams.compile_cache_dir is not None:
+            set_compile_cache(self.hparams.compile_cache_dir)
+        options = {"mode": self.hparams.compile_mode, "dynamic": self.hparams.compile_dynamic}
+        self.compiled_net = CompiledFallback(self.net, name=type(self.net).__name__, **options)
+        if self.hparams.compile_loss:
+            self.compiled_criterion = CompiledFallback(self.criterion, name="the loss", **options)
+
     def on_train_start(self):
         # by default lightning executes validation step sanity checks before training starts,
         # so it's worth to make sure validation metrics don't store results from these checks
@@ -153,23 +164,87 @@ class DLIBLitModule(LightningModule):
         # self.val_err.reset()
         self.val_err_least.reset()
 
+    def on_train_epoch_start(self):
+        # freeze the BN statistics, then the quantization ranges, for the last QAT epochs
+        if not self.hparams.qat:
+            return
+        freeze_bn_epoch = self.hparams.qat.get("freeze_bn_epoch")
+        if freeze_bn_epoch is not None and self.current_epoch >= freeze_bn_epoch:
+            self.net.apply(freeze_bn_stats)
+        freeze_observer_epoch = self.hparams.qat.get("freeze_observer_epoch")
+        if freeze_observer_epoch is not None and self.current_epoch >= freeze_observer_epoch:
+            self.net.apply(disable_observer)
+
+    def on_fit_end(self):
+        # the int8 model goes next to `last.ckpt`
+        if not self.hparams.qat or not self.trainer.is_global_zero:
+            return
+        checkpoint = self.trainer.checkpoint_callback
+        dirpath = self.trainer.default_root_dir
+        if checkpoint is not None and checkpoint.dirpath:
+            dirpath = checkpoint.dirpath
+        size = self.hparams.qat.get("input_size", 224)
+        path = os.path.join(dirpath, "last_int8.pt")
+        save_torchscript(convert_int8(self.net), torch.randn(1, 3, size, size), path)
+        log.info(f"int8 model saved to {path}")
+
+    def on_load_checkpoint(self, checkpoint: Dict[str, Any]):
+        # a QAT checkpoint loaded without the `qat` config, e.g. by `src/eval.py`, holds the
+        # fake-quantized net, prepared here from the `qat` saved with the checkpoint
+        qat = checkpoint.get("hyper_parameters", {}).get("qat")
+        if qat and not self.qat_prepared:
+            recompile = self.compiled_net is not None
+            self.hparams.qat = qat
+            self.prepare_qat_net(qat)
+            if recompile:
+                self.compile_net()
+        # checkpoints of a channel-pruned net (see `ChannelPruning`) have smaller layers
+        resize_to_state_dict(self.net, checkpoint["state_dict"], prefix="net.")
+
+    def on_after_batch_transfer(self, batch: Any, dataloader_idx: int):
+        # augment training batches on the device they were moved to
+        if self.batch_augment is not None and self.trainer.training:
+            x, y = batch
+            batch = self.batch_augment(x, y)
+        return batch
+
+    def normalize(self, x: torch.Tensor) -> torch.Tensor:
+        """Normalize raw uint8 images with the ImageNet mean/std, float images pass through."""
+        if x.dtype != torch.uint8:
+            return x
+        return (x.float() - self.mean) / self.std
+
     def model_step(self, batch: Any):
         x, y = batch
-        preds = self.forward(x)
-        loss = self.criterion(preds, y)
+        inputs = self.normalize(x)
+        if self.hparams.channels_last:
+            inputs = inputs.contiguous(memory_format=torch.channels_last)
+        autocast = self.bf16_autocast and self.device.type == "cpu"
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=autocast):
+            preds = self.forward(inputs)
+        # the loss and the metrics stay in fp32
+        preds = preds.float()
+        criterion = self.compiled_criterion or self.criterion
+        loss, residual = criterion(preds, y)
         # preds = torch.argmax(logits, dim=1)
-        return loss, preds, y, x
+        return loss, preds, y, x, residual
+
+    def log_metrics(self, stage: str, metrics: LandmarkMetrics):
+        """Log the epoch values of `metrics` as `<stage>/...`, MAE and NME on the progress bar."""
+        results = metrics.compute()
+        self.log_dict({f"{stage}/{name}": results[name] for name in ("err", "nme")}, prog_bar=True)
+        others = {name: value for name, value in results.items() if name not in ("err", "nme")}
+        self.log_dict({f"{stage}/{name}": value for name, value in others.items()})
+        metrics.reset()
+        return results
 
     def training_step(self, batch: Any, batch_idx: int):
-        loss, preds, targets, _ = self.model_step(batch)
+        loss, preds, targets, _, residual = self.model_step(batch)
 
         # update and log metrics
         self.train_loss(loss)
-        self.train_err(preds, targets)
-        self.train_nme(preds, targets)
+        self.train_metrics.update_residual(residual, targets)
         self.log("train/loss", self.train_loss, on_step=False, on_epoch=True, prog_bar=True)
-        self.log("train/err", self.train_err, on_step=False, on_epoch=True, prog_bar=True)
-        self.log("train/nme", self.train_nme, on_step=False, on_epoch=True, prog_bar=True)
 
         # return dict with any tensors to read in callback or in `on_train_epoch_end` below
         # return loss or backpropagation will fail
@@ -177,68 +252,60 @@ class DLIBLitModule(LightningModule):
         return {"loss": loss, "preds": preds, "targets": targets}
 
     def on_train_epoch_end(self):
-        pass
+        self.log_metrics("train", self.train_metrics)
 
     def validation_step(self, batch: Any, batch_idx: int):
-        loss, preds, targets, images = self.model_step(batch)
+        loss, preds, targets, _, residual = self.model_step(batch)
 
         # update and log metrics
         self.val_loss(loss)
-        self.val_err(preds, targets)
-        self.val_nme(preds, targets)
+        self.val_metrics.update_residual(residual, targets)
         self.log("val/loss", self.val_loss, on_step=False, on_epoch=True, prog_bar=True)
-        self.log("val/err", self.val_err, on_step=False, on_epoch=True, prog_bar=True)
-        self.log("val/nme", self.val_nme, on_step=False, on_epoch=True, prog_bar=True)
-        
-        # save image, targets and preds to draw batch in on_validation_epoch_end
-        self.validation_step_outputs.append({"image": images, "targets": targets, "preds": preds})
-
 
+        # drawn by the `ValidationVisualizer` callback
         return {"loss": loss, "preds": preds, "targets": targets}
 
     def on_validation_epoch_end(self):
-        err = self.val_err.compute()  # get current val acc
+        err = self.log_metrics("val", self.val_metrics)["err"]  # get current val acc
         self.val_err_least(err)  # update best so far val acc
         # log `val_err_least` as a value through `.compute()` method, instead of as a metric object
         # otherwise metric would be reset by lightning after each epoch
         self.log("val/err_least", self.val_err_least.compute(), prog_bar=True)
-        
-        # get the result of the first batch of validation epoch
-        first_val_batch_result = self.validation_step_outputs[0]
-        x = first_val_batch_result["image"]
-        y = first_val_batch_result["targets"]
-        y_hat = first_val_batch_result["preds"]
-
-        # draw the first batch & save it
-        annotated_batch = draw_batch(x, y, y_hat)
-        torchvision.utils.save_image(annotated_batch, outputs_path / "val_end.png")
-        
-        # log the first batch
-        wandb.log({"annotated_image": wandb.Image(annotated_batch)})
-        
-        # free memory & prepare for the next validation epoch
-        self.validation_step_outputs.clear()
 
     def test_step(self, batch: Any, batch_idx: int):
-        loss, preds, targets, _ = self.model_step(batch)
+        loss, preds, targets, _, residual = self.model_step(batch)
 
         # update and log metrics
         self.test_loss(loss)
-        self.test_err(preds, targets)
-        self.test_nme(preds, targets)
-        self.test_fr(preds, targets)
+        self.test_metrics.update_residual(residual, targets)
+        self.test_ced.update(preds, targets)
         self.log("test/loss", self.test_loss, on_step=False, on_epoch=True, prog_bar=True)
-        self.log("test/err", self.test_err, on_step=False, on_epoch=True, prog_bar=True)
-        self.log("test/nme", self.test_nme, on_step=False, on_epoch=True, prog_bar=True)
-        self.log("test/fr", self.test_fr, on_step=False, on_epoch=True, prog_bar=True)
 
         return {"loss": loss, "preds": preds, "targets": targets}
 
     def on_test_epoch_end(self):
-        pass
+        self.log_metrics("test", self.test_metrics)
+
+        results = self.test_ced.compute()
+        # `test/fr` keeps the former FR@0.10 metric name
+        self.log("test/fr", results["fr@0.10"], prog_bar=True)
+        # `nme` of the CED is the same value as `test/nme` of `test_metrics`
+        self.log_dict({f"test/{name}": value for name, value in results.items() if name != "nme"})
+
+        # save the cumulative error distribution curve
+        x, y = self.test_ced.curve()
+        if self.trainer.is_global_zero:
+            np.savetxt(
+                outputs_path / "test_ced.csv",
+                torch.stack([x, y], dim=1).cpu().numpy(),
+                delimiter=",",
+                header="nme,fraction",
+                comments="",
+            )
+        self.test_ced.reset()
 
     def predict_step(self, batch: Any, batch_idx: int, dataloader_idx: int = None):
-        _, preds, _, _ = self.model_step(batch)
+        _, preds, _, _, _ = self.model_step(batch)
         return preds
     
     def configure_optimizers(self):
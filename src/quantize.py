@@ -0,0 +1,133 @@
+import json
+import os
+from typing import Any, Dict, Optional, Tuple
+
+import hydra
+import rootutils
+import torch
+from lightning import LightningDataModule, LightningModule
+from omegaconf import DictConfig
+
+rootutils.setup_root(__file__, indicator=".project-root", pythonpath=True)
+# ------------------------------------------------------------------------------------ #
+# the setup_root above is equivalent to:
+# - adding project root dir to PYTHONPATH
+#       (so you don't need to force user to install project as a package)
+#       (necessary before importing any local modules e.g. `from src import utils`)
+# - setting up PROJECT_ROOT environment variable
+#       (which is used as a base for paths in "configs/paths/default.yaml")
+#       (this way all filepaths are the same no matter where you run the code)
+# - loading environment variables from ".env" in root dir
+#
+# you can remove it if you:
+# 1. either install project as a package or move entry files to project root dir
+# 2. set `root_dir` to "." in "configs/paths/default.yaml"
+#
+# more info: https://github.com/ashleve/rootutils
+# ------------------------------------------------------------------------------------ #
+
+from src.models.components.quantization import (
+    calibration_batches,
+    evaluate_landmarks,
+    latency_ms,
+    quantize_onnx,
+    quantize_static,
+    save_torchscript,
+)
+from src.utils import RankedLogger, extras, task_wrapper
+
+log = RankedLogger(__name__, rank_zero_only=True)
+
+
+@task_wrapper
+def quantize(cfg: DictConfig) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+    """Quantizes the network of a checkpoint to int8 and compares it to the float network.
+
+    The network is calibrated on the first batches of the validation set, both networks are
+    evaluated on the test set (NME, failure rates, AUC) and timed on CPU. The int8 model is saved
+    to `quantization.output_path` with a `.pt` or `.onnx` suffix and `quantization.json` to the
+    output dir.
+
+    :param cfg: DictConfig configuration composed by Hydra.
+    :return: Tuple[dict, dict] with the report and dict with all instantiated objects.
+    """
+    assert cfg.ckpt_path
+
+    log.info(f"Instantiating datamodule <{cfg.data._target_}>")
+    datamodule: LightningDataModule = hydra.utils.instantiate(cfg.data)
+    datamodule.prepare_data()
+    datamodule.setup(stage="test")
+
+    log.info(f"Instantiating model <{cfg.model._target_}>")
+    model: LightningModule = hydra.utils.instantiate(cfg.model)
+    checkpoint = torch.load(cfg.ckpt_path, map_location="cpu", weights_only=False)
+    # resizes the layers of a channel-pruned net (see `ChannelPruning`) to the checkpoint
+    model.on_load_checkpoint(checkpoint)
+    model.load_state_dict(checkpoint["state_dict"])
+    model.eval()
+    net, normalize = model.net, model.normalize
+
+    settings = cfg.quantization
+    val_loader, test_loader = datamodule.val_dataloader(), datamodule.test_dataloader()
+    example = normalize(next(iter(val_loader))[0]).float()
+    calibration = calibration_batches(val_loader, normalize, settings.num_calibration_batches)
+
+    batches = settings.num_calibration_batches
+    log.info(f"Quantizing with {settings.export}, calibrating on {batches} batches...")
+    os.makedirs(os.path.dirname(os.path.abspath(settings.output_path)), exist_ok=True)
+    if settings.export == "onnx":
+        output_path = f"{settings.output_path}.onnx"
+        quantized = quantize_onnx(net, calibration, example, output_path)
+    elif settings.export == "torch":
+        output_path = f"{settings.output_path}.pt"
+        quantized = quantize_static(net, calibration, example, backend=settings.backend)
+        save_torchscript(quantized, example, output_path)
+    else:
+        raise ValueError(f"Unknown export {settings.export}, expected torch or onnx")
+    log.info(f"int8 model saved to {output_path}")
+
+    report: Dict[str, Any] = {
+        "export": settings.export,
+        "backend": settings.backend,
+        "path": output_path,
+    }
+    latency_input = example[: settings.latency_batch_size]
+    for name, fn in (("fp32", net), ("int8", quantized)):
+        log.info(f"Evaluating the {name} network...")
+        report[name] = evaluate_landmarks(fn, test_loader, normalize, settings.eval_batches)
+        report[name]["latency_ms"] = latency_ms(fn, latency_input, steps=settings.latency_steps)
+    report["speedup"] = report["fp32"]["latency_ms"] / report["int8"]["latency_ms"]
+    report["nme_increase"] = report["int8"]["nme"] - report["fp32"]["nme"]
+
+    for name in ("nme", "fr@0.10", "auc@0.10", "nme_jaw", "nme_brows", "latency_ms"):
+        log.info(f"{name:>12}: fp32 {report['fp32'][name]:.4f}  int8 {report['int8'][name]:.4f}")
+    log.info(
+        f"int8 is {report['speedup']:.2f}x faster at batch size {len(latency_input)}, "
+        f"NME {report['nme_increase']:+.4f}"
+    )
+
+    report_path = os.path.join(cfg.paths.output_dir, "quantization.json")
+    with open(report_path, "w") as file:
+        json.dump(report, file, indent=2)
+    log.info(f"Report saved to {report_path}")
+
+    object_dict = {"cfg": cfg, "datamodule": datamodule, "model": model}
+    return report, object_dict
+
+
+@hydra.main(version_base="1.3", config_path="../configs", config_name="quantize.yaml")
+def main(cfg: DictConfig) -> Optional[float]:
+    """Main entry point for post-training quantization.
+
+    :param cfg: DictConfig configuration composed by Hydra.
+    """
+    extras(cfg)
+
+    report, _ = quantize(cfg)
+
+    # NME of the int8 network, so quantization settings can be swept with hydra
+    return report["int8"]["nme"]
+
+
+if __name__ == "__main__":
+    main()
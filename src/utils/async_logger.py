@@ -0,0 +1,227 @@
+import queue
+import threading
+from argparse import Namespace
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import torch
+import torch.nn.functional as F
+from lightning.pytorch.loggers import Logger
+from lightning.pytorch.utilities import rank_zero_only
+
+from src.utils import pylogger
+
+log = pylogger.RankedLogger(__name__, rank_zero_only=True)
+
+
+def downsample(image: Any) -> Any:
+    """Halve the resolution of a (C, H, W) float tensor or a PIL image, others pass through."""
+    if isinstance(image, torch.Tensor) and image.ndim == 3 and image.is_floating_point():
+        return F.avg_pool2d(image[None], 2)[0]
+    if hasattr(image, "reduce"):
+        return image.reduce(2)
+    return image
+
+
+class AsyncLogger(Logger):
+    """Wraps a Lightning logger so that logging never blocks the training loop.
+
+    Every call is put on a bounded queue and replayed on the wrapped logger by one background
+    thread. The thread takes up to `batch_size` items at a time and merges the metrics logged for
+    the same step into one `log_metrics` call. Under back-pressure, images are downsampled once the
+    queue is half full, and new items are dropped once it is full or `max_media` images are already
+    waiting. Dropped items are counted in `dropped`. `finalize` flushes the queue before finalizing
+    the wrapped logger.
+
+    Attributes missing from the wrapper, like `experiment` or `WandbLogger.watch`, resolve on the
+    wrapped logger.
+    """
+
+    def __init__(
+        self,
+        logger: Logger,
+        max_queue: int = 1000,
+        batch_size: int = 64,
+        flush_interval: float = 1.0,
+        max_media: int = 8,
+    ) -> None:
+        """
+        :param logger: The wrapped logger.
+        :param max_queue: Maximum number of pending calls.
+        :param batch_size: Maximum number of calls replayed at a time.
+        :param flush_interval: Seconds the background thread waits for new calls.
+        :param max_media: Maximum number of pending `log_image` calls.
+        """
+        super().__init__()
+        self._logger = logger
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_media = max_media
+        self.dropped = 0
+
+        self._queue: "queue.Queue[Tuple[str, Any]]" = queue.Queue(maxsize=max_queue)
+        self._media = 0
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self._logger, name)
+
+    @property
+    def logger(self) -> Logger:
+        return self._logger
+
+    @property
+    def name(self) -> Optional[str]:
+        return self._logger.name
+
+    @property
+    def version(self) -> Optional[Union[int, str]]:
+        return self._logger.version
+
+    @property
+    def root_dir(self) -> Optional[str]:
+        return self._logger.root_dir
+
+    @property
+    def log_dir(self) -> Optional[str]:
+        return self._logger.log_dir
+
+    @property
+    def save_dir(self) -> Optional[str]:
+        return self._logger.save_dir
+
+    @property
+    def experiment(self) -> Any:
+        return self._logger.experiment
+
+    def _put(self, kind: str, payload: Any) -> bool:
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="async-logger", daemon=True)
+            self._thread.start()
+        try:
+            self._queue.put_nowait((kind, payload))
+            return True
+        except queue.Full:
+            self._drop(kind)
+            return False
+
+    def _drop(self, kind: str) -> None:
+        self.dropped += 1
+        if self.dropped == 1 or self.dropped % 1000 == 0:
+            log.warning(
+                f"Logging queue is full, dropped {self.dropped} calls so far (last: {kind})"
+            )
+
+    @rank_zero_only
+    def log_metrics(self, metrics: Dict[str, float], step: Optional[int] = None) -> None:
+        self._put("metrics", (dict(metrics), step))
+
+    @rank_zero_only
+    def log_hyperparams(
+        self, params: Union[Dict[str, Any], Namespace], *args: Any, **kwargs: Any
+    ) -> None:
+        self._put("hyperparams", (params, args, kwargs))
+
+    @rank_zero_only
+    def log_image(
+        self, key: str, images: List[Any], step: Optional[int] = None, **kwargs: Any
+    ) -> None:
+        if not hasattr(self._logger, "log_image"):
+            return
+        with self._lock:
+            if self._media >= self.max_media:
+                self._drop("image")
+                return
+            self._media += 1
+        images = [
+            image.detach().cpu() if isinstance(image, torch.Tensor) else image for image in images
+        ]
+        if self._queue.qsize() >= self.max_queue // 2:
+            images = [downsample(image) for image in images]
+        if not self._put("image", (key, images, step, kwargs)):
+            with self._lock:
+                self._media -= 1
+
+    @rank_zero_only
+    def log_graph(
+        self, model: torch.nn.Module, input_array: Optional[torch.Tensor] = None
+    ) -> None:
+        self._logger.log_graph(model, input_array)
+
+    @rank_zero_only
+    def save(self) -> None:
+        self._put("save", None)
+
+    def after_save_checkpoint(self, checkpoint_callback: Any) -> None:
+        self._put("checkpoint", checkpoint_callback)
+
+    @rank_zero_only
+    def finalize(self, status: str) -> None:
+        self.flush()
+        self._logger.finalize(status)
+
+    def flush(self) -> None:
+        """Block until every pending call reached the wrapped logger, then stop the thread."""
+        if self._thread is None:
+            return
+        self._queue.join()
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                items = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(items) < self.batch_size:
+                try:
+                    items.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._replay(items)
+            for _ in items:
+                self._queue.task_done()
+
+    def _call(self, method: str, *args: Any, **kwargs: Any) -> None:
+        try:
+            getattr(self._logger, method)(*args, **kwargs)
+        except Exception as e:
+            log.warning(f"Async {method} on {type(self._logger).__name__} failed: {e}")
+
+    def _replay(self, items: List[Tuple[str, Any]]) -> None:
+        # metrics of consecutive calls for the same step are merged into one call
+        pending: Optional[Tuple[Dict[str, float], Optional[int]]] = None
+        for kind, payload in items:
+            if kind == "metrics":
+                metrics, step = payload
+                if pending is not None and pending[1] == step:
+                    pending[0].update(metrics)
+                    continue
+                if pending is not None:
+                    self._call("log_metrics", *pending)
+                pending = (metrics, step)
+                continue
+            if pending is not None:
+                self._call("log_metrics", *pending)
+                pending = None
+            if kind == "image":
+                key, images, step, kwargs = payload
+                with self._lock:
+                    self._media -= 1
+                self._call("log_image", key=key, images=images, step=step, **kwargs)
+            elif kind == "hyperparams":
+                params, args, kwargs = payload
+                self._call("log_hyperparams", params, *args, **kwargs)
+            elif kind == "save":
+                self._call("save")
+            elif kind == "checkpoint":
+                self._call("after_save_checkpoint", payload)
+        if pending is not None:
+            self._call("log_metrics", *pending)
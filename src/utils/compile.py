@@ -0,0 +1,70 @@
+import os
+from typing import Any, Callable, Optional
+
+import torch
+
+from src.utils import pylogger
+
+log = pylogger.RankedLogger(__name__, rank_zero_only=True)
+
+
+def set_compile_cache(cache_dir: str) -> None:
+    """Keep the Inductor caches (FX graphs, AOTAutograd, Triton, autotuning) in `cache_dir`.
+
+    Runs that share the directory, like the jobs of a Hydra multirun and `src/eval.py` after
+    training, load the compiled kernels from it instead of compiling again. Must be set before the
+    first compilation of the process.
+    """
+    cache_dir = os.path.abspath(cache_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    os.environ["TORCHINDUCTOR_CACHE_DIR"] = cache_dir
+    torch._inductor.config.fx_graph_cache = True
+    torch._inductor.config.autotune_local_cache = True
+    torch._functorch.config.enable_autograd_cache = True
+
+
+class CompiledFallback:
+    """`torch.compile` of a module that falls back to the eager module when compilation fails.
+
+    Compilation is lazy, so failures only show at the first calls: when a compiled call raises, the
+    eager module runs the same inputs, and if that succeeds the compiled version is dropped for
+    good. Errors of the module itself are raised by the eager call.
+
+    Not an `nn.Module`, so the compiled wrapper does not change the `state_dict` keys of its owner
+    and checkpoints stay loadable without compilation.
+    """
+
+    def __init__(
+        self,
+        module: torch.nn.Module,
+        mode: Optional[str] = None,
+        dynamic: Optional[bool] = None,
+        fullgraph: bool = False,
+        name: Optional[str] = None,
+    ) -> None:
+        """
+        :param module: The module to compile.
+        :param mode: `torch.compile` mode: `default`, `reduce-overhead`, `max-autotune`...
+        :param dynamic: Compile for dynamic shapes, `None` to let Dynamo decide after a
+            recompilation.
+        :param fullgraph: Fail on graph breaks instead of splitting the graph.
+        :param name: Name of the module in the fallback warning.
+        """
+        self.module = module
+        self.name = name or type(module).__name__
+        self.compiled: Optional[Callable[..., Any]] = torch.compile(
+            module, mode=mode, dynamic=dynamic, fullgraph=fullgraph
+        )
+
+    def __call__(self, *args: Any, **kwargs: Any) -> Any:
+        if self.compiled is not None:
+            try:
+                return self.compiled(*args, **kwargs)
+            except Exception as error:
+                outputs = self.module(*args, **kwargs)
+                log.warning(
+                    f"torch.compile of {self.name} failed, running it in eager mode: {error}"
+                )
+                self.compiled = None
+                return outputs
+        return self.module(*args, **kwargs)
@@ -0,0 +1,178 @@
+import copy
+import os
+import time
+from typing import Dict, List, NamedTuple, Tuple
+
+import torch
+
+
+def available_cores() -> List[List[int]]:
+    """Logical CPUs this process may run on, grouped by physical core (hyperthread siblings)."""
+    if hasattr(os, "sched_getaffinity"):
+        cpus = sorted(os.sched_getaffinity(0))
+    else:
+        cpus = list(range(os.cpu_count() or 1))
+    cores: Dict[tuple, List[int]] = {}
+    for cpu in cpus:
+        topology = f"/sys/devices/system/cpu/cpu{cpu}/topology"
+        try:
+            with open(f"{topology}/physical_package_id") as package:
+                with open(f"{topology}/core_id") as core:
+                    key = (int(package.read()), int(core.read()))
+        except (OSError, ValueError):
+            key = (0, cpu)
+        cores.setdefault(key, []).append(cpu)
+    return list(cores.values())
+
+
+class CorePartition(NamedTuple):
+    compute: List[int]
+    workers: List[List[int]]
+
+
+def partition_cores(num_workers: int, cores_per_worker: int = 1) -> CorePartition:
+    """Give every DataLoader worker `cores_per_worker` physical cores, the rest to compute threads.
+
+    Workers take the last cores, so the compute threads keep core 0 onwards. When there are too few
+    cores, workers share theirs and the compute threads keep at least half of the cores.
+    """
+    cores = available_cores()
+    if num_workers <= 0:
+        return CorePartition([cpu for core in cores for cpu in core], [])
+    reserved = min(num_workers * cores_per_worker, len(cores) // 2)
+    split = len(cores) - reserved
+    compute, worker_cores = cores[:split], cores[split:] or cores[-1:]
+    workers = []
+    for worker in range(num_workers):
+        # one logical CPU per physical core, siblings are left to the core's other thread
+        start = (worker * cores_per_worker) % len(worker_cores)
+        picked = [
+            worker_cores[(start + offset) % len(worker_cores)][0]
+            for offset in range(cores_per_worker)
+        ]
+        workers.append(sorted(set(picked)))
+    return CorePartition([core[0] for core in compute], workers)
+
+
+class WorkerAffinity:
+    """`worker_init_fn` pinning every DataLoader worker to its own cores of `partition_cores`.
+
+    Each worker also limits its PyTorch intra-op threads to its number of cores, so workers do not
+    oversubscribe the cores of the compute threads. The partition is taken when this object is
+    created, before the main process is pinned to its compute cores.
+    """
+
+    def __init__(self, num_workers: int, cores_per_worker: int = 1) -> None:
+        self.workers = partition_cores(num_workers, cores_per_worker).workers
+
+    def __call__(self, worker_id: int) -> None:
+        if not self.workers:
+            return
+        cpus = self.workers[worker_id % len(self.workers)]
+        set_affinity(cpus)
+        torch.set_num_threads(len(cpus))
+
+
+def set_affinity(cpus: List[int]) -> None:
+    """Pin every thread of this process to `cpus`.
+
+    On Linux `sched_setaffinity(0, ...)` only pins the calling thread, threads that already exist,
+    like the intra-op OpenMP pool created with the model, keep their mask. Threads started later
+    inherit the mask of the thread starting them.
+    """
+    if not hasattr(os, "sched_setaffinity"):
+        return
+    try:
+        threads = [int(tid) for tid in os.listdir("/proc/self/task")]
+    except OSError:
+        threads = [0]
+    for tid in threads:
+        try:
+            os.sched_setaffinity(tid, cpus)
+        except ProcessLookupError:
+            # the thread exited in between
+            continue
+
+
+def pin_compute_threads(cpus: List[int]) -> Tuple[List[int], int]:
+    """Pin every thread of this process to `cpus` and use one intra-op thread per CPU.
+
+    :return: The previous CPUs and intra-op thread count, for `restore_compute_threads`.
+    """
+    previous = sorted(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else []
+    num_threads = torch.get_num_threads()
+    set_affinity(cpus)
+    torch.set_num_threads(len(cpus))
+    return previous, num_threads
+
+
+def restore_compute_threads(cpus: List[int], num_threads: int) -> None:
+    """Undo `pin_compute_threads` with the values it returned."""
+    if cpus:
+        set_affinity(cpus)
+    torch.set_num_threads(num_threads)
+
+
+def bf16_supported() -> bool:
+    """Whether the CPU has native bf16 instructions (AVX512-BF16 or AMX) for bf16 autocast."""
+    for check in ("_is_avx512_bf16_supported", "_is_amx_tile_supported"):
+        if getattr(torch.cpu, check, lambda: False)():
+            return True
+    try:
+        with open("/proc/cpuinfo") as file:
+            flags = file.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
+
+
+def measure_throughput(
+    net: torch.nn.Module,
+    input_shape: tuple,
+    steps: int = 10,
+    warmup: int = 3,
+    channels_last: bool = False,
+    bf16_autocast: bool = False,
+) -> float:
+    """Training samples per second of forward and backward passes of a copy of `net`.
+
+    :param net: The network, left untouched.
+    :param input_shape: (B, C, H, W) of an input batch.
+    :param steps: Number of timed steps.
+    :param warmup: Number of untimed steps first.
+    :param channels_last: Run the network and its inputs in channels_last memory format.
+    :param bf16_autocast: Run the forward pass under CPU bf16 autocast.
+    :return: Samples per second.
+    """
+    net = copy.deepcopy(net).cpu().train()
+    x = torch.randn(input_shape)
+    if channels_last:
+        net = net.to(memory_format=torch.channels_last)
+        x = x.contiguous(memory_format=torch.channels_last)
+    for step in range(warmup + steps):
+        if step == warmup:
+            start = time.perf_counter()
+        with torch.autocast("cpu", dtype=torch.bfloat16, enabled=bf16_autocast):
+            out = net(x)
+        out.float().abs().mean().backward()
+        net.zero_grad(set_to_none=True)
+    return steps * input_shape[0] / (time.perf_counter() - start)
+
+
+def compare_throughput(
+    net: torch.nn.Module,
+    input_shape: tuple,
+    channels_last: bool,
+    bf16_autocast: bool,
+    steps: int = 10,
+) -> Dict[str, float]:
+    """Throughput of the fp32 contiguous baseline and of the given mode, and the speed-up."""
+    baseline = measure_throughput(net, input_shape, steps)
+    optimized = measure_throughput(
+        net, input_shape, steps, channels_last=channels_last, bf16_autocast=bf16_autocast
+    )
+    return {
+        "baseline_samples_per_sec": baseline,
+        "samples_per_sec": optimized,
+        "speedup": optimized / baseline,
+    }
@@ -6,6 +6,7 @@ from lightning.pytorch.loggers import Logger
 from omegaconf import DictConfig
 
 from src.utils import pylogger
+from src.utils.async_logger import AsyncLogger
 
 log = pylogger.RankedLogger(__name__, rank_zero_only=True)
 
@@ -53,4 +54,10 @@ def instantiate_loggers(logger_cfg: DictConfig) -> List[Logger]:
             log.info(f"Instantiating logger <{lg_conf._target_}>")
             logger.append(hydra.utils.instantiate(lg_conf))
 
+    # `logger=[<loggers>,async]` moves every logger behind a background queue (see `AsyncLogger`)
+    async_cfg = logger_cfg.get("async")
+    if async_cfg:
+        log.info("Wrapping loggers in <src.utils.async_logger.AsyncLogger>")
+        logger = [AsyncLogger(lg, **async_cfg) for lg in logger]
+
     return logger
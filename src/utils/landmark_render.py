@@ -0,0 +1,105 @@
+from typing import Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+import torchvision
+
+IMG_MEAN = (0.485, 0.456, 0.406)
+IMG_STD = (0.229, 0.224, 0.225)
+
+TARGET_COLOR = (0, 255, 0)
+PRED_COLOR = (255, 0, 0)
+
+
+def to_uint8(images: torch.Tensor) -> torch.Tensor:
+    """Undo the ImageNet normalization of a (B, 3, H, W) float batch, uint8 ones pass through."""
+    if images.dtype == torch.uint8:
+        return images
+    mean = images.new_tensor(IMG_MEAN).view(1, 3, 1, 1)
+    std = images.new_tensor(IMG_STD).view(1, 3, 1, 1)
+    return (images * std + mean).mul_(255).clamp_(0, 255).round_().to(torch.uint8)
+
+
+def to_pixels(keypoints: torch.Tensor, height: int, width: int) -> torch.Tensor:
+    """Map (..., K, 2) keypoints in [-0.5, 0.5] to pixels of a `width` x `height` image."""
+    return (keypoints + 0.5) * keypoints.new_tensor([width, height])
+
+
+def _disk(radius: int, device: torch.device) -> torch.Tensor:
+    """(P, 2) integer (dx, dy) offsets of a filled disk."""
+    steps = torch.arange(-radius, radius + 1, device=device)
+    dy, dx = torch.meshgrid(steps, steps, indexing="ij")
+    inside = dx**2 + dy**2 <= radius**2 + radius
+    return torch.stack([dx[inside], dy[inside]], dim=1)
+
+
+def draw_points(
+    images: torch.Tensor,
+    points: torch.Tensor,
+    color: Tuple[int, int, int],
+    radius: int = 1,
+) -> torch.Tensor:
+    """Stamp a disk of `color` at every point of a whole batch with a single index op, in place.
+
+    :param images: (B, C, H, W) uint8 images.
+    :param points: (B, K, 2) pixel coordinates, `x` then `y`.
+    :param color: RGB color, only the first C values are used.
+    :param radius: Disk radius in pixels.
+    :return: `images`.
+    """
+    batch, channels, height, width = images.shape
+    points = torch.as_tensor(points, device=images.device)
+    # (B, K, P, 2) pixels covered by every disk
+    pixels = points.round().long()[:, :, None, :] + _disk(radius, images.device)
+    x, y = pixels[..., 0], pixels[..., 1]
+    inside = (x >= 0) & (x < width) & (y >= 0) & (y < height)
+    index = torch.arange(batch, device=images.device).view(batch, 1, 1).expand_as(x)
+    value = torch.tensor(color[:channels], dtype=images.dtype, device=images.device)
+    # (B, H, W, C) view of the same memory
+    images.permute(0, 2, 3, 1)[index[inside], y[inside], x[inside]] = value
+    return images
+
+
+def draw_landmarks(
+    images: torch.Tensor,
+    targets: Optional[torch.Tensor] = None,
+    preds: Optional[torch.Tensor] = None,
+    radius: int = 1,
+) -> torch.Tensor:
+    """Draw target (green) and predicted (red) keypoints in [-0.5, 0.5] on a batch.
+
+    :param images: (B, 3, H, W) uint8 or ImageNet-normalized float images.
+    :param targets: Optional (B, K, 2) target keypoints.
+    :param preds: Optional (B, K, 2) predicted keypoints, drawn over the targets.
+    :param radius: Disk radius in pixels.
+    :return: (B, 3, H, W) uint8 images.
+    """
+    images = to_uint8(images).clone()
+    height, width = images.shape[-2:]
+    for points, color in ((targets, TARGET_COLOR), (preds, PRED_COLOR)):
+        if points is not None:
+            points = torch.as_tensor(points, device=images.device).float()
+            draw_points(images, to_pixels(points, height, width), color, radius)
+    return images
+
+
+def render_grid(
+    images: torch.Tensor,
+    targets: Optional[torch.Tensor] = None,
+    preds: Optional[torch.Tensor] = None,
+    radius: int = 2,
+    nrow: int = 8,
+) -> torch.Tensor:
+    """Draw the keypoints of a batch and tile it into one (3, H', W') float image in [0, 1], ready
+    for `torchvision.utils.save_image` or a logger's `log_image`."""
+    annotated = draw_landmarks(images, targets, preds, radius)
+    return torchvision.utils.make_grid(annotated, nrow=nrow).float() / 255
+
+
+def annotate_image(
+    image: np.ndarray, keypoints: np.ndarray, color: Sequence[int] = TARGET_COLOR, radius: int = 1
+) -> np.ndarray:
+    """Draw pixel keypoints on one (H, W, 3) uint8 image, returns a new array."""
+    tensor = torch.from_numpy(np.array(image, dtype=np.uint8)).permute(2, 0, 1)[None]
+    points = torch.as_tensor(np.asarray(keypoints, dtype=np.float32))[None]
+    return draw_points(tensor, points, tuple(color), radius)[0].permute(1, 2, 0).numpy()
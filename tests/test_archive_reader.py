@@ -0,0 +1,92 @@
+import gzip
+import io
+import os
+import pickle
+import tarfile
+import zipfile
+from pathlib import Path
+from typing import Dict
+from unittest import mock
+
+import pytest
+
+from src.data.components.archive_reader import ArchiveReader
+
+MEMBERS = {
+    "data/a.txt": b"first member",
+    "data/images/b.jpg": bytes(range(256)) * 64,
+    "data/c.bin": b"\x00" * 5000,
+}
+
+
+def zip_bytes(members: Dict[str, bytes]) -> bytes:
+    """A zip with a directory entry, stored and deflated members."""
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("data/", b"")
+        for i, (name, data) in enumerate(members.items()):
+            compression = zipfile.ZIP_STORED if i % 2 else zipfile.ZIP_DEFLATED
+            archive.writestr(name, data, compress_type=compression)
+    return buffer.getvalue()
+
+
+def tar_bytes(members: Dict[str, bytes]) -> bytes:
+    """A plain tar of `members`, the first one stored under a `./` prefix."""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w") as archive:
+        for i, (name, data) in enumerate(members.items()):
+            info = tarfile.TarInfo(f"./{name}" if i == 0 else name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize("kind", ["zip", "tar"])
+def test_archive_reader_index(tmp_path: Path, kind: str) -> None:
+    """Tests that members are read through the index, which is saved, reused and rebuilt when
+    the archive changes.
+
+    :param tmp_path: The temporary directory.
+    :param kind: Archive format.
+    """
+    path = tmp_path / f"archive.{kind}"
+    write = zip_bytes if kind == "zip" else tar_bytes
+    path.write_bytes(write(MEMBERS))
+
+    reader = ArchiveReader(str(path))
+    assert sorted(reader.names()) == sorted(MEMBERS)
+    assert all(reader.read(name) == data for name, data in MEMBERS.items())
+    assert os.path.isfile(f"{path}.index.json")
+    target = reader.extract("data/images/b.jpg", str(tmp_path / "out"))
+    assert Path(target).read_bytes() == MEMBERS["data/images/b.jpg"]
+
+    # the saved index is reused, and a worker gets its own file handle
+    with mock.patch.object(ArchiveReader, "build_index", side_effect=AssertionError):
+        copy = pickle.loads(pickle.dumps(ArchiveReader(str(path))))
+    assert copy._file is None
+    assert copy.read("data/a.txt") == MEMBERS["data/a.txt"]
+    copy.close()
+    reader.close()
+
+    # rewriting the archive invalidates the index
+    changed = {**MEMBERS, "data/a.txt": b"changed member of another size"}
+    path.write_bytes(write(changed))
+    reader = ArchiveReader(str(path))
+    assert reader.read("data/a.txt") == changed["data/a.txt"]
+    reader.close()
+
+
+def test_archive_reader_gzip(tmp_path: Path) -> None:
+    """Tests that a `.tar.gz` is recompressed once into a seekable `.tar` next to it."""
+    path = tmp_path / "archive.tar.gz"
+    path.write_bytes(gzip.compress(tar_bytes(MEMBERS)))
+
+    reader = ArchiveReader.open(str(path))
+    assert reader.path == str(tmp_path / "archive.tar") and reader.kind == "tar"
+    assert all(reader.read(name) == data for name, data in MEMBERS.items())
+    reader.close()
+
+    with mock.patch.object(ArchiveReader, "recompress", side_effect=AssertionError):
+        reader = ArchiveReader.open(str(path))
+    assert reader.read("data/c.bin") == MEMBERS["data/c.bin"]
+    reader.close()
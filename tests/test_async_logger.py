@@ -0,0 +1,70 @@
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import torch
+from lightning.pytorch.loggers import Logger
+
+from src.utils.async_logger import AsyncLogger
+
+
+class SlowLogger(Logger):
+    """Records every call, blocking until `release` is set to stand in for a slow backend."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.metrics: List[Dict[str, float]] = []
+        self.images: List[List[Any]] = []
+        self.release = threading.Event()
+
+    @property
+    def name(self) -> str:
+        return "slow"
+
+    @property
+    def version(self) -> int:
+        return 0
+
+    def log_hyperparams(self, params: Any, *args: Any, **kwargs: Any) -> None:
+        pass
+
+    def log_metrics(self, metrics: Dict[str, float], step: Optional[int] = None) -> None:
+        self.release.wait()
+        self.metrics.append({**metrics, "step": step})
+
+    def log_image(self, key: str, images: List[Any], step: Optional[int] = None) -> None:
+        self.images.append(images)
+
+
+def test_async_logger_batches_metrics() -> None:
+    """Tests that logging does not wait for the backend and that metrics of a step are merged."""
+    inner = SlowLogger()
+    logger = AsyncLogger(inner, flush_interval=0.01)
+
+    start = time.perf_counter()
+    for step in range(10):
+        logger.log_metrics({"train/loss": float(step)}, step=step)
+        logger.log_metrics({"train/err": float(step)}, step=step)
+    assert time.perf_counter() - start < 0.5
+
+    inner.release.set()
+    logger.finalize("success")
+    assert len(inner.metrics) == 10
+    assert inner.metrics[3] == {"train/loss": 3.0, "train/err": 3.0, "step": 3}
+
+
+def test_async_logger_back_pressure() -> None:
+    """Tests that a full queue drops calls and that images beyond `max_media` are dropped."""
+    inner = SlowLogger()
+    logger = AsyncLogger(inner, max_queue=4, max_media=2, flush_interval=0.01)
+
+    for step in range(20):
+        logger.log_metrics({"x": float(step)}, step=step)
+    for _ in range(5):
+        logger.log_image(key="image", images=[torch.rand(3, 8, 8)])
+    assert logger.dropped > 0
+
+    inner.release.set()
+    logger.finalize("success")
+    assert len(inner.metrics) + len(inner.images) + logger.dropped == 25
+    assert len(inner.images) <= 2
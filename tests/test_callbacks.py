@@ -0,0 +1,146 @@
+import json
+from functools import partial
+from pathlib import Path
+from typing import Any, Dict, List
+from unittest import mock
+
+import albumentations as A
+import cv2
+import numpy as np
+import torch
+from albumentations.pytorch.transforms import ToTensorV2
+from lightning import Trainer
+from lightning.pytorch.callbacks import Callback
+from lightning.pytorch.loggers import CSVLogger
+from torch import nn
+
+from src.callbacks.probe import ProbeSetCallback
+from src.callbacks.step_profiler import PHASES, StepPhaseProfiler
+from src.callbacks.visualization import ValidationVisualizer
+from src.data.components.synthetic import write_dlib
+from src.data.dlib_datamodule import DLIBDataModule
+from src.models.dlib_module import DLIBLitModule
+
+
+class ImageLogger(CSVLogger):
+    """A CSV logger that keeps the images passed to `log_image`, like `WandbLogger` uploads."""
+
+    def __init__(self, save_dir: str) -> None:
+        super().__init__(save_dir)
+        self.images: List[Dict[str, Any]] = []
+
+    def log_image(self, key: str, images: list, step: int) -> None:
+        self.images.append({"key": key, "images": images, "step": step})
+
+
+def fit(tmp_path: Path, callbacks: List[Callback]) -> Trainer:
+    """Train a tiny landmark model for one short epoch on a synthetic DLIB dataset.
+
+    :param tmp_path: The temporary directory holding the dataset and the logs.
+    :param callbacks: The callbacks to train with.
+    :return: The trainer, after fit.
+    """
+    write_dlib(str(tmp_path / "data"), num_images=40, min_size=160, max_size=240)
+    transform = A.Compose(
+        [A.Resize(64, 64), A.Normalize(), ToTensorV2()],
+        keypoint_params=A.KeypointParams(format="xy", remove_invisible=False),
+    )
+    datamodule = DLIBDataModule(
+        data_dir=str(tmp_path / "data"),
+        transform_train=transform,
+        transform_val=transform,
+        batch_size=4,
+        num_workers=0,
+    )
+    net = nn.Sequential(
+        nn.Conv2d(3, 8, 3, 2),
+        nn.ReLU(),
+        nn.AdaptiveAvgPool2d(1),
+        nn.Flatten(),
+        nn.Linear(8, 68 * 2),
+        nn.Unflatten(1, (68, 2)),
+    )
+    model = DLIBLitModule(net, optimizer=partial(torch.optim.Adam, lr=1e-3), scheduler=None)
+    trainer = Trainer(
+        max_epochs=1,
+        limit_train_batches=2,
+        limit_val_batches=2,
+        num_sanity_val_steps=0,
+        accelerator="cpu",
+        devices=1,
+        callbacks=callbacks,
+        logger=ImageLogger(str(tmp_path / "logs")),
+        enable_checkpointing=False,
+        enable_progress_bar=False,
+        enable_model_summary=False,
+    )
+    trainer.fit(model, datamodule=datamodule)
+    return trainer
+
+
+def test_validation_visualizer(tmp_path: Path) -> None:
+    """Tests that a validation epoch renders the sampled landmarks to disk and to the loggers.
+
+    :param tmp_path: The temporary directory.
+    """
+    save_path = tmp_path / "val_end.png"
+    visualizer = ValidationVisualizer(num_samples=3, save_path=str(save_path))
+    trainer = fit(tmp_path, [visualizer])
+
+    # teardown waits for the background render
+    assert visualizer.executor is None and save_path.is_file()
+    (logged,) = trainer.logger.images
+    assert logged["key"] == "annotated_image" and logged["step"] == trainer.global_step
+    grid = logged["images"][0]
+    assert grid.dtype == torch.float32 and 0 <= grid.min() and grid.max() <= 1
+    # three 64 px samples in one row of the grid, with its 2 px padding
+    assert grid.shape == (3, 64 + 4, 3 * 64 + 8)
+
+
+def test_probe_set(tmp_path: Path) -> None:
+    """Tests that the probe faces are cropped once and annotated on their images after an epoch.
+
+    :param tmp_path: The temporary directory.
+    """
+    paths = [str(tmp_path / "first.jpg"), str(tmp_path / "second.jpg")]
+    rng = np.random.default_rng(0)
+    for path in paths:
+        cv2.imwrite(path, rng.integers(0, 256, (120, 160, 3), dtype=np.uint8))
+    # a box hanging over the top left corner is clipped to the image
+    faces = [[{"x": 10, "y": 20, "w": 60, "h": 50}], [{"x": -10, "y": -5, "w": 40, "h": 45}]]
+    probe = ProbeSetCallback(paths, input_size=32)
+    with mock.patch("src.callbacks.probe.detect_faces", side_effect=faces) as detect:
+        trainer = fit(tmp_path, [probe])
+    assert detect.call_count == 2
+    assert probe.batch.shape == (2, 3, 32, 32) and probe.batch.dtype == torch.uint8
+    assert probe.faces[1] == {"image": 1, "x": 0, "y": 0, "w": 30, "h": 40}
+
+    (logged,) = trainer.logger.images
+    assert logged["key"] == "Predicted Image" and len(logged["images"]) == 2
+    for image, original in zip(logged["images"], probe.images):
+        assert image.shape == original.shape and (image != original).any()
+    assert trainer.callback_metrics["probe/ms_per_face"] > 0
+
+
+def test_step_phase_profiler(tmp_path: Path) -> None:
+    """Tests that the training steps are split into phases, summarized and traced, and that the
+    timing wrappers are removed after fit.
+
+    :param tmp_path: The temporary directory.
+    """
+    trace_path = tmp_path / "trace.json"
+    profiler = StepPhaseProfiler(trace_path=str(trace_path))
+    trainer = fit(tmp_path, [profiler])
+
+    assert len(profiler.steps) == 2
+    for step in profiler.steps:
+        assert sum(step.get(phase, 0.0) for phase in PHASES) <= step["total"] + 1e-6
+    metrics = trainer.callback_metrics
+    assert metrics["profile/total_p50_ms"] > 0 and metrics["profile/forward_p50_ms"] > 0
+    assert 0 <= metrics["profile/data_wait_fraction"] <= 1
+
+    events = json.loads(trace_path.read_text())["traceEvents"]
+    phases = {event["name"] for event in events}
+    assert {"data_wait", "h2d", "forward", "loss", "backward", "optimizer", "metrics"} <= phases
+    assert "forward" not in vars(trainer.lightning_module)
+    assert "batch_to_device" not in vars(trainer.strategy)
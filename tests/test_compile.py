@@ -0,0 +1,44 @@
+from unittest import mock
+
+import pytest
+import torch
+from torch import nn
+
+from src.utils.compile import CompiledFallback
+from tests.helpers.run_if import RunIf
+
+
+def test_compiled_fallback() -> None:
+    """Tests that a failing compilation falls back to the eager module for good."""
+    module = nn.Linear(4, 2)
+    x = torch.randn(3, 4)
+    compiled = mock.Mock(side_effect=RuntimeError("backend compiler failed"))
+    with mock.patch("torch.compile", return_value=compiled) as compile:
+        wrapper = CompiledFallback(module, mode="reduce-overhead")
+    assert compile.call_args.kwargs["mode"] == "reduce-overhead"
+
+    assert torch.equal(wrapper(x), module(x))
+    assert wrapper.compiled is None
+    assert torch.equal(wrapper(x), module(x))
+    assert compiled.call_count == 1
+
+
+def test_compiled_fallback_module_error() -> None:
+    """Tests that errors of the module itself are raised, not hidden by the fallback."""
+    compiled = mock.Mock(side_effect=RuntimeError("shape mismatch"))
+    with mock.patch("torch.compile", return_value=compiled):
+        wrapper = CompiledFallback(nn.Linear(4, 2))
+    with pytest.raises(RuntimeError, match="mat1 and mat2"):
+        wrapper(torch.randn(3, 5))
+
+
+@RunIf(min_torch="2.0")
+@pytest.mark.slow
+def test_compiled_module() -> None:
+    """Tests that the compiled module matches the eager one and keeps the compiled version."""
+    module = nn.Sequential(nn.Linear(4, 8), nn.ReLU(), nn.Linear(8, 2))
+    x = torch.randn(3, 4)
+    wrapper = CompiledFallback(module, name="mlp")
+    with torch.no_grad():
+        assert torch.allclose(wrapper(x), module(x), atol=1e-6)
+    assert wrapper.compiled is not None
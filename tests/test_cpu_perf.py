@@ -0,0 +1,54 @@
+import os
+import threading
+from unittest import mock
+
+import pytest
+
+from src.utils.cpu_perf import (
+    WorkerAffinity,
+    partition_cores,
+    pin_compute_threads,
+    restore_compute_threads,
+)
+
+CORES = [[0, 8], [1, 9], [2, 10], [3, 11], [4, 12], [5, 13], [6, 14], [7, 15]]
+
+
+def test_partition_cores() -> None:
+    """Tests that workers get their own physical cores and the compute threads keep the rest."""
+    with mock.patch("src.utils.cpu_perf.available_cores", return_value=CORES):
+        compute, workers = partition_cores(num_workers=2, cores_per_worker=2)
+        assert compute == [0, 1, 2, 3]
+        assert workers == [[4, 5], [6, 7]]
+
+        # too many workers share the reserved cores, the compute threads keep half
+        compute, workers = partition_cores(num_workers=6)
+        assert compute == [0, 1, 2, 3]
+        assert len(workers) == 6 and all(len(cpus) == 1 and cpus[0] >= 4 for cpus in workers)
+
+        assert partition_cores(num_workers=0).workers == []
+        assert WorkerAffinity(num_workers=2).workers == [[6], [7]]
+
+
+@pytest.mark.skipif(not hasattr(os, "sched_getaffinity"), reason="CPU affinity needs Linux")
+def test_pin_compute_threads() -> None:
+    """Tests that pinning covers threads started before it and that it can be undone."""
+    cpus = sorted(os.sched_getaffinity(0))
+    started, done = threading.Event(), threading.Event()
+    masks = []
+
+    def thread() -> None:
+        started.set()
+        done.wait()
+        masks.append(os.sched_getaffinity(0))
+
+    worker = threading.Thread(target=thread)
+    worker.start()
+    started.wait()
+    previous = pin_compute_threads(cpus[:1])
+    done.set()
+    worker.join()
+    assert masks == [set(cpus[:1])]
+
+    restore_compute_threads(*previous)
+    assert sorted(os.sched_getaffinity(0)) == cpus
@@ -1,8 +1,21 @@
 from pathlib import Path
+from typing import Callable
 
+import albumentations as A
+import hydra
+import numpy as np
 import pytest
 import torch
+from albumentations.pytorch.transforms import ToTensorV2
+from omegaconf import OmegaConf
+from PIL import Image
+from torch.utils.data import Dataset
 
+from src.data.components.shards import ShardedIterableDataset, write_shards
+from src.data.components.synthetic import write_dlib, write_lpa
+from src.data.components.tensor_cache import TensorCache
+from src.data.dlib_datamodule import DLIBDataModule
+from src.data.lpa_datamodule import LPADataModule
 from src.data.mnist_datamodule import MNISTDataModule
 
 
@@ -36,3 +49,130 @@ def test_mnist_datamodule(batch_size: int) -> None:
     assert len(y) == batch_size
     assert x.dtype == torch.float32
     assert y.dtype == torch.int64
+
+
+@pytest.mark.parametrize(
+    "datamodule_cls,write",
+    [(DLIBDataModule, write_dlib), (LPADataModule, write_lpa)],
+)
+def test_landmark_datamodule(tmp_path: Path, datamodule_cls: type, write: Callable) -> None:
+    """Tests `DLIBDataModule` and `LPADataModule` offline on a synthetic 300W dataset, checking the
+    splits and the shapes, dtypes and range of a training batch.
+
+    :param tmp_path: The temporary directory holding the synthetic dataset.
+    :param datamodule_cls: The datamodule class to test.
+    :param write: The synthetic dataset writer matching the datamodule layout.
+    """
+    write(str(tmp_path), num_images=20, min_size=320, max_size=480)
+    transform = hydra.utils.instantiate(OmegaConf.load("configs/data/transform_val/default.yaml"))
+
+    dm = datamodule_cls(
+        data_dir=str(tmp_path),
+        transform_train=transform,
+        transform_val=transform,
+        batch_size=4,
+        num_workers=0,
+    )
+    dm.prepare_data()
+    dm.setup()
+    assert len(dm.data_train) + len(dm.data_val) + len(dm.data_test) == 20
+
+    x, y = next(iter(dm.train_dataloader()))
+    assert x.shape == (4, 3, 224, 224) and x.dtype == torch.float32
+    assert y.shape == (4, 68, 2)
+    assert y.abs().max() <= 0.5
+
+
+@pytest.mark.parametrize("world_size", [1, 2, 3])
+def test_sharded_dataset_ranks(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch, world_size: int
+) -> None:
+    """Tests that `ShardedIterableDataset` gives every rank the same number of distinct samples,
+    also when the split has fewer full shards than ranks.
+
+    :param tmp_path: The temporary directory holding the shards.
+    :param monkeypatch: Fixture simulating the DDP ranks.
+    :param world_size: The simulated number of ranks.
+    """
+    image = Image.new("RGB", (8, 8))
+    samples = [{"image": image, "landmark": np.full((68, 2), i, np.float32)} for i in range(5)]
+    write_shards(samples, str(tmp_path), shard_size=4)
+
+    seen = []
+    for rank in range(world_size):
+        monkeypatch.setattr(
+            ShardedIterableDataset, "_world", staticmethod(lambda: (rank, world_size))
+        )
+        dataset = ShardedIterableDataset(str(tmp_path), buffer_size=2)
+        indices = [int(sample["landmark"][0, 0]) for sample in dataset]
+        assert len(indices) == len(dataset) == 5 // world_size
+        seen += indices
+    assert len(set(seen)) == len(seen)
+
+
+@pytest.mark.parametrize(
+    "datamodule_cls,write",
+    [(DLIBDataModule, write_dlib), (LPADataModule, write_lpa)],
+)
+def test_eval_cache_key(tmp_path: Path, datamodule_cls: type, write: Callable) -> None:
+    """Tests that the cached val split is rebuilt when the transform or the labels change, so it
+    always matches the uncached split.
+
+    :param tmp_path: The temporary directory holding the synthetic dataset.
+    :param datamodule_cls: The datamodule class to test.
+    :param write: The synthetic dataset writer matching the datamodule layout.
+    """
+    write(str(tmp_path), num_images=20, min_size=320, max_size=480)
+    transform = hydra.utils.instantiate(OmegaConf.load("configs/data/transform_val/default.yaml"))
+    small = A.Compose(
+        [A.Resize(112, 112), A.Normalize(), ToTensorV2()],
+        keypoint_params=A.KeypointParams(format="xy", remove_invisible=False),
+    )
+
+    def val_split(transform: A.Compose, cache_eval: bool = True) -> Dataset:
+        dm = datamodule_cls(
+            data_dir=str(tmp_path),
+            transform_train=transform,
+            transform_val=transform,
+            num_workers=0,
+            cache_eval=cache_eval,
+        )
+        dm.prepare_data()
+        dm.setup()
+        return dm.data_val
+
+    def assert_matches(cached: TensorCache, data: Dataset) -> None:
+        assert isinstance(cached, TensorCache) and len(cached) == len(data)
+        for (image, landmark), (expected_image, expected_landmark) in zip(cached, data):
+            assert torch.allclose(torch.as_tensor(image), expected_image)
+            assert np.allclose(landmark, expected_landmark)
+
+    default = val_split(transform)
+    assert_matches(default, val_split(transform, cache_eval=False))
+
+    resized = val_split(small)
+    assert resized.cache_dir != default.cache_dir
+    assert resized[0][0].shape == (3, 112, 112)
+    assert val_split(transform).cache_dir == default.cache_dir
+
+    # new landmarks in the label files
+    write(str(tmp_path), num_images=20, seed=1, min_size=320, max_size=480)
+    relabeled = val_split(transform)
+    assert relabeled.cache_dir != default.cache_dir
+    assert_matches(relabeled, val_split(transform, cache_eval=False))
+
+
+def test_tensor_cache_rebuild(tmp_path: Path) -> None:
+    """Tests that a `TensorCache` opened with another key is rebuilt in place.
+
+    :param tmp_path: The temporary directory holding the cache.
+    """
+    first = [(torch.zeros(3, 4, 4), np.zeros((68, 2), np.float32)) for _ in range(3)]
+    second = [(torch.ones(3, 4, 4), np.ones((68, 2), np.float32)) for _ in range(2)]
+
+    cache = TensorCache.open(first, str(tmp_path), {"transform": "a"})
+    assert len(cache) == 3 and not cache[0][0].any()
+    assert len(TensorCache.open(second, str(tmp_path), {"transform": "a"})) == 3
+
+    cache = TensorCache.open(second, str(tmp_path), {"transform": "b"})
+    assert len(cache) == 2 and cache[0][0].all() and cache[0][1].all()
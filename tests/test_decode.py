@@ -0,0 +1,62 @@
+import io
+import math
+from typing import Tuple
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from src.data.components.decode import open_reduced
+
+
+def marker_jpeg(size: Tuple[int, int], marker: Tuple[int, int], radius: int) -> io.BytesIO:
+    """A dark JPEG of `size` with a bright square of `radius` centered on pixel `marker`."""
+    width, height = size
+    pixels = np.full((height, width, 3), 20, dtype=np.uint8)
+    x, y = marker
+    pixels[y - radius : y + radius + 1, x - radius : x + radius + 1] = 235
+    file = io.BytesIO()
+    Image.fromarray(pixels).save(file, format="JPEG", quality=95)
+    file.seek(0)
+    return file
+
+
+@pytest.mark.parametrize(
+    "size,decode_size,expected",
+    [((1001, 723), 100, 8), ((1001, 723), 300, 2), ((997, 611), 180, 4), ((20, 20), 2, 8)],
+)
+def test_open_reduced_factor(size: Tuple[int, int], decode_size: int, expected: int) -> None:
+    """Tests that the returned factor is the DCT scale the decoder used, also for odd and tiny
+    images where the decoded size rounds away from `size / factor`.
+
+    :param size: Width and height of the JPEG.
+    :param decode_size: Minimum side of the ROI after decoding.
+    :param expected: The expected reduction factor.
+    """
+    roi_box = (0, 0, size[0], size[1])
+    image, factor = open_reduced(
+        marker_jpeg(size, (size[0] // 2, size[1] // 2), 1), roi_box, decode_size
+    )
+    assert factor == expected
+    assert image.size == (math.ceil(size[0] / factor), math.ceil(size[1] / factor))
+
+
+@pytest.mark.parametrize("decode_size", [None, 300, 100])
+def test_open_reduced_keypoint(decode_size: int) -> None:
+    """Tests that an original pixel coordinate divided by the factor lands on the same content in
+    the reduced image.
+
+    :param decode_size: Minimum side of the ROI after decoding.
+    """
+    marker = (613, 389)
+    roi_box = (101, 57, 1001, 723)
+    image, factor = open_reduced(marker_jpeg((1001, 723), marker, 12), roi_box, decode_size)
+    assert factor == {None: 1, 300: 2, 100: 8}[decode_size]
+
+    pixels = np.asarray(image, dtype=np.float32)
+    weights = np.clip(pixels[..., 0] - 128, 0, None)
+    y, x = np.mgrid[0 : pixels.shape[0], 0 : pixels.shape[1]]
+    center = np.array([(weights * x).sum(), (weights * y).sum()]) / weights.sum()
+    # pixel centers sit at half a pixel, in the original and in the reduced image
+    keypoint = (np.array(marker) + 0.5) / factor - 0.5
+    assert np.abs(center - keypoint).max() < 0.5
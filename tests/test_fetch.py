@@ -0,0 +1,189 @@
+import hashlib
+import json
+import os
+import tarfile
+import threading
+import zipfile
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator, List, Tuple
+from unittest import mock
+
+import pytest
+
+from src.data.components.fetch import download, extract
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files with single byte range support and records the requested ranges."""
+
+    ranges = True
+    requests: List[str] = []
+
+    def log_message(self, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        path = self.translate_path(self.path)
+        with open(path, "rb") as file:
+            data = file.read()
+        header = self.headers.get("Range")
+        type(self).requests.append(header)
+        if self.ranges and header:
+            start, end = header.split("=")[1].split("-")
+            start, end = int(start), int(end) if end else len(data) - 1
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+            data = data[start : end + 1]
+        else:
+            self.send_response(200)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+@pytest.fixture
+def server(tmp_path: Path) -> Iterator[Tuple[str, Path]]:
+    """A local HTTP server over `tmp_path/www` standing in for the dataset hosts.
+
+    :param tmp_path: The temporary directory to serve.
+    :return: The base URL and the served directory.
+    """
+    root = tmp_path / "www"
+    root.mkdir()
+    RangeRequestHandler.ranges = True
+    RangeRequestHandler.requests = []
+    handler = partial(RangeRequestHandler, directory=str(root))
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_address[1]}", root
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def test_download_ranges(server: Tuple[str, Path], tmp_path: Path) -> None:
+    """Tests that a file is downloaded in parallel chunks and verified against its checksum.
+
+    :param server: The local HTTP server.
+    :param tmp_path: The temporary directory.
+    """
+    url, root = server
+    data = os.urandom(100_000)
+    (root / "file.bin").write_bytes(data)
+
+    sha256 = hashlib.sha256(data).hexdigest()
+    path = download(
+        f"{url}/file.bin", str(tmp_path / "file.bin"), sha256=sha256, chunk_size=16_384
+    )
+
+    assert Path(path).read_bytes() == data
+    assert len(RangeRequestHandler.requests) == 1 + 7
+    assert not (tmp_path / "file.bin.part").exists()
+    assert not (tmp_path / "file.bin.part.json").exists()
+
+
+def test_download_resume(server: Tuple[str, Path], tmp_path: Path) -> None:
+    """Tests that an interrupted download only fetches the chunks it is missing.
+
+    :param server: The local HTTP server.
+    :param tmp_path: The temporary directory.
+    """
+    url, root = server
+    data = os.urandom(64_000)
+    (root / "file.bin").write_bytes(data)
+    part = tmp_path / "file.bin.part"
+    part.write_bytes(data[:32_000] + bytes(32_000))
+    state = {"url": f"{url}/file.bin", "size": 64_000, "chunk_size": 16_000, "done": [0, 1]}
+    (tmp_path / "file.bin.part.json").write_text(json.dumps(state))
+
+    download(f"{url}/file.bin", str(tmp_path / "file.bin"), chunk_size=16_000)
+
+    assert (tmp_path / "file.bin").read_bytes() == data
+    assert sorted(RangeRequestHandler.requests[1:]) == ["bytes=32000-47999", "bytes=48000-63999"]
+
+
+def test_download_checksum_mismatch(server: Tuple[str, Path], tmp_path: Path) -> None:
+    """Tests that a download with the wrong checksum raises and is removed.
+
+    :param server: The local HTTP server.
+    :param tmp_path: The temporary directory.
+    """
+    url, root = server
+    (root / "file.bin").write_bytes(os.urandom(1_000))
+
+    with pytest.raises(IOError):
+        download(f"{url}/file.bin", str(tmp_path / "file.bin"), sha256="0" * 64)
+    assert not list(tmp_path.glob("file.bin*"))
+
+
+def test_download_without_ranges(server: Tuple[str, Path], tmp_path: Path) -> None:
+    """Tests the single connection fallback for servers without range support.
+
+    :param server: The local HTTP server.
+    :param tmp_path: The temporary directory.
+    """
+    url, root = server
+    RangeRequestHandler.ranges = False
+    data = os.urandom(50_000)
+    (root / "file.bin").write_bytes(data)
+    (tmp_path / "file.bin.part").write_bytes(data[:10_000])
+
+    download(f"{url}/file.bin", str(tmp_path / "file.bin"))
+
+    assert (tmp_path / "file.bin").read_bytes() == data
+
+
+@pytest.mark.parametrize("kind", ["zip", "tar", "tar.gz"])
+def test_extract_incremental(tmp_path: Path, kind: str) -> None:
+    """Tests that extraction skips the members already present with the right size.
+
+    :param tmp_path: The temporary directory.
+    :param kind: The archive format.
+    """
+    files = {f"folder/{index}.bin": os.urandom(1_000 + index) for index in range(10)}
+    archive = tmp_path / f"archive.{kind}"
+    if kind == "zip":
+        with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as file:
+            for name, data in files.items():
+                file.writestr(name, data)
+    else:
+        source = tmp_path / "source"
+        for name, data in files.items():
+            (source / name).parent.mkdir(parents=True, exist_ok=True)
+            (source / name).write_bytes(data)
+        with tarfile.open(archive, "w:gz" if kind == "tar.gz" else "w") as file:
+            file.add(source / "folder", arcname="folder")
+    dest = tmp_path / "dest"
+
+    with mock.patch("src.data.components.fetch._extract_stream", side_effect=AssertionError):
+        assert sorted(extract(str(archive), str(dest))) == sorted(files)
+    # a gzipped tar is decompressed once and then extracted in parallel
+    assert (tmp_path / "archive.tar").is_file() == (kind != "zip")
+    for name, data in files.items():
+        assert (dest / name).read_bytes() == data
+
+    (dest / "folder/3.bin").unlink()
+    (dest / "folder/5.bin").write_bytes(b"truncated")
+    assert sorted(extract(str(archive), str(dest))) == ["folder/3.bin", "folder/5.bin"]
+    assert (dest / "folder/5.bin").read_bytes() == files["folder/5.bin"]
+
+
+def test_extract_skips_corrupt_zip_members(tmp_path: Path) -> None:
+    """Tests that `extract` raises on a corrupt zip member, or skips it with `skip_errors`.
+
+    :param tmp_path: The temporary directory holding the archive.
+    """
+    archive = tmp_path / "archive.zip"
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_STORED) as file:
+        file.writestr("good.bin", b"a" * 100)
+        file.writestr("bad.bin", b"b" * 100)
+    data = archive.read_bytes()
+    offset = data.index(b"b" * 100)
+    archive.write_bytes(data[:offset] + b"c" + data[offset + 1 :])
+
+    with pytest.raises(zipfile.BadZipFile):
+        extract(str(archive), str(tmp_path / "strict"))
+    assert extract(str(archive), str(tmp_path / "dest"), skip_errors=True) == ["good.bin"]
+    assert not (tmp_path / "dest" / "bad.bin").exists()
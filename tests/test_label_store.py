@@ -0,0 +1,50 @@
+import os
+from pathlib import Path
+
+import numpy as np
+
+from src.data.components.dlib_lpa import DLIB_LPA
+from src.data.components.label_store import LabelStore, roi_boxes_from_landmarks
+
+
+def _write_lpa_labels(path: Path, names, landmarks: np.ndarray) -> None:
+    with open(path, "w") as file:
+        for name, points in zip(names, landmarks):
+            values = np.concatenate([points[:, 0], points[:, 1]])
+            file.write(" ".join([name] + [f"{v:.3f}" for v in values]) + "\n")
+
+
+def test_label_store_roundtrip_and_update(tmp_path: Path) -> None:
+    """Tests that `LabelStore` parses label files once, serves names, landmarks and roi boxes from
+    memory maps, and only rebuilds when a label file changes.
+
+    :param tmp_path: The temporary directory for the label files and the store.
+    """
+    rng = np.random.default_rng(0)
+    landmarks = rng.uniform(50, 150, size=(5, 68, 2)).astype(np.float32)
+    names = [f"img_{i}.jpg" for i in range(5)]
+    first, second = tmp_path / "a.txt", tmp_path / "b.txt"
+    _write_lpa_labels(first, names[:3], landmarks[:3])
+    _write_lpa_labels(second, names[3:], landmarks[3:])
+
+    store_dir = str(tmp_path / "store")
+    store = LabelStore.open(store_dir, [str(first), str(second)], DLIB_LPA.parse_labels)
+    assert len(store) == 5
+    assert [store.file_name(i) for i in range(5)] == names
+    np.testing.assert_allclose(store.landmarks, landmarks, atol=1e-3)
+    np.testing.assert_allclose(store.roi_boxes, roi_boxes_from_landmarks(store.landmarks))
+
+    # the roi box matches the per-sample implementation of the dataset
+    expected = DLIB_LPA.parse_roi_box_from_landmark(None, [tuple(p) for p in store.landmarks[0]])
+    np.testing.assert_allclose(store.roi_boxes[0], expected, rtol=1e-5)
+
+    # an unchanged store is reused as is
+    mtime = os.stat(os.path.join(store_dir, "landmarks.npy")).st_mtime_ns
+    assert len(LabelStore.open(store_dir, [str(first), str(second)], DLIB_LPA.parse_labels)) == 5
+    assert os.stat(os.path.join(store_dir, "landmarks.npy")).st_mtime_ns == mtime
+
+    # a changed label file triggers an update
+    _write_lpa_labels(second, names[3:4], landmarks[3:4])
+    store = LabelStore.open(store_dir, [str(first), str(second)], DLIB_LPA.parse_labels)
+    assert len(store) == 4
+    assert store.file_name(3) == names[3]
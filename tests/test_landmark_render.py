@@ -0,0 +1,60 @@
+import numpy as np
+import torch
+
+from src.utils.landmark_render import (
+    IMG_MEAN,
+    IMG_STD,
+    PRED_COLOR,
+    TARGET_COLOR,
+    annotate_image,
+    draw_landmarks,
+    render_grid,
+    to_pixels,
+    to_uint8,
+)
+
+
+def test_to_uint8() -> None:
+    """Tests that normalized images are mapped back to uint8 and uint8 ones pass through."""
+    images = torch.randint(0, 256, (2, 3, 8, 8), dtype=torch.uint8)
+    mean = torch.tensor(IMG_MEAN).view(1, 3, 1, 1)
+    std = torch.tensor(IMG_STD).view(1, 3, 1, 1)
+    assert torch.equal(to_uint8((images / 255 - mean) / std), images)
+    assert to_uint8(images) is images
+
+
+def test_draw_landmarks() -> None:
+    """Tests that keypoints in [-0.5, 0.5] land on their pixels, the predictions over the
+    targets."""
+    images = torch.zeros(2, 3, 20, 40, dtype=torch.uint8)
+    targets = torch.tensor([[[0.0, 0.0], [-0.5, -0.5]]]).expand(2, -1, -1)
+    preds = torch.tensor([[[0.0, 0.0], [0.25, 0.25]]]).expand(2, -1, -1)
+    assert torch.equal(to_pixels(preds[0], 20, 40), torch.tensor([[20.0, 10.0], [30.0, 15.0]]))
+
+    annotated = draw_landmarks(images, targets, preds, radius=0)
+    assert not images.any()
+    for x, y, color in ((20, 10, PRED_COLOR), (0, 0, TARGET_COLOR), (30, 15, PRED_COLOR)):
+        assert annotated[:, :, y, x].tolist() == [list(color)] * 2
+    assert annotated.bool().any(dim=1).sum() == 2 * 3
+
+    # a disk of radius 1 is a plus sign with its corners
+    disk = draw_landmarks(images, preds=preds[:, :1], radius=1)[0, 0, 9:12, 19:22]
+    assert disk.bool().all()
+
+
+def test_render_grid() -> None:
+    """Tests that a batch is tiled into one float image in [0, 1]."""
+    images = torch.randint(0, 256, (5, 3, 16, 16), dtype=torch.uint8)
+    grid = render_grid(images, torch.zeros(5, 68, 2), torch.zeros(5, 68, 2), nrow=3)
+    assert grid.dtype == torch.float32 and 0 <= grid.min() and grid.max() <= 1
+    # 2 rows of 3 images, with 2 px padding around every image
+    assert grid.shape == (3, 2 * 16 + 6, 3 * 16 + 8)
+
+
+def test_annotate_image() -> None:
+    """Tests drawing pixel keypoints on a single HWC image."""
+    image = np.zeros((10, 12, 3), dtype=np.uint8)
+    annotated = annotate_image(image, np.array([[3.0, 7.0]]), radius=0)
+    assert not image.any()
+    assert annotated[7, 3].tolist() == list(TARGET_COLOR)
+    assert annotated.any(axis=-1).sum() == 1
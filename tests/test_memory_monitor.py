@@ -0,0 +1,42 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+from torch.utils.data import DataLoader, TensorDataset
+
+from src.callbacks.memory_monitor import MemoryMonitor, dataloader_workers, sample
+
+
+def trainer_with(train_dataloader: DataLoader) -> SimpleNamespace:
+    """A trainer exposing only the public dataloader properties, without loop internals."""
+    fit_loop = SimpleNamespace(epoch_loop=SimpleNamespace())
+    return SimpleNamespace(
+        train_dataloader=train_dataloader, val_dataloaders=None, fit_loop=fit_loop
+    )
+
+
+def test_dataloader_workers() -> None:
+    """Tests that persistent workers are found from the DataLoader, and that the sample falls
+    back to all child processes when no iterator is reachable."""
+    dataset = TensorDataset(torch.arange(8.0))
+    assert dataloader_workers(trainer_with(DataLoader(dataset))) == []
+
+    loader = DataLoader(dataset, batch_size=2, num_workers=2, persistent_workers=True)
+    trainer = trainer_with(loader)
+    assert dataloader_workers(trainer) is None
+    next(iter(loader))
+    pids = dataloader_workers(trainer)
+    assert len(pids) == 2
+
+    stats = sample(pids)
+    assert stats["workers"] == 2 and stats["total_uss_mb"] > stats["main_uss_mb"]
+    assert sample(None)["workers"] >= 2
+
+
+def test_memory_monitor_growth() -> None:
+    """Tests that only a peak growing in each of the last `patience` epochs is reported."""
+    monitor = MemoryMonitor(patience=2, tolerance_mb=10.0, raise_on_growth=True)
+    for epoch, peak in enumerate([100.0, 150.0, 155.0, 200.0]):
+        monitor.check_growth(peak, epoch)
+    with pytest.raises(RuntimeError, match="at epoch 4"):
+        monitor.check_growth(250.0, 4)
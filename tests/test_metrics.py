@@ -0,0 +1,60 @@
+import pytest
+import torch
+
+from src.models.components.ced import CED
+from src.models.components.fr import FR
+from src.models.components.landmark_metrics import LandmarkCriterion, LandmarkMetrics
+from src.models.components.loss import SoftWingLoss
+from src.models.components.nme import NME
+
+
+@pytest.mark.parametrize("num_bins", [None, 1000])
+def test_ced(num_bins: int) -> None:
+    """Tests that `CED` matches a per-sample loop over `NME`, with exact errors and with the
+    fixed-bin histogram.
+
+    :param num_bins: Number of histogram bins, `None` to keep every error.
+    """
+    torch.manual_seed(0)
+    target = torch.rand(200, 68, 2) - 0.5
+    preds = target + torch.randn(200, 68, 2) * torch.rand(200, 1, 1) * 0.03
+
+    metric = CED(thresholds=(0.08, 0.10), max_error=0.10, num_bins=num_bins)
+    for start in range(0, 200, 64):
+        metric.update(preds[start : start + 64], target[start : start + 64])
+    results = metric.compute()
+
+    errors = torch.stack([NME()(p[None], t[None]) for p, t in zip(preds, target)])
+    assert torch.isclose(results["nme"], errors.mean(), atol=1e-6)
+    assert torch.isclose(results["fr@0.08"], (errors > 0.08).float().mean())
+    assert torch.isclose(results["fr@0.10"], FR(threshold=0.10)(preds, target))
+    assert 0.0 < results["auc@0.10"] < 1.0
+
+    x, y = metric.curve(steps=10)
+    assert x.shape == y.shape == (11,)
+    assert torch.all(y[1:] >= y[:-1])
+
+
+def test_landmark_metrics() -> None:
+    """Tests that the fused criterion and metrics match `SoftWingLoss`, `MeanAbsoluteError` and
+    `NME` computed separately."""
+    torch.manual_seed(0)
+    target = torch.rand(100, 68, 2) - 0.5
+    preds = target + torch.randn(100, 68, 2) * 0.02
+
+    loss, residual = LandmarkCriterion()(preds, target)
+    assert torch.isclose(loss, SoftWingLoss()(preds, target))
+
+    metric = LandmarkMetrics()
+    for start in range(0, 100, 32):
+        metric.update_residual(residual[start : start + 32], target[start : start + 32])
+    results = metric.compute()
+
+    assert torch.isclose(results["err"], (preds - target).abs().mean())
+    assert torch.isclose(results["nme"], NME()(preds, target))
+    distances = torch.linalg.norm(preds - target, dim=-1)
+    inter_ocular = torch.linalg.norm(target[:, 36] - target[:, 45], dim=-1)
+    inter_pupil = torch.linalg.norm(target[:, 36:42].mean(1) - target[:, 42:48].mean(1), dim=-1)
+    assert torch.isclose(results["nme_ip"], (distances.mean(1) / inter_pupil).mean())
+    assert torch.isclose(results["nme_eyes"], (distances[:, 36:48].mean(1) / inter_ocular).mean())
+    assert torch.isclose(results["nme_jaw"], (distances[:, :17].mean(1) / inter_ocular).mean())
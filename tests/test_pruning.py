@@ -0,0 +1,110 @@
+from types import SimpleNamespace
+
+import pytest
+import torch
+from lightning.pytorch.strategies import DDPStrategy
+from torch import nn
+
+from src.callbacks.pruning import ChannelPruning
+from src.models.components.channel_pruning import (
+    l1_importance,
+    prune_group,
+    resize_to_state_dict,
+    select_channels,
+    trace_channels,
+)
+from src.models.components.quantization import quantize_static
+from src.models.dlib_module import DLIBLitModule
+
+
+class Block(nn.Module):
+    """Residual block with a depthwise convolution and squeeze-excitation, like MobileNetV3."""
+
+    def __init__(self, channels: int) -> None:
+        super().__init__()
+        self.expand = nn.Sequential(nn.Conv2d(channels, 32, 1), nn.BatchNorm2d(32), nn.ReLU())
+        self.depthwise = nn.Sequential(
+            nn.Conv2d(32, 32, 3, padding=1, groups=32), nn.BatchNorm2d(32), nn.ReLU()
+        )
+        self.squeeze = nn.Sequential(
+            nn.AdaptiveAvgPool2d(1),
+            nn.Conv2d(32, 8, 1),
+            nn.ReLU(),
+            nn.Conv2d(8, 32, 1),
+            nn.Hardsigmoid(),
+        )
+        self.project = nn.Sequential(nn.Conv2d(32, channels, 1), nn.BatchNorm2d(channels))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        y = self.depthwise(self.expand(x))
+        return x + self.project(y * self.squeeze(y))
+
+
+class Net(nn.Module):
+    def __init__(self) -> None:
+        super().__init__()
+        self.stem = nn.Sequential(nn.Conv2d(3, 16, 3, 2), nn.BatchNorm2d(16), nn.ReLU())
+        self.blocks = nn.Sequential(Block(16), Block(16))
+        self.head = nn.Sequential(nn.Linear(16, 64), nn.Hardswish(), nn.Linear(64, 68 * 2))
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        x = nn.functional.adaptive_avg_pool2d(self.blocks(self.stem(x)), 1)
+        return self.head(torch.flatten(x, 1)).view(-1, 68, 2)
+
+
+def test_channel_pruning() -> None:
+    """Tests that residual and squeeze-excitation channels are pruned together, that the rebuilt
+    network fits the MACs target, and that its state dict loads into the full network."""
+    torch.manual_seed(0)
+    net, x = Net().eval(), torch.randn(2, 3, 32, 32)
+    graph = trace_channels(net, x)
+    prunable = [group for group in graph.groups if group.prunable]
+    # the stem and residual channels, the expanded channels and the squeeze of each block, the
+    # head features
+    assert sorted(group.size for group in prunable) == [8, 8, 16, 32, 32, 64]
+    residual = next(group for group in prunable if group.size == 16)
+    assert len([m for m in residual.producers if isinstance(m, nn.Conv2d)]) == 3
+
+    scores = {
+        index: l1_importance(group) for index, group in enumerate(graph.groups) if group.prunable
+    }
+    macs = graph.macs()
+    for index, keep in select_channels(graph, scores, 0.5 * macs, min_channels=4).items():
+        prune_group(graph.groups[index], keep)
+    assert graph.macs() <= 0.5 * macs
+    assert trace_channels(net, x).macs() == graph.macs()
+    assert net(x).shape == (2, 68, 2)
+
+    full = Net().eval()
+    resize_to_state_dict(full, net.state_dict())
+    full.load_state_dict(net.state_dict())
+    assert torch.equal(full(x), net(x))
+
+
+def test_pruned_checkpoint_quantizes() -> None:
+    """Tests that a pruned checkpoint loads the way `src/quantize.py` loads it and quantizes."""
+    torch.manual_seed(0)
+    x = torch.randn(2, 3, 32, 32)
+    pruned = DLIBLitModule(Net(), optimizer=None, scheduler=None).eval()
+    graph = trace_channels(pruned.net, x)
+    scores = {
+        index: l1_importance(group) for index, group in enumerate(graph.groups) if group.prunable
+    }
+    for index, keep in select_channels(graph, scores, 0.5 * graph.macs(), min_channels=4).items():
+        prune_group(graph.groups[index], keep)
+    checkpoint = {"state_dict": pruned.state_dict(), "hyper_parameters": dict(pruned.hparams)}
+
+    model = DLIBLitModule(Net(), optimizer=None, scheduler=None).eval()
+    model.on_load_checkpoint(checkpoint)
+    model.load_state_dict(checkpoint["state_dict"])
+    quantized = quantize_static(model.net, [x], x)
+    with torch.no_grad():
+        assert quantized(x).shape == (2, 68, 2)
+
+
+def test_channel_pruning_rejects_ddp() -> None:
+    """Tests that pruning refuses multi-process training, whose wrapper keeps the old layers."""
+    callback = ChannelPruning()
+    callback.setup(SimpleNamespace(world_size=1), None, "fit")
+    with pytest.raises(RuntimeError, match="single device"):
+        callback.setup(SimpleNamespace(world_size=2, strategy=DDPStrategy()), None, "fit")
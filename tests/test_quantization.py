@@ -0,0 +1,80 @@
+import torch
+from torch import nn
+from torch.ao.nn.intrinsic.qat import freeze_bn_stats
+from torch.ao.quantization import disable_observer
+
+from src.models.components.quantization import (
+    convert_int8,
+    evaluate_landmarks,
+    prepare_qat,
+    quantize_static,
+)
+from src.models.dlib_module import DLIBLitModule
+
+
+class TinyNet(nn.Module):
+    def __init__(self) -> None:
+        super().__init__()
+        self.features = nn.Sequential(
+            nn.Conv2d(3, 8, 3, 2), nn.BatchNorm2d(8), nn.ReLU(), nn.AdaptiveAvgPool2d(1)
+        )
+        self.head = nn.Linear(8, 68 * 2)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        return self.head(self.features(x).flatten(1)).view(-1, 68, 2)
+
+
+def test_quantize_static() -> None:
+    """Tests that post-training quantization fuses Conv+BN+ReLU into int8 kernels and stays close
+    to the float network."""
+    torch.manual_seed(0)
+    net = TinyNet().eval()
+    calibration = [torch.randn(4, 3, 32, 32) for _ in range(4)]
+    quantized = quantize_static(net, calibration, calibration[0])
+
+    kinds = {type(module).__name__ for module in quantized.modules()}
+    assert "ConvReLU2d" in kinds and "BatchNorm2d" not in kinds
+
+    x = calibration[0]
+    with torch.no_grad():
+        assert (quantized(x) - net(x)).abs().max() < 0.05
+
+    batches = [(x, torch.rand(4, 68, 2) - 0.5)]
+    results = evaluate_landmarks(quantized, batches, normalize=lambda images: images)
+    assert {"nme", "fr@0.10", "auc@0.10", "nme_jaw"} <= results.keys()
+
+
+def test_prepare_qat() -> None:
+    """Tests that QAT trains through fake quantization, freezes BN and observers, and converts."""
+    torch.manual_seed(0)
+    x = torch.randn(4, 3, 32, 32)
+    prepared = prepare_qat(TinyNet(), x)
+    prepared(x).abs().mean().backward()
+
+    prepared.apply(freeze_bn_stats)
+    prepared.apply(disable_observer)
+    fused = next(module for module in prepared.modules() if hasattr(module, "freeze_bn"))
+    assert fused.freeze_bn and not fused.bn.training
+    assert all(
+        not module.observer_enabled
+        for module in prepared.modules()
+        if hasattr(module, "observer_enabled")
+    )
+
+    quantized = convert_int8(prepared)
+    assert prepared.training
+    with torch.no_grad():
+        assert quantized(x).shape == (4, 68, 2)
+
+
+def test_qat_checkpoint_loads_without_qat_config() -> None:
+    """Tests that a QAT checkpoint loads into a module built without `qat`, as in `src/eval.py`."""
+    qat = {"backend": "x86", "input_size": 32}
+    model = DLIBLitModule(TinyNet(), optimizer=None, scheduler=None, qat=qat)
+    model.setup("fit")
+    checkpoint = {"state_dict": model.state_dict(), "hyper_parameters": dict(model.hparams)}
+
+    float_model = DLIBLitModule(TinyNet(), optimizer=None, scheduler=None)
+    float_model.on_load_checkpoint(checkpoint)
+    float_model.load_state_dict(checkpoint["state_dict"])
+    assert float_model.qat_prepared and float_model.hparams.qat == qat
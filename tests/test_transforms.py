@@ -0,0 +1,165 @@
+from unittest import mock
+
+import albumentations as A
+import numpy as np
+import pytest
+import torch
+from albumentations.pytorch.transforms import ToTensorV2
+
+from src.data.components.batch_augment import FLIP_PERMUTATION_68, BatchAugment
+from src.data.components.fused_affine import FusedAffine
+from src.data.components.transport import strip_normalize, uint8_collate
+
+
+def smooth_image(height: int, width: int) -> np.ndarray:
+    """A low-frequency RGB image, so resampling it once or four times gives close pixels."""
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    channels = [
+        np.sin(x / 23.0) + np.cos(y / 17.0),
+        np.sin((x + y) / 29.0),
+        np.cos((x - 2 * y) / 31.0),
+    ]
+    return ((np.stack(channels, axis=-1) + 2) * 60).astype(np.uint8)
+
+
+@pytest.mark.parametrize("hflip,vflip", [(False, False), (True, False), (True, True)])
+def test_fused_affine(hflip: bool, vflip: bool) -> None:
+    """Tests that `FusedAffine` matches the sequential albumentations pipeline it replaces.
+
+    :param hflip: Whether to flip horizontally.
+    :param vflip: Whether to flip vertically.
+    """
+    rng = np.random.default_rng(0)
+    image = smooth_image(300, 320)
+    keypoints = [tuple(point) for point in rng.uniform(80, 220, size=(68, 2))]
+    angle, scale, dx, dy, extra_angle = 7.0, 1.04, 0.03, -0.02, 20.0
+
+    sequential = A.Compose(
+        [
+            A.ShiftScaleRotate(
+                shift_limit_x=(dx, dx),
+                shift_limit_y=(dy, dy),
+                scale_limit=(scale - 1, scale - 1),
+                rotate_limit=(angle, angle),
+                p=1.0,
+            ),
+            A.Resize(256, 256),
+            A.CenterCrop(224, 224),
+            A.HorizontalFlip(p=float(hflip)),
+            A.VerticalFlip(p=float(vflip)),
+            A.Rotate(limit=(extra_angle, extra_angle), p=1.0),
+        ],
+        keypoint_params=A.KeypointParams(format="xy", remove_invisible=False),
+    )
+    expected = sequential(image=image, keypoints=keypoints)
+
+    fused = FusedAffine()
+    params = {"angle": angle, "scale": scale, "dx": dx, "dy": dy, "extra_angle": extra_angle}
+    params.update(hflip=hflip, vflip=vflip, rows=image.shape[0], cols=image.shape[1])
+    fused_image = fused.apply(image, **params)
+    fused_keypoints = fused.apply_to_keypoints([(x, y, 0.0, 1.0) for x, y in keypoints], **params)
+
+    assert fused_image.shape == expected["image"].shape == (224, 224, 3)
+    # the borders are reflected at different stages, compare the inside of the face crop
+    difference = np.abs(fused_image.astype(np.float32) - expected["image"].astype(np.float32))
+    assert difference[32:-32, 32:-32].mean() < 1.0
+    # `Resize` scales keypoints about the image corner, the fused warp about the pixel centers
+    points = np.array([keypoint[:2] for keypoint in fused_keypoints])
+    assert np.allclose(points, np.array(expected["keypoints"]), atol=0.25)
+
+
+def blob_images(keypoints: torch.Tensor, height: int, width: int) -> torch.Tensor:
+    """(B, 3, H, W) uint8 images with a Gaussian blob at the first keypoint of every sample."""
+    centers = (keypoints[:, 0] + 0.5) * keypoints.new_tensor([width, height]) - 0.5
+    y, x = torch.meshgrid(torch.arange(height), torch.arange(width), indexing="ij")
+    distance = (x - centers[:, 0, None, None]) ** 2 + (y - centers[:, 1, None, None]) ** 2
+    blob = torch.exp(-distance / (2 * 2.0**2))
+    return (blob[:, None].expand(-1, 3, -1, -1) * 255).round().to(torch.uint8)
+
+
+def blob_centers(images: torch.Tensor) -> torch.Tensor:
+    """(B, 2) intensity-weighted center of the blob of every image, in `[-0.5, 0.5]`."""
+    weights = images[:, 0].float()
+    height, width = weights.shape[1:]
+    y, x = torch.meshgrid(torch.arange(height), torch.arange(width), indexing="ij")
+    total = weights.sum(dim=(1, 2))
+    centers = torch.stack([(weights * x).sum(dim=(1, 2)), (weights * y).sum(dim=(1, 2))], dim=1)
+    return (centers / total[:, None] + 0.5) / torch.tensor([width, height]) - 0.5
+
+
+def test_batch_augment_flip() -> None:
+    """Tests that a horizontal flip mirrors the image and keypoints and swaps left and right."""
+    torch.manual_seed(0)
+    images = torch.randint(0, 256, (4, 3, 48, 64), dtype=torch.uint8)
+    keypoints = torch.rand(4, 68, 2) - 0.5
+    augment = BatchAugment(affine_p=0.0, hflip_p=1.0, color_p=0.0)
+
+    out_images, out_keypoints = augment(images, keypoints)
+    assert out_images.dtype == torch.uint8
+    assert torch.equal(out_images, images.flip(dims=[3]))
+    # pixel x -> width - 1 - x, so the mirrored normalized x is -x - 1 / width
+    mirrored = torch.stack([-keypoints[..., 0] - 1 / 64, keypoints[..., 1]], dim=-1)
+    permutation = list(FLIP_PERMUTATION_68)
+    assert torch.allclose(out_keypoints, mirrored[:, permutation], atol=1e-5)
+    # the outer corner of the right eye takes the place of the one of the left eye
+    assert torch.allclose(out_keypoints[:, 36], mirrored[:, 45], atol=1e-5)
+    assert torch.allclose(out_keypoints[:, 48], mirrored[:, 54], atol=1e-5)
+
+
+def test_batch_augment_affine() -> None:
+    """Tests that the warped images and keypoints stay consistent under the random affine."""
+    torch.manual_seed(0)
+    # keep the blobs away from the borders, where the reflection padding would shift them
+    keypoints = (torch.rand(8, 68, 2) - 0.5) * 0.3
+    images = blob_images(keypoints, 48, 64)
+    augment = BatchAugment(
+        degrees=30.0, translate=0.1, scale=(0.8, 1.2), affine_p=1.0, hflip_p=0.0, color_p=0.0
+    )
+    normalized = (images.float() / 255 - augment.mean) / augment.std
+
+    for batch in (images, normalized):
+        torch.manual_seed(1)
+        out_images, out_keypoints = augment(batch, keypoints)
+        assert out_images.dtype == batch.dtype and out_images.shape == batch.shape
+        if batch.is_floating_point():
+            out_images = ((out_images * augment.std + augment.mean) * 255).clamp(0, 255)
+        pixels = (blob_centers(out_images) - out_keypoints[:, 0]) * torch.tensor([64, 48])
+        assert pixels.abs().max() < 0.5
+
+
+def test_strip_normalize() -> None:
+    """Tests that stripping `Normalize` keeps the other steps and makes `ToTensorV2` emit uint8."""
+    transform = A.Compose(
+        [A.HorizontalFlip(p=1.0), A.Normalize(), ToTensorV2()],
+        keypoint_params=A.KeypointParams(format="xy", remove_invisible=False),
+    )
+    image = smooth_image(32, 48)
+    stripped = strip_normalize(transform)
+    assert [type(t) for t in stripped.transforms] == [A.HorizontalFlip, ToTensorV2]
+
+    out = stripped(image=image, keypoints=[(10.0, 20.0)])
+    assert out["image"].dtype == torch.uint8
+    assert torch.equal(out["image"], torch.from_numpy(image[:, ::-1].copy()).permute(2, 0, 1))
+    assert out["keypoints"] == [(37.0, 20.0)]
+
+
+@pytest.mark.parametrize("in_worker", [False, True])
+def test_uint8_collate(in_worker: bool) -> None:
+    """Tests that `uint8_collate` stacks uint8 images and float32 landmarks, in shared memory
+    inside a DataLoader worker.
+
+    :param in_worker: Whether to collate as inside a DataLoader worker.
+    """
+    batch = [
+        (torch.randint(0, 256, (3, 8, 8), dtype=torch.uint8), np.random.rand(68, 2))
+        for _ in range(4)
+    ]
+    worker_info = object() if in_worker else None
+    with mock.patch("src.data.components.transport.get_worker_info", return_value=worker_info):
+        images, landmarks = uint8_collate(batch)
+
+    assert images.dtype == torch.uint8 and images.shape == (4, 3, 8, 8)
+    assert torch.equal(images, torch.stack([image for image, _ in batch]))
+    assert images.is_shared() == in_worker
+    assert landmarks.dtype == torch.float32
+    assert np.allclose(landmarks.numpy(), np.stack([landmark for _, landmark in batch]))